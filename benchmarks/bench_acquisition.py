@@ -0,0 +1,203 @@
+"""Latency and throughput benchmark of the acquisition path, on simulated devices.
+
+Drives BLE notification -> engine.handle_bike_data (display listeners, Lorenz fusion)
+-> DataProcessor.record -> session writer -> disk at each rate, then measures
+plan-step dispatch (scheduler deadline -> set_brake_power issued on the BLE loop).
+Results are saved as JSON so releases can be compared.
+
+    python benchmarks/bench_acquisition.py --rates 4 20 100 500 --duration 10
+    python benchmarks/bench_acquisition.py --find-max
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic.simulators import SIMULATED_ADDRESS, create_simulated_engine  # noqa: E402
+
+
+def percentiles(values, points=(50, 90, 99, 99.9)):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{p:g}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+    result["max"] = ordered[-1]
+    result["mean"] = sum(ordered) / len(ordered)
+    return result
+
+
+class TimingSink:
+    """SessionWriter sink that records, per row, the delay between the sample time and its write."""
+
+    filename = "<timing>"
+
+    def __init__(self):
+        self.delays_ms = []
+
+    def write_rows(self, items):
+        now = time.monotonic_ns()
+        self.delays_ms.extend((now - sample.t_ns) / 1e6 for sample in items)
+
+    def flush(self):
+        pass
+
+    def fsync(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run_rate(rate_hz, duration, with_lorenz=True):
+    engine = create_simulated_engine(ftms_rate_hz=rate_hz, jitter=0.0)
+    timing_sink = TimingSink()
+    engine.data_processor.start()
+    engine.data_processor.writer.sinks.append(timing_sink)
+    ingest_ms, fusion_ms = [], []
+
+    handle_bike_data = engine.handle_bike_data
+
+    def timed_handle_bike_data(bike_data):
+        t0 = time.perf_counter()
+        handle_bike_data(bike_data)
+        ingest_ms.append(1000 * (time.perf_counter() - t0))
+    engine.handle_bike_data = timed_handle_bike_data
+
+    record = engine.fusion.emit if engine.fusion is not None else None
+
+    def timed_record(sample):
+        fusion_ms.append((time.monotonic_ns() - sample.t_ns) / 1e6)
+        record(sample)
+    if engine.fusion is not None:
+        engine.fusion.emit = timed_record
+    engine.add_data_listener(lambda bike_data: None)  # stands in for the display listener
+
+    engine.connect_ble(SIMULATED_ADDRESS)
+    if with_lorenz:
+        engine.connect_lorenz()
+    max_backlog = 0
+    cpu0, t0 = time.process_time(), time.monotonic()
+    engine.enable_data().result()
+    while time.monotonic() - t0 < duration:
+        time.sleep(0.05)
+        max_backlog = max(max_backlog, engine.data_processor.writer.backlog())
+    final_backlog = engine.data_processor.writer.backlog()
+    engine.disable_data().result()
+    elapsed = time.monotonic() - t0
+    cpu = time.process_time() - cpu0
+    samples = len(ingest_ms)
+    csv_filename = engine.data_processor.csv_filename
+    engine.close()
+    size = os.path.getsize(csv_filename)
+    achieved = samples / elapsed
+    return {
+        "target_hz": rate_hz,
+        "achieved_hz": achieved,
+        "samples": samples,
+        "latency_ms": {
+            "ingest": percentiles(ingest_ms),
+            "fusion_wait": percentiles(fusion_ms),
+            "sample_to_disk": percentiles(timing_sink.delays_ms),
+        },
+        "writer": engine.data_processor.writer_stats(),
+        "max_backlog": max_backlog,
+        "final_backlog": final_backlog,
+        "bytes_per_hour": size / elapsed * 3600,
+        "cpu_ms_per_sample": 1000 * cpu / samples if samples else None,
+        "sustained": achieved >= 0.95 * rate_hz and final_backlog <= max(10, rate_hz * 0.5),
+    }
+
+
+def run_plan_dispatch(steps=200, step_time=0.02):
+    engine = create_simulated_engine(jitter=0.0)
+    issued = []
+    ble = engine.ble_manager
+    set_brake_power = ble.set_brake_power
+
+    async def timed_set_brake_power(power):
+        issued.append((int(power), time.monotonic()))
+        await set_brake_power(power)
+    ble.set_brake_power = timed_set_brake_power
+    engine.connect_ble(SIMULATED_ADDRESS)
+
+    done = threading.Event()
+    scheduler = engine.start_plan([("potenza", i, step_time, None) for i in range(steps)],
+                                  on_finished=lambda completed: done.set())
+    done.wait(steps * step_time + 30)
+    engine.close()
+    latencies = []
+    for index, t_issued in issued:
+        timing = scheduler.timings[index]
+        latencies.append(1000 * (t_issued - (scheduler.start_monotonic + timing.actual)))
+    return {
+        "steps": steps,
+        "step_time_s": step_time,
+        "issued": len(issued),
+        "step_to_brake_ms": percentiles(latencies),
+        "scheduler": scheduler.jitter_stats(),
+    }
+
+
+def find_max_rate(duration, start=500, limit=16000):
+    rate, best = start, None
+    while rate <= limit:
+        result = run_rate(rate, duration)
+        print(f"  {rate} Hz: {result['achieved_hz']:.0f} Hz ottenuti, backlog finale {result['final_backlog']}")
+        if not result["sustained"]:
+            break
+        best = rate
+        rate *= 2
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del percorso di acquisizione su dispositivi simulati")
+    parser.add_argument("--rates", type=float, nargs="+", default=[4, 20, 100, 500])
+    parser.add_argument("--duration", type=float, default=10.0, help="Durata per frequenza [s]")
+    parser.add_argument("--plan-steps", type=int, default=200)
+    parser.add_argument("--find-max", action="store_true", help="Cerca la massima frequenza sostenibile")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    output_file = os.path.join(os.path.abspath(args.output),
+                               f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_acquisition.json")
+    report = {"date": datetime.now().isoformat(), "python": sys.version, "platform": platform.platform(),
+              "duration_s": args.duration, "rates": []}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # DataProcessor writes sessions in ./output
+        try:
+            for rate in args.rates:
+                print(f"Frequenza {rate:g} Hz...")
+                report["rates"].append(run_rate(rate, args.duration))
+            print("Dispatch passi del piano...")
+            report["plan_dispatch"] = run_plan_dispatch(args.plan_steps)
+            if args.find_max:
+                print("Ricerca frequenza massima sostenibile...")
+                report["max_sustainable_hz"] = find_max_rate(min(args.duration, 5.0))
+        finally:
+            os.chdir(cwd)
+
+    with open(output_file, "w") as file:
+        json.dump(report, file, indent=2)
+    for result in report["rates"]:
+        disk = result["latency_ms"]["sample_to_disk"]
+        print(f"{result['target_hz']:>6g} Hz: ottenuti {result['achieved_hz']:.1f} Hz, "
+              f"ingest p99 {result['latency_ms']['ingest'].get('p99', 0):.3f} ms, "
+              f"disco p99 {disk.get('p99', 0):.1f} ms, {result['bytes_per_hour'] / 1e6:.1f} MB/h, "
+              f"CPU {result['cpu_ms_per_sample'] or 0:.3f} ms/campione")
+    print(f"Dispatch piano p99: {report['plan_dispatch']['step_to_brake_ms'].get('p99', 0):.2f} ms")
+    print(f"Risultati salvati in {output_file}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
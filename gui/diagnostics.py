@@ -0,0 +1,85 @@
+import time
+from tkinter import ttk
+
+COLUMNS = (("Metrica", 240), ("Etichette", 120), ("Valore", 90), ("Al secondo", 90), ("p50 [ms]", 80),
+           ("p95 [ms]", 80), ("p99 [ms]", 80))
+
+
+def _format(value, digits=2):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+class DiagnosticsPanel(ttk.Frame):
+    """Table of the engine metrics (logic.metrics), refreshed every `interval_ms` while visible.
+
+    Counters show their total and rate since the previous refresh, histograms their observation
+    rate and p50/p95/p99 in ms. Rows are created once per metric and only changed cells are redrawn.
+    """
+
+    def __init__(self, master, registry, interval_ms=1000, **kwargs):
+        super().__init__(master, **kwargs)
+        self.registry = registry
+        self.interval_ms = interval_ms
+        self.after_id = None
+        self.items = {}  # chiave metrica -> item del Treeview
+        self.shown = {}
+        self.previous = {}  # chiave -> (istante, conteggio) per il calcolo delle frequenze
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        self.tree = ttk.Treeview(self, columns=[name for name, _ in COLUMNS], show='headings', selectmode='none',
+                                 height=8)
+        for name, width in COLUMNS:
+            self.tree.heading(name, text=name)
+            self.tree.column(name, width=width, anchor="w" if name in ("Metrica", "Etichette") else "e")
+        self.tree.grid(row=0, column=0, sticky="nsew", padx=(10, 0), pady=10)
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
+        scrollbar.grid(row=0, column=1, sticky="ns", pady=10)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+
+    def start(self):
+        if self.after_id is None:
+            self.after_id = self.after(self.interval_ms, self._frame)
+
+    def stop(self):
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+
+    def _frame(self):
+        self.after_id = self.after(self.interval_ms, self._frame)
+        if self.winfo_viewable():
+            self.refresh()
+
+    def refresh(self):
+        now = time.monotonic()
+        for name, labels, metric in self.registry.items():
+            key = (name, tuple(sorted(labels.items())))
+            label_text = ", ".join(f"{k}={v}" for k, v in labels.items() if k != "rig")
+            try:
+                value = metric.get()
+            except Exception:
+                continue
+            if metric.kind == "histogram":
+                count = value["count"]
+                quantiles = [_format(None if value[q] is None else 1000 * value[q], 3) for q in ("p50", "p95", "p99")]
+                row = (name, label_text, count, self._rate(key, now, count), *quantiles)
+            elif metric.kind == "counter":
+                row = (name, label_text, _format(value), self._rate(key, now, value), "", "", "")
+            else:
+                row = (name, label_text, _format(value), "", "", "", "")
+            if key not in self.items:
+                self.items[key] = self.tree.insert("", "end", values=row)
+            elif self.shown.get(key) != row:
+                self.tree.item(self.items[key], values=row)
+            self.shown[key] = row
+
+    def _rate(self, key, now, count):
+        previous = self.previous.get(key)
+        self.previous[key] = (now, count)
+        if previous is None or now <= previous[0] or count is None:
+            return ""
+        return _format((count - previous[1]) / (now - previous[0]), 1)
@@ -0,0 +1,85 @@
+import threading
+import tkinter as tk
+
+
+def format_value(value):
+    return str(value)
+
+
+def format_lorenz_value(value):
+    return f"{value:.2f}" if isinstance(value, (int, float)) else "N/A"
+
+
+class DisplayRefresher:
+    """Latest-value display layer for read-only Entry widgets.
+
+    update() can be called from any thread and only stores the newest value per key.
+    The Tk thread redraws at a fixed frame rate and touches only the widgets whose text changed.
+    Counters: `merged` values overwritten before being drawn, `dropped` values for unbound keys,
+    `unchanged` redraws skipped because the text was identical.
+    """
+
+    def __init__(self, root, fps=10):
+        self.root = root
+        self.interval_ms = int(1000 / fps)
+        self.entries = {}  # key -> (entry, formatter)
+        self.texts = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.received = 0
+        self.merged = 0
+        self.dropped = 0
+        self.unchanged = 0
+        self.drawn = 0
+        self.frames = 0
+        self.after_id = None
+
+    def bind(self, key, entry, formatter=format_value):
+        self.entries[key] = (entry, formatter)
+
+    def update(self, values, skip_none=False):
+        with self.lock:
+            for key, value in values.items():
+                if skip_none and value is None:
+                    continue
+                self.received += 1
+                if key not in self.entries:
+                    self.dropped += 1
+                    continue
+                if key in self.pending:
+                    self.merged += 1
+                self.pending[key] = value
+
+    def start(self):
+        if self.after_id is None:
+            self.after_id = self.root.after(self.interval_ms, self._frame)
+
+    def stop(self):
+        if self.after_id is not None:
+            self.root.after_cancel(self.after_id)
+            self.after_id = None
+
+    def _frame(self):
+        self.redraw()
+        self.after_id = self.root.after(self.interval_ms, self._frame)
+
+    def redraw(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        self.frames += 1
+        for key, value in pending.items():
+            entry, formatter = self.entries[key]
+            text = formatter(value)
+            if self.texts.get(key) == text:
+                self.unchanged += 1
+                continue
+            self.texts[key] = text
+            entry.config(state='normal')
+            entry.delete(0, tk.END)
+            entry.insert(0, text)
+            entry.config(state='readonly')
+            self.drawn += 1
+
+    def stats(self):
+        return {"received": self.received, "drawn": self.drawn, "merged": self.merged, "dropped": self.dropped,
+                "unchanged": self.unchanged, "frames": self.frames}
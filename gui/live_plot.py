@@ -0,0 +1,152 @@
+import tkinter as tk
+from tkinter import ttk
+
+PLOT_FIELDS = ["power", "power_lorenz", "cadence", "speed", "torque_lorenz"]
+# Pannelli del grafico: titolo e serie con la stessa scala
+PANELS = [("Potenza [W]", ["power", "power_lorenz"]),
+          ("Cadenza [rpm] / Velocità [km/h] / Coppia [Nm]", ["cadence", "speed", "torque_lorenz"])]
+COLORS = {"power": "#1f77b4", "power_lorenz": "#d62728", "cadence": "#2ca02c", "speed": "#ff7f0e",
+          "torque_lorenz": "#9467bd"}
+LABELS = {"power": "Potenza FTMS", "power_lorenz": "Potenza Lorenz", "cadence": "Cadenza", "speed": "Velocità",
+          "torque_lorenz": "Coppia Lorenz"}
+WINDOWS = {"1 min": 60, "5 min": 300, "15 min": 900, "Sessione": None}
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 45, 10, 18, 16
+
+
+class LivePlot(ttk.Frame):
+    """Live chart of a logic.live_series.LiveSeries on Tk canvases.
+
+    Redraws run on the Tk thread at `fps` and only when new samples arrived (or the view
+    changed); each line is a persistent canvas item whose coordinates are replaced, with at
+    most two points per horizontal pixel pair, so the cost is bounded by the canvas width
+    and independent of the sample rate and the session length. Nothing is drawn while the
+    chart is not visible.
+    """
+
+    def __init__(self, master, series, fps=2, **kwargs):
+        super().__init__(master, **kwargs)
+        self.series = series
+        self.interval_ms = int(1000 / fps)
+        self.after_id = None
+        self.drawn_state = None
+        self.frames = 0
+        self.drawn = 0
+
+        controls = ttk.Frame(self)
+        controls.grid(row=0, column=0, sticky="ew", padx=5)
+        self.window = tk.StringVar(value="5 min")
+        ttk.Label(controls, text="Finestra:").pack(side="left")
+        ttk.Combobox(controls, textvariable=self.window, values=list(WINDOWS), state="readonly",
+                     width=9).pack(side="left", padx=(2, 10))
+        self.visible = {}
+        for field in PLOT_FIELDS:
+            self.visible[field] = tk.BooleanVar(value=True)
+            tk.Checkbutton(controls, text=LABELS[field], fg=COLORS[field], variable=self.visible[field],
+                           command=self.redraw).pack(side="left")
+        self.window.trace_add("write", lambda *args: self.redraw())
+
+        self.grid_columnconfigure(0, weight=1)
+        self.canvases = []
+        for row, (title, fields) in enumerate(PANELS, start=1):
+            self.grid_rowconfigure(row, weight=1)
+            canvas = tk.Canvas(self, background="white", height=90, highlightthickness=0)
+            canvas.grid(row=row, column=0, sticky="nsew", padx=5, pady=2)
+            items = {
+                "title": canvas.create_text(MARGIN_LEFT, 2, anchor="nw", text=title, font=("TkDefaultFont", 8)),
+                "frame": canvas.create_rectangle(0, 0, 0, 0, outline="grey"),
+                "y_max": canvas.create_text(MARGIN_LEFT - 3, 0, anchor="ne", font=("TkDefaultFont", 8)),
+                "y_min": canvas.create_text(MARGIN_LEFT - 3, 0, anchor="se", font=("TkDefaultFont", 8)),
+                "x_left": canvas.create_text(MARGIN_LEFT, 0, anchor="nw", font=("TkDefaultFont", 8)),
+                "x_right": canvas.create_text(0, 0, anchor="ne", font=("TkDefaultFont", 8)),
+                "lines": {field: canvas.create_line(0, 0, 0, 0, fill=COLORS[field], state="hidden")
+                          for field in fields},
+            }
+            canvas.bind("<Configure>", lambda event: self.redraw())
+            self.canvases.append((canvas, fields, items))
+
+    def start(self):
+        if self.after_id is None:
+            self.after_id = self.after(self.interval_ms, self._frame)
+
+    def stop(self):
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+            self.after_id = None
+
+    def stats(self):
+        return {"frames": self.frames, "drawn": self.drawn}
+
+    def _frame(self):
+        self.after_id = self.after(self.interval_ms, self._frame)
+        self.frames += 1
+        if self.series.version != self.drawn_state:
+            self.redraw()
+
+    def redraw(self):
+        if not self.winfo_viewable():
+            return
+        self.drawn_state = self.series.version
+        self.drawn += 1
+        window_s = WINDOWS.get(self.window.get())
+        width = max(canvas.winfo_width() for canvas, _, _ in self.canvases)
+        buckets = max(1, (width - MARGIN_LEFT - MARGIN_RIGHT) // 2)
+        if window_s is None:
+            data = {field: [(t, low) for t, low, _ in points] + [(t, high) for t, _, high in points]
+                    for field, points in self.series.overview().items()}
+            # Envelope drawn as a zigzag between min and max of each slot, in time order
+            data = {field: sorted(points, key=lambda point: point[0]) for field, points in data.items()}
+        else:
+            data = self.series.recent(window_s, buckets)
+        times = [points[-1][0] for points in data.values() if points]
+        if not times:
+            return
+        t_end = max(times)
+        if window_s is None:
+            t_start = min(points[0][0] for points in data.values() if points)
+        else:
+            t_start = t_end - int(window_s * 1e9)
+        span = max(t_end - t_start, 1)
+        for canvas, fields, items in self.canvases:
+            self._draw_panel(canvas, fields, items, data, t_start, span)
+
+    def _draw_panel(self, canvas, fields, items, data, t_start, span):
+        width, height = canvas.winfo_width(), canvas.winfo_height()
+        x0, x1 = MARGIN_LEFT, width - MARGIN_RIGHT
+        y0, y1 = MARGIN_TOP, height - MARGIN_BOTTOM
+        if x1 <= x0 or y1 <= y0:
+            return
+        shown = [field for field in fields if self.visible[field].get() and len(data.get(field, ())) >= 2]
+        values = [value for field in shown for _, value in data[field]]
+        low, high = (min(values), max(values)) if values else (0.0, 1.0)
+        if high - low < 1e-9:
+            low, high = low - 1, high + 1
+        pad = 0.05 * (high - low)
+        low, high = low - pad, high + pad
+        x_scale = (x1 - x0) / span
+        y_scale = (y1 - y0) / (high - low)
+        for field in fields:
+            line = items["lines"][field]
+            if field not in shown:
+                canvas.itemconfigure(line, state="hidden")
+                continue
+            coords = []
+            for t, value in data[field]:
+                coords.append(x0 + (t - t_start) * x_scale)
+                coords.append(y1 - (value - low) * y_scale)
+            canvas.coords(line, coords)
+            canvas.itemconfigure(line, state="normal")
+        canvas.coords(items["frame"], x0, y0, x1, y1)
+        canvas.coords(items["y_max"], x0 - 3, y0)
+        canvas.itemconfigure(items["y_max"], text=f"{high:.0f}")
+        canvas.coords(items["y_min"], x0 - 3, y1)
+        canvas.itemconfigure(items["y_min"], text=f"{low:.0f}")
+        canvas.coords(items["x_left"], x0, y1 + 1)
+        canvas.itemconfigure(items["x_left"], text=f"-{self._format_span(span)}")
+        canvas.coords(items["x_right"], x1, y1 + 1)
+        canvas.itemconfigure(items["x_right"], text="ora")
+
+    @staticmethod
+    def _format_span(span_ns):
+        seconds = int(span_ns / 1e9)
+        hours, rest = divmod(seconds, 3600)
+        return f"{hours}h{rest // 60:02d}m" if hours else f"{rest // 60}m{rest % 60:02d}s"
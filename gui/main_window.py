@@ -1,43 +1,99 @@
 import tkinter as tk
 from tkinter import ttk
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import logging
-from shared_lib.bluetooth_manager import AsyncioWorker, BLEManager  # Assuming these are correct
-from shared_lib.LorenzLib import LorenzReader  # Assuming this is correct
-from shared_lib.funzioni_accessorie import trova_porta_usb_serial  # Assuming this is correct
-from shared_lib.modbus_utils import ModbusBancoCollaudo  # Assuming this is correct
+import threading
+from gui.diagnostics import DiagnosticsPanel
+from gui.display import DisplayRefresher, format_lorenz_value
+from gui.live_plot import PLOT_FIELDS, LivePlot
+from gui.plan_view import PlanView
 from logic.data_processing import DataProcessor
+from logic.discovery import DEVICE_STALE_S
+from logic.engine import BenchEngine
+from logic.live_series import LiveSeries
+from logic.startup import STARTUP, created
 from tkinter import filedialog
 
+PLAN_POLL_MS = 100  # Aggiornamento del passo corrente nella tabella del piano
+
 
 class TextHandler(logging.Handler):
-    """Custom logging handler that sends log messages to a Tkinter Text widget."""
+    """Custom logging handler that sends log messages to a Tkinter Text widget.
+
+    emit() may run on any thread and only appends to a bounded buffer; lines are applied to the
+    widget in batches on the Tk thread and the widget keeps at most `max_lines` lines.
+    Must be created on the Tk thread.
+    """
 
-    def __init__(self, text_widget):
+    def __init__(self, text_widget, max_lines=2000, interval_ms=200):
         super().__init__()
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.lines = deque(maxlen=max_lines)
+        self.lines_lock = threading.Lock()
+        self.discarded = 0  # righe mai mostrate perché superate da righe più recenti
+        self.widget_lines = 0
+        self.after_id = self.text_widget.after(self.interval_ms, self._flush)
 
     def emit(self, record):
         msg = self.format(record)
-        self.text_widget.config(state='normal')
-        self.text_widget.insert(tk.END, msg + '\n')
-        self.text_widget.config(state='disabled')
-        self.text_widget.yview(tk.END)
+        with self.lines_lock:
+            if len(self.lines) == self.max_lines:
+                self.discarded += 1
+            self.lines.append(msg)
+
+    def _flush(self):
+        with self.lines_lock:
+            batch = list(self.lines)
+            self.lines.clear()
+        if batch:
+            try:
+                self.text_widget.config(state='normal')
+                self.text_widget.insert(tk.END, '\n'.join(batch) + '\n')
+                self.widget_lines += len(batch)
+                if self.widget_lines > self.max_lines:
+                    excess = self.widget_lines - self.max_lines
+                    self.text_widget.delete('1.0', f'{excess + 1}.0')
+                    self.widget_lines = self.max_lines
+                self.text_widget.config(state='disabled')
+                self.text_widget.yview(tk.END)
+            except tk.TclError:  # Widget destroyed during shutdown
+                return
+        self.after_id = self.text_widget.after(self.interval_ms, self._flush)
 
 
 class MainWindow(tk.Tk):
-    def __init__(self):
+    def __init__(self, engine=None, profile_startup=False, backends=("csv",)):
+        # profile_startup: report the startup phases (logic.startup) once the devices are ready, then quit
+        # backends: formats of the session files when the window builds its own engine
         super().__init__()
+        self.profile_startup = profile_startup
         self.lorenz_update_id = None
         self.title("Total Commander")
         self.geometry("1350x760")
-        self.worker = AsyncioWorker()
-        self.worker.start()
-        self.ble_manager = BLEManager(self.worker)
-        self.data_processor = DataProcessor()
-        self.modbus = ModbusBancoCollaudo()
-        self.executor = ThreadPoolExecutor(max_workers=1)  # Max workers = 1 serializes submitted tasks
+        # The window is a client of the engine, which owns devices, dispatch and recording.
+        # Its devices are built on first use: the window shows before any driver is loaded
+        with STARTUP.phase("init BenchEngine"):
+            self.engine = engine if engine is not None else BenchEngine(backends=backends)
+        self.worker = self.engine.worker
+        self.ble_manager = self.engine.ble_manager
+        self.data_processor = self.engine.data_processor
+        self.modbus = self.engine.modbus
+        self.dispatcher = self.engine.dispatcher
+        self.discovery = self.engine.discovery
+        self.device_addresses = []  # indirizzo di ciascuna riga della lista dispositivi
+        self.device_rows = []  # (testo, colori) mostrati per riga
         self.auto_commands_running = False
+        self.plan_paused_shown = False
+        self.plan_run = None
+        self.plan = []  # Piano compilato caricato (logic.plan.Plan)
+        # Widgets are redrawn by the display layer on the Tk thread, never from the BLE callback
+        self.display = DisplayRefresher(self, fps=10)
+        self.engine.add_data_listener(self.update_data_fields)
+        # Recorded rows (FTMS + Lorenz) feed the chart buffers; the chart redraws on its own timer
+        self.live_series = LiveSeries(PLOT_FIELDS)
+        self.engine.add_record_listener(lambda row, t_ns: self.live_series.push(t_ns, row))
 
         # Frame principale
         self.main_frame = ttk.Frame(self)
@@ -55,7 +111,7 @@ class MainWindow(tk.Tk):
 
         self.device_list = tk.Listbox(self.frame_search)
         self.device_list.grid(row=0, column=0, sticky="nsew", padx=10, pady=5)
-        self.btn_search = ttk.Button(self.frame_search, text="Cerca Dispositivi", command=self.search_devices)
+        self.btn_search = ttk.Button(self.frame_search, text="Ferma Ricerca", command=self.search_devices)
         self.btn_search.grid(row=1, column=0, sticky="ew", padx=10, pady=2)
         self.btn_connect = ttk.Button(self.frame_search, text="Connetti", command=self.connect_device)
         self.btn_connect.grid(row=2, column=0, sticky="ew", padx=10, pady=2)
@@ -80,7 +136,7 @@ class MainWindow(tk.Tk):
         # Frame contenitore per la seconda colonna
         self.middle_left_frame = ttk.Frame(self.main_frame)
         self.middle_left_frame.grid(row=0, column=1, sticky="nsew", padx=5, pady=5)
-        self.middle_left_frame.grid_rowconfigure(0, weight=1)  # Allow commands_table to expand
+        self.middle_left_frame.grid_rowconfigure(0, weight=1)  # Allow the plan view to expand
         self.middle_left_frame.grid_columnconfigure(0, weight=1)
 
         # Frame comandi da CSV
@@ -89,26 +145,9 @@ class MainWindow(tk.Tk):
         self.automatic_commands.grid_rowconfigure(0, weight=1)
         self.automatic_commands.grid_columnconfigure(0, weight=1)
 
-        self.scrollbar = ttk.Scrollbar(self.automatic_commands, orient="vertical")
-        self.scrollbar.grid(row=0, column=1, sticky="ns")
-        self.commands_table = ttk.Treeview(self.automatic_commands,
-                                           columns=("Comando", "Valore", "Tempo [s]", "Vel Banco [km/h]"),
-                                           show='headings',
-                                           yscrollcommand=self.scrollbar.set)
-        self.commands_table.heading("Comando", text="Comando")
-        self.commands_table.heading("Valore", text="Valore")
-        self.commands_table.heading("Tempo [s]", text="Tempo [s]")
-        self.commands_table.heading("Vel Banco [km/h]", text="Vel Banco [km/h]")
-        self.commands_table.column("Comando", width=100)
-        self.commands_table.column("Valore", width=100)
-        self.commands_table.column("Tempo [s]", width=100)
-        self.commands_table.column("Vel Banco [km/h]", width=100)
-        self.commands_table.grid(row=0, column=0, sticky="nsew", padx=(10, 0),
-                                 pady=10)  # padx to prevent overlap with scrollbar
-        self.scrollbar.config(command=self.commands_table.yview)
-        self.commands_table.tag_configure('oddrow', background='lightgrey')
-        self.commands_table.tag_configure('evenrow', background='white')
-        self.commands_table.tag_configure('currentrow', background='yellow')
+        # Only the visible rows exist in Tk, whatever the plan length
+        self.plan_view = PlanView(self.automatic_commands)
+        self.plan_view.grid(row=0, column=0, sticky="nsew")
 
         # Frame per i comandi automatici
         self.frame_auto_commands = ttk.LabelFrame(self.middle_left_frame, text="Comandi automatici")
@@ -137,19 +176,32 @@ class MainWindow(tk.Tk):
         self.create_lorenz_controls()
         self.create_banco_controls()
 
-        # Frame per il log delle attività
-        self.frame_log = ttk.LabelFrame(self, text="Log delle Attività")
-        self.frame_log.grid(row=1, column=0, columnspan=4, sticky="nsew", padx=10, pady=10)
+        # Log delle attività e grafico in tempo reale, su schede
+        self.bottom_tabs = ttk.Notebook(self)
+        self.bottom_tabs.grid(row=1, column=0, columnspan=4, sticky="nsew", padx=10, pady=10)
+        self.frame_log = ttk.Frame(self.bottom_tabs)
         self.frame_log.grid_columnconfigure(0, weight=1)
+        self.bottom_tabs.add(self.frame_log, text="Log delle Attività")
+        self.live_plot = LivePlot(self.bottom_tabs, self.live_series)
+        self.bottom_tabs.add(self.live_plot, text="Grafico")
+        self.diagnostics = DiagnosticsPanel(self.bottom_tabs, self.engine.metrics)
+        self.bottom_tabs.add(self.diagnostics, text="Diagnostica")
         self.log_text = tk.Text(self.frame_log, state='disabled', height=13)
         self.log_text.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
 
+        self.after_idle(self._start_background_init)  # Background scan once the window is drawn
+        self._refresh_device_list()
         self.periodic_connection_check()
+        self.display.start()
+        self.live_plot.start()
+        self.diagnostics.start()
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def create_command_controls(self):
         commands = [("Livello [/200]", self.send_level_command), ("Potenza [W]", self.send_power_command),
-                    ("Simulazione [%]", self.send_simulation_command)]
+                    ("Simulazione [%]", self.send_simulation_command),
+                    ("Potenza Lorenz [W]", self.send_lorenz_power_target),
+                    ("Coppia Lorenz [Nm]", self.send_lorenz_torque_target)]
         self.frame_commands.grid_columnconfigure(0, weight=2)
         self.frame_commands.grid_columnconfigure(1, weight=1)
         self.frame_commands.grid_columnconfigure(2, weight=1)
@@ -160,12 +212,18 @@ class MainWindow(tk.Tk):
             entry.grid(row=i, column=1, padx=5, sticky="ew")
             if "Livello" in label:
                 self.livello_entry = entry
+            elif "Potenza Lorenz" in label:
+                self.potenza_lorenz_entry = entry
+            elif "Coppia Lorenz" in label:
+                self.coppia_lorenz_entry = entry
             elif "Potenza" in label:
                 self.potenza_entry = entry
             elif "Simulazione" in label:
                 self.simulazione_entry = entry
             btn = ttk.Button(self.frame_commands, text="Invia", command=command)
             btn.grid(row=i, column=2, padx=5, sticky="ew")
+        self.closed_loop_status = ttk.Label(self.frame_commands, text="Anello chiuso: inattivo")
+        self.closed_loop_status.grid(row=len(commands), column=0, columnspan=3, padx=5, sticky="w")
 
     def create_data_fields(self):
         fields = ["power", "cadence", "speed", "resistance", "total_distance", "elapsed_time"]
@@ -180,64 +238,125 @@ class MainWindow(tk.Tk):
             entry = ttk.Entry(frame, state='readonly', justify='right')
             entry.grid(row=0, column=1, padx=5)
             self.data_entries[field.lower().replace(" ", "_")] = entry
+            self.display.bind(field.lower().replace(" ", "_"), entry)
         self.btn_toggle_data = ttk.Button(self.data_controls, text="Abilita Dati", command=self.toggle_data)
         self.btn_toggle_data.grid(row=len(fields), column=0, columnspan=2, padx=10, pady=5)
 
+    def _start_background_init(self):
+        STARTUP.mark("finestra visibile")
+        threading.Thread(target=self._init_devices, name="DeviceInit", daemon=True).start()
+
+    def _init_devices(self):
+        # The BLE stack (driver import, asyncio worker) starts here, off the Tk thread
+        try:
+            with STARTUP.phase("avvio ricerca BLE"):
+                self.discovery.start()  # The list fills and updates while the window is open
+        except Exception as e:
+            logging.getLogger().error(f"Avvio della ricerca BLE fallito: {e}")
+        self.after(0, self._on_devices_ready)
+
+    def _on_devices_ready(self):
+        STARTUP.mark("dispositivi pronti")
+        if not self.discovery.is_running():
+            self.btn_search.config(text="Cerca Dispositivi")
+        if self.profile_startup:
+            report = STARTUP.report()
+            logging.getLogger().info(f"Profilo di avvio:\n{report}")
+            try:
+                with open("startup_profile.txt", "w", encoding="utf-8") as file:
+                    file.write(report + "\n")
+            except OSError as e:
+                logging.getLogger().error(f"Impossibile salvare il profilo di avvio: {e}")
+            self.after(500, self.on_closing)
+
     def periodic_connection_check(self):
-        self.worker.run_coroutine(self._async_check_ble_status())
+        if created(self.worker) and created(self.ble_manager):  # Nothing to ask before the BLE stack starts
+            self.worker.run_coroutine(self._async_check_ble_status())
         self._check_and_update_modbus_status()
+        self._update_closed_loop_status()
+        self._refresh_device_list()
         self.after(1000, self.periodic_connection_check)
 
     async def _async_check_ble_status(self):
         try:
-            is_connected = self.ble_manager.get_connection_status()
+            is_connected = self.engine.is_ble_connected()
             self.after(0, self._update_ble_status_ui, is_connected, False)
         except Exception as e:
             logging.getLogger().error(f"Errore durante il controllo dello stato BLE: {e}")
             self.after(0, self._update_ble_status_ui, None, True)
 
     def _update_ble_status_ui(self, is_connected, error=False):
-        if error:
+        if self.engine.supervisor.state("ftms") == "riconnessione":
+            self.connection_status.config(text="Riconnessione...", fg="orange")
+        elif error:
             self.connection_status.config(text="Errore BLE", fg="orange")
         elif is_connected:
             self.connection_status.config(text="Connesso", fg="green")
         else:
             self.connection_status.config(text="Non Connesso", fg="red")
 
+    def _update_closed_loop_status(self):
+        stats = self.engine.closed_loop_stats()
+        if stats is None:
+            self.closed_loop_status.config(text="Anello chiuso: inattivo")
+        else:
+            kind, actuator = self.engine.closed_loop_mode
+            self.closed_loop_status.config(
+                text=f"Anello chiuso ({kind}/{actuator}): obiettivo {stats['target']}, uscita {stats['output']}")
+
     def _check_and_update_modbus_status(self):
-        if self.modbus.is_connesso():
+        if self.engine.is_modbus_connected():
             self.btn_connect_banco.config(text="Disconnetti")
             self.banco_status.config(text="Connesso", fg="green")
+        elif self.engine.bench.is_connecting():
+            self.btn_connect_banco.config(text="Annulla")
+            self.banco_status.config(text="Connessione...", fg="orange")
         else:
             self.btn_connect_banco.config(text="Connetti")
             self.banco_status.config(text="Non Connesso", fg="red")
 
     def search_devices(self):
-        logging.getLogger().info("Richiesta ricerca dispositivi")
-        self.progress.start()
-        self.btn_search.config(state=tk.DISABLED)
-        self.executor.submit(self._search_devices)
-
-    def _search_devices(self):
-        devices = {}
-        try:
-            devices = self.worker.run_coroutine(self.ble_manager.scan_devices(timeout=5)).result()
-        except Exception as e:
-            logging.getLogger().error(f"Errore durante la scansione BLE: {e}")
-        finally:
-            self.after(0, self._update_device_list_ui, devices)
-
-    def _update_device_list_ui(self, devices):
-        self.device_list.delete(0, tk.END)
-        for address, (name, rssi) in devices.items():
-            self.device_list.insert(tk.END, f"{name} - {address} - RSSI: {rssi}")
-            if rssi > -50:  # Note: Typically higher RSSI (less negative) is better.
-                # If you want to highlight strong signals, this is okay.
-                # If you meant weak signals (e.g. < -70), adjust the condition.
-                self.device_list.itemconfig(tk.END, {'bg': 'lightcoral'})  # Assuming lightcoral for > -50 RSSI
-            logging.getLogger().info(f"Dispositivo trovato: {name} - {address} - RSSI: {rssi}")
-        self.progress.stop()
-        self.btn_search.config(state=tk.NORMAL)
+        # The scan runs in background on the asyncio loop: the button only starts or stops it
+        if self.discovery.is_running():
+            self.discovery.stop()
+            self.btn_search.config(text="Cerca Dispositivi")
+        else:
+            self.discovery.start()
+            self.btn_search.config(text="Ferma Ricerca")
+
+    def _refresh_device_list(self):
+        """Updates the device list in place from the discovery cache; rows keep their position."""
+        entries = {entry[0]: entry for entry in self.discovery.snapshot()}
+        for index in reversed(range(len(self.device_addresses))):
+            if self.device_addresses[index] not in entries:  # Expired from the cache
+                self.device_list.delete(index)
+                del self.device_addresses[index]
+                del self.device_rows[index]
+        for address in entries:
+            if address not in self.device_addresses:
+                self.device_addresses.append(address)
+                self.device_rows.append(None)
+                self.device_list.insert(tk.END, "")
+        for index, address in enumerate(self.device_addresses):
+            _, name, rssi, age, known = entries[address]
+            text = f"{'* ' if known else ''}{name or 'Sconosciuto'} - {address} - RSSI: "
+            text += f"{rssi:.0f}" if rssi is not None else "-"
+            stale = age is None or age > DEVICE_STALE_S
+            if age is not None and stale:
+                text += f" (non visto da {age:.0f}s)"
+            # Strong signal highlighted as before; devices not seen recently in grey
+            colors = {'bg': 'lightcoral' if rssi is not None and rssi > -50 else 'white',
+                      'fg': 'grey' if stale else 'black'}
+            row = (text, tuple(colors.items()))
+            if row == self.device_rows[index]:
+                continue
+            selected = index in self.device_list.curselection()
+            self.device_list.delete(index)
+            self.device_list.insert(index, text)
+            self.device_list.itemconfig(index, colors)
+            if selected:
+                self.device_list.selection_set(index)
+            self.device_rows[index] = row
 
     def connect_device(self):
         selected_device_index = self.device_list.curselection()
@@ -247,20 +366,16 @@ class MainWindow(tk.Tk):
         self.progress.start()
         self.btn_connect.config(state=tk.DISABLED)
         self.btn_disconnect.config(state=tk.DISABLED)
-        self.executor.submit(self._connect_device, self.device_list.get(selected_device_index[0]))
+        self.dispatcher.submit("ftms", self._connect_device, self.device_addresses[selected_device_index[0]])
 
-    def _connect_device(self, selected_device_string):
-        # selected_device = self.device_list.get(tk.ACTIVE) # This is not thread-safe
+    def _connect_device(self, address):
+        # Direct connection by address, also for known trainers not seen by the current scan
         success = False
-        if selected_device_string:
-            try:
-                address = selected_device_string.split(" - ")[1]
-                logging.getLogger().info(f"Tentativo connessione a {address}")
-                self.worker.run_coroutine(self.ble_manager.connect_to_device(address)).result()
-                success = True  # Assume success if no exception
-            except Exception as e:
-                logging.getLogger().error(f"Errore durante la connessione BLE a {selected_device_string}: {e}")
-                success = False
+        try:
+            self.engine.connect_ble(address)
+            success = True  # Assume success if no exception
+        except Exception as e:
+            logging.getLogger().error(f"Errore durante la connessione BLE a {address}: {e}")
 
         self.after(0, self._update_connect_device_ui, success)
 
@@ -275,12 +390,12 @@ class MainWindow(tk.Tk):
         self.btn_connect.config(state=tk.DISABLED)
         self.btn_disconnect.config(state=tk.DISABLED)
         logging.getLogger().info("Richiesta Disconnessione")
-        self.executor.submit(self._disconnect_device)
+        self.dispatcher.submit("ftms", self._disconnect_device)
 
     def _disconnect_device(self):
         disconnected = False
         try:
-            disconnected = self.worker.run_coroutine(self.ble_manager.disconnect_device()).result()
+            disconnected = self.engine.disconnect_ble()
         except Exception as e:
             logging.getLogger().error(f"Errore durante la disconnessione BLE: {e}")
 
@@ -296,70 +411,59 @@ class MainWindow(tk.Tk):
     def send_level_command(self, level=None):
         if level is None: level = self.livello_entry.get()
         if level:
-            self.executor.submit(self._send_level_command, level)
+            self.engine.send_level_command(level)
         else:
             logging.getLogger().warning("Livello non specificato.")
 
-    def _send_level_command(self, level):
-        try:
-            logging.getLogger().info(f"Invio comando livello: {level}/200")
-            self.worker.run_coroutine(self.ble_manager.set_brake_percentage(int(level)))
-        except Exception as e:
-            logging.getLogger().error(f"Errore invio comando livello: {e}")
-
     def send_power_command(self, power=None):
         if power is None: power = self.potenza_entry.get()
         if power:
-            self.executor.submit(self._send_power_command, power)
+            self.engine.send_power_command(power)
         else:
             logging.getLogger().warning("Potenza non specificata.")
 
-    def _send_power_command(self, power):
-        try:
-            logging.getLogger().info(f"Invio comando potenza: {power}W")
-            self.worker.run_coroutine(self.ble_manager.set_brake_power(int(power)))
-        except Exception as e:
-            logging.getLogger().error(f"Errore invio comando potenza: {e}")
-
     def send_simulation_command(self, simulation=None):
         if simulation is None: simulation = self.simulazione_entry.get()
         if simulation:
-            self.executor.submit(self._send_simulation_command, simulation)
+            self.engine.send_simulation_command(simulation)
         else:
             logging.getLogger().warning("Simulazione non specificata.")
 
-    def _send_simulation_command(self, simulation):
-        try:
-            logging.getLogger().info(f"Invio comando simulazione: {simulation}%")
-            self.worker.run_coroutine(self.ble_manager.set_brake_simulation(grade=int(simulation)))
-        except Exception as e:
-            logging.getLogger().error(f"Errore invio comando simulazione: {e}")
+    def send_lorenz_power_target(self, target=None):
+        if target is None: target = self.potenza_lorenz_entry.get()
+        if target:
+            try:
+                target = float(target)
+            except ValueError:
+                logging.getLogger().error(f"Valore potenza Lorenz non valido: {target}")
+                return
+            self.engine.start_closed_loop("power", target)
+        else:
+            logging.getLogger().warning("Potenza Lorenz non specificata.")
+
+    def send_lorenz_torque_target(self, target=None):
+        if target is None: target = self.coppia_lorenz_entry.get()
+        if target:
+            try:
+                target = float(target)
+            except ValueError:
+                logging.getLogger().error(f"Valore coppia Lorenz non valido: {target}")
+                return
+            self.engine.start_closed_loop("torque", target)
+        else:
+            logging.getLogger().warning("Coppia Lorenz non specificata.")
 
     def toggle_data(self):
         if self.btn_toggle_data.cget('text') == 'Abilita Dati':
             self.btn_toggle_data.config(text='Disabilita Dati')
-            logging.getLogger().info("Dati BLE abilitati")
-            self.worker.run_coroutine(self.ble_manager.enable_indoor_bike_data_notifications(self.update_data_fields))
+            self.engine.enable_data()
         else:
             self.btn_toggle_data.config(text='Abilita Dati')
-            self.worker.run_coroutine(self.ble_manager.disable_indoor_bike_data_notifications())
+            self.engine.disable_data()
 
     def update_data_fields(self, bike_data):
-        for key, value in bike_data.items():
-            if value is not None and key in self.data_entries:  # Check if key exists
-                self.data_entries[key.replace(" ", "_")].config(state='normal')
-                self.data_entries[key.replace(" ", "_")].delete(0, tk.END)
-                self.data_entries[key.replace(" ", "_")].insert(0, str(value))
-                self.data_entries[key.replace(" ", "_")].config(state='readonly')
-
-        lorenz_data = {}
-        if self.lorenz_reader and self.lorenz_reader.is_connected():  # Check if Lorenz reader is initialized and connected
-            lorenz_data = self.lorenz_reader.get_data()
-        else:  # Provide default empty Lorenz data if not connected
-            lorenz_data = {"speed_avg": None, "torque_lorenz": None, "power_lorenz": None, "offset_lorenz": None}
-
-        combined_data = {**bike_data, **lorenz_data}
-        self.data_processor.handle_bike_data(combined_data)
+        # Called on the BLE thread: only stores the latest values, the display redraws at its frame rate
+        self.display.update(bike_data, skip_none=True)
 
     def load_commands_from_csv(self):
         if self.auto_commands_running:
@@ -367,83 +471,71 @@ class MainWindow(tk.Tk):
             return
         file_path = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
         if file_path:
-            for item in self.commands_table.get_children(): self.commands_table.delete(item)
-            commands = DataProcessor.read_brake_commands_from_csv(file_path)
-            for i, command in enumerate(commands):
-                tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-                self.commands_table.insert("", "end", values=command, tags=(tag,))
+            self.plan = DataProcessor.read_brake_commands_from_csv(file_path)  # Compiled plan, shown as is
+            if self.plan:
+                logging.getLogger().info(f"Piano caricato: {len(self.plan)} passi, durata {self.plan.duration:.0f}s")
+            self.plan_view.set_plan(self.plan)
 
     def launch_auto_commands(self):
-        if not self.commands_table.get_children():
+        if not self.plan:
             logging.getLogger().info("La tabella dei comandi è vuota.")
             return
         if self.auto_commands_running:
             logging.getLogger().info("Comandi automatici già in corso.")
             return
 
-        commands = [self.commands_table.item(item, 'values') for item in self.commands_table.get_children()]
-        command_items = self.commands_table.get_children()
-        for index, item in enumerate(command_items):
-            self.commands_table.item(item, tags=('evenrow' if index % 2 == 0 else 'oddrow',))
-
-        def send_next_command(index):
-            if index < len(commands) and self.auto_commands_running:
-                command_type, value, wait_time, speed_banco = commands[index]
-                try:
-                    wait_time = int(float(wait_time))  # More robust conversion
-                except ValueError:
-                    logging.error(f"Tempo di attesa non valido: {wait_time} per comando {index}. Interruzione.")
-                    self.stop_auto_commands()  # Stop if wait_time is invalid
-                    return
-
-                if index > 0: self.commands_table.item(command_items[index - 1],
-                                                       tags=('evenrow' if (index - 1) % 2 == 0 else 'oddrow',))
-                self.commands_table.item(command_items[index], tags=('currentrow',))
-
-                if command_type == "potenza":
-                    self.send_power_command(value)
-                elif command_type == "livelli":
-                    self.send_level_command(value)
-                elif command_type == "simulazione":
-                    self.send_simulation_command(value)
-
-                if speed_banco is not None and speed_banco.lower() != "none" and speed_banco.strip() != "":
-                    try:
-                        self.setspeed_modbus(float(speed_banco))
-                    except ValueError:
-                        logging.error(f"Velocità banco non valida: {speed_banco}")
-                else:
-                    logging.info("Nessuna impostazione velocità banco per questo comando.")
-
-                self.auto_command_id = self.after(wait_time * 1000, lambda: send_next_command(index + 1))
-            else:
-                self.auto_commands_running = False
-                self.led_status.config(text="Comandi Automatici: Completati", fg="blue")
-                if command_items and index > 0:  # Ensure last command highlighting is removed if loop completed
-                    self.commands_table.item(command_items[min(index, len(command_items) - 1)], tags=(
-                    'evenrow' if (min(index, len(command_items) - 1)) % 2 == 0 else 'oddrow',))
-                logging.getLogger().info("Comandi automatici completati")
-
-        self.commands_table.tag_configure('oddrow', background='lightgrey')
-        self.commands_table.tag_configure('evenrow', background='white')
-        self.commands_table.tag_configure('currentrow', background='yellow')
+        # Steps run on the engine's scheduler thread; the view polls its progress from the Tk thread
+        run = object()  # Identifies this run, so a late end of a previous plan does not reset the UI
+
+        def finished(completed):
+            self.after(0, self._on_plan_finished, run, completed)
+        try:
+            scheduler = self.engine.start_plan(self.plan, on_finished=finished)
+        except (RuntimeError, OSError) as e:
+            logging.getLogger().error(f"Impossibile avviare i comandi automatici: {e}")
+            return
+        self.plan_run = run
         self.auto_commands_running = True
+        self.plan_paused_shown = False
         self.led_status.config(text="Comandi Automatici: ON", fg="green")
-        send_next_command(0)
+        self.plan_view.set_timings(scheduler.timings)
+        self._poll_plan_progress()
+
+    def _poll_plan_progress(self):
+        if not self.auto_commands_running:
+            return
+        index = self.engine.plan_scheduler.current_index
+        if index >= 0 and index != self.plan_view.current:
+            self.plan_view.set_current(index)
+        paused = self.engine.is_plan_paused()
+        if paused != self.plan_paused_shown:
+            self.plan_paused_shown = paused
+            if paused:
+                self.led_status.config(text="Comandi Automatici: IN PAUSA (riconnessione)", fg="orange")
+            else:
+                self.led_status.config(text="Comandi Automatici: ON", fg="green")
+        self.after(PLAN_POLL_MS, self._poll_plan_progress)
+
+    def _on_plan_finished(self, run, completed):
+        # Tk thread; a plan stopped from the UI has already been reset by stop_auto_commands
+        if run is not self.plan_run or not self.auto_commands_running:
+            return
+        self.auto_commands_running = False
+        self.plan_view.set_current(None)
+        if completed:
+            self.led_status.config(text="Comandi Automatici: Completati", fg="blue")
+            logging.getLogger().info("Comandi automatici completati")
+        else:
+            self.led_status.config(text="Comandi Automatici: OFF", fg="red")
+            logging.getLogger().warning("Comandi automatici terminati prima della fine del piano")
 
     def stop_auto_commands(self):
         if self.auto_commands_running:
             self.auto_commands_running = False
             self.led_status.config(text="Comandi Automatici: OFF", fg="red")
-            if hasattr(self, 'auto_command_id') and self.auto_command_id:
-                self.after_cancel(self.auto_command_id)
-                self.auto_command_id = None
+            self.engine.stop_plan()
             logging.getLogger().info("Comandi automatici interrotti")
-            for item_id in self.commands_table.get_children():  # Use item_id
-                if 'currentrow' in self.commands_table.item(item_id, 'tags'):
-                    index = self.commands_table.index(item_id)
-                    self.commands_table.item(item_id, tags=('evenrow' if index % 2 == 0 else 'oddrow',))
-                    break
+            self.plan_view.set_current(None)
         else:
             logging.getLogger().info("Non ci sono comandi automatici attivi")
 
@@ -451,7 +543,7 @@ class MainWindow(tk.Tk):
         self.frame_lorenz = ttk.LabelFrame(self.right_frame, text="Gestione Lorenz")
         self.frame_lorenz.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
 
-        self.lorenz_reader = LorenzReader()  # Make sure LorenzReader has an is_connected() method
+        self.lorenz_reader = self.engine.lorenz_reader
         self.lorenz_controls = ttk.Frame(self.frame_lorenz)
         self.lorenz_controls.grid(row=0, column=0, sticky="ew", padx=5, pady=5)
 
@@ -474,6 +566,11 @@ class MainWindow(tk.Tk):
         self.speed_avg_label = self.create_labeled_entry(self.lorenz_controls, "Speed Avg", 4)
         self.torque_lorenz_label = self.create_labeled_entry(self.lorenz_controls, "Torque Lorenz", 5)
         self.power_lorenz_label = self.create_labeled_entry(self.lorenz_controls, "Power Lorenz", 6)
+        self.lorenz_display_keys = {"speed_avg": "lorenz_speed_avg", "torque_lorenz": "lorenz_torque_lorenz",
+                                    "power_lorenz": "lorenz_power_lorenz", "offset_lorenz": "lorenz_offset_lorenz"}
+        for entry, key in [(self.speed_avg_label, "lorenz_speed_avg"), (self.torque_lorenz_label, "lorenz_torque_lorenz"),
+                           (self.power_lorenz_label, "lorenz_power_lorenz"), (self.offset_label, "lorenz_offset_lorenz")]:
+            self.display.bind(key, entry, format_lorenz_value)
 
     def create_banco_controls(self):
         self.banco_controls = ttk.LabelFrame(self.right_frame, text="Gestione Banco")
@@ -512,37 +609,17 @@ class MainWindow(tk.Tk):
                 self.lorenz_update_id = None
             return
 
-        data = self.lorenz_reader.get_data()
-        values = {
-            self.speed_avg_label: data.get("speed_avg"),
-            self.torque_lorenz_label: data.get("torque_lorenz"),
-            self.power_lorenz_label: data.get("power_lorenz"),
-            self.offset_label: data.get("offset_lorenz"),
-        }
-        for entry, val in values.items():
-            entry.config(state='normal')
-            entry.delete(0, tk.END)
-            entry.insert(0, f"{val:.2f}" if isinstance(val, (int, float)) else "N/A")
-            entry.config(state='readonly')
+        data = self.engine.get_lorenz_data()
+        self.display.update({key: data.get(field) for field, key in self.lorenz_display_keys.items()})
 
     def initiate_lorenz_connection(self):
         logging.getLogger().info("Avvio connessione Lorenz...")
         self.btn_connect_lorenz.config(state=tk.DISABLED)
         self.btn_disconnect_lorenz.config(state=tk.DISABLED)  # Disable disconnect during connection attempt
-        self.executor.submit(self._execute_lorenz_connection)
+        self.dispatcher.submit("lorenz", self._execute_lorenz_connection)
 
     def _execute_lorenz_connection(self):
-        porta_com_lorenz = trova_porta_usb_serial("Lorenz USB sensor interface Port")
-        success = False
-        if porta_com_lorenz:
-            try:
-                logging.getLogger().info(f"Trovata porta Lorenz: {porta_com_lorenz}")
-                success = self.lorenz_reader.open_connection(int(porta_com_lorenz.split("COM")[-1]))
-            except Exception as e:
-                logging.getLogger().error(f"Errore durante la connessione al Lorenz: {e}")
-                success = False
-        else:
-            logging.getLogger().warning("Porta Lorenz non trovata.")
+        success = self.engine.connect_lorenz()
         self.after(0, self._update_lorenz_ui_after_connection, success)
 
     def _update_lorenz_ui_after_connection(self, success):
@@ -564,11 +641,16 @@ class MainWindow(tk.Tk):
     def start_lorenz_update(self):
         if self.lorenz_reader and self.lorenz_reader.is_connected():
             try:
+                if self.lorenz_status.cget("text") != "Lorenz: Connesso":  # Back after a reconnection
+                    self.lorenz_status.config(text="Lorenz: Connesso", fg="green")
                 self.update_lorenz_data()
-                self.lorenz_update_id = self.after(500, self.start_lorenz_update)
+                self.lorenz_update_id = self.after(self.display.interval_ms, self.start_lorenz_update)
             except Exception as e:
                 logging.getLogger().error(f"Errore durante aggiornamento Lorenz: {e}")
                 self.disconnect_lorenz()  # Attempt to disconnect if updates fail
+        elif self.engine.lorenz_expected:  # Link lost: the supervisor is reconnecting it
+            self.lorenz_status.config(text="Lorenz: Riconnessione...", fg="orange")
+            self.lorenz_update_id = self.after(1000, self.start_lorenz_update)
         else:  # Stop if not connected
             self.stop_lorenz_update()
 
@@ -581,13 +663,7 @@ class MainWindow(tk.Tk):
     def disconnect_lorenz(self):
         # Consider running close_connection in a thread if it can block
         # For now, assuming it's quick.
-        if self.lorenz_reader and self.lorenz_reader.is_connected():
-            if self.lorenz_reader.close_connection():
-                logging.getLogger().info("Lorenz Disconnesso")
-            else:
-                logging.getLogger().warning("Problema durante la disconnessione del Lorenz.")
-        else:
-            logging.getLogger().info("Lorenz già disconnesso o non inizializzato.")
+        self.engine.disconnect_lorenz()
 
         self.lorenz_status.config(text="Lorenz: Non Connesso", fg="red")
         self.stop_lorenz_update()
@@ -598,19 +674,13 @@ class MainWindow(tk.Tk):
 
     def clear_lorenz_data_fields(self):
         # Method to clear Lorenz data fields
-        na_fields = [self.offset_label, self.speed_avg_label, self.torque_lorenz_label, self.power_lorenz_label]
-        for entry_widget in na_fields:
-            if entry_widget:  # Check if widget exists
-                entry_widget.config(state='normal')
-                entry_widget.delete(0, tk.END)
-                entry_widget.insert(0, "N/A")
-                entry_widget.config(state='readonly')
+        self.display.update({key: None for key in self.lorenz_display_keys.values()})
 
     def initiate_read_lorenz_offset(self):
         if self.lorenz_reader and self.lorenz_reader.is_connected():
             logging.getLogger().info("Avvio lettura offset Lorenz...")
             self.btn_read_offset.config(state=tk.DISABLED)
-            self.executor.submit(self._execute_read_lorenz_offset)
+            self.dispatcher.submit("lorenz", self._execute_read_lorenz_offset)
         else:
             logging.getLogger().warning("Lorenz non connesso. Impossibile leggere l'offset.")
 
@@ -618,8 +688,7 @@ class MainWindow(tk.Tk):
         success = False
         try:
             # Assuming read_offset() updates an internal value picked up by get_data()
-            self.lorenz_reader.read_offset()
-            logging.getLogger().info(f"Comando lettura offset Lorenz inviato.")
+            self.engine.read_lorenz_offset()
             success = True
             # The periodic update_lorenz_data will show the new offset.
             # If immediate update is desired and read_offset returns the value or get_data can be called:
@@ -642,12 +711,11 @@ class MainWindow(tk.Tk):
             logging.getLogger().warning("Lettura offset Lorenz fallita o Lorenz non connesso.")
 
     def clicked_button_connection_modbus(self):
-        # This could also benefit from threading if connection is slow,
-        # but typically Modbus/TCP connections are faster than serial.
-        if not self.modbus.is_connesso():
-            self.modbus.connetti(self.entry_ip.get(), 502)
+        # Non-blocking: the bench client connects (and reconnects) on the asyncio worker
+        if self.engine.bench.target is None:
+            self.engine.connect_modbus(self.entry_ip.get(), 502)
         else:
-            self.modbus.disconnetti()
+            self.engine.disconnect_modbus()
         self._check_and_update_modbus_status()  # Update UI immediately
 
     def clicked_button_setspeed_modbus(self):
@@ -661,40 +729,18 @@ class MainWindow(tk.Tk):
             logging.error(f"Valore velocità banco non valido: {self.speed_banco_entry.get()}")
 
     def setspeed_modbus(self, speedkmh):
-        try:
-            if speedkmh is None:
-                raise ValueError("La velocità non può essere None")
-            if not (0 <= speedkmh <= 80):  # Allow 0 km/h
-                raise ValueError(
-                    f"La velocità richiesta ({speedkmh} km/h) è fuori dal range consentito (0-80 km/h). Comando rifiutato.")
-            logging.getLogger().info(f"Impostazione velocità banco a {speedkmh} km/h")
-            self.modbus.set_motor_speed(int(speedkmh * 10))  # Assuming API needs speed * 10
-        except ValueError as ve:
-            logging.getLogger().error(f"Errore valore velocità banco: {ve}")
-        except Exception as e:
-            logging.getLogger().error(f"Errore nell'invio della velocità del banco: {e}")
+        self.engine.setspeed_modbus(speedkmh)
 
     def on_closing(self):
         logging.getLogger().info("Chiusura applicazione...")
-        if hasattr(self, 'lorenz_reader') and self.lorenz_reader.is_connected():
-            self.lorenz_reader.close_connection()
-        if hasattr(self, 'ble_manager') and self.ble_manager.get_connection_status():
-            # Ensure disconnect is called, might need to be async and waited for briefly
-            # For simplicity here, direct call. If it blocks, needs care.
-            self.worker.run_coroutine(self.ble_manager.disconnect_device())
-
-        if hasattr(self, 'modbus') and self.modbus.is_connesso():
-            self.modbus.disconnetti()
-
-        if hasattr(self, 'worker'):
-            self.worker.stop()  # Ensure asyncio worker is stopped
-
-        if hasattr(self, 'executor'):
-            self.executor.shutdown(wait=True)  # Wait for pending tasks
-
+        self.stop_lorenz_update()
+        self.display.stop()
+        logging.getLogger().info(f"Aggiornamenti display: {self.display.stats()}")
+        self.live_plot.stop()
+        self.diagnostics.stop()
+        self.engine.close()
         self.destroy()
 
-
 if __name__ == "__main__":
     # Setup basic logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
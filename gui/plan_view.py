@@ -0,0 +1,176 @@
+import tkinter as tk
+from tkinter import ttk
+
+COLUMNS = (("#", 60), ("Comando", 110), ("Valore", 70), ("Tempo [s]", 70), ("Vel Banco [km/h]", 100),
+           ("Inizio prev. [s]", 100), ("Inizio eff. [s]", 100), ("Ritardo [ms]", 80))
+DEFAULT_ROW_HEIGHT = 20
+HEADING_HEIGHT = 25
+
+
+def _format_number(value, digits):
+    if value is None:
+        return ""
+    return f"{value:.{digits}f}" if isinstance(value, float) else str(value)
+
+
+class PlanView(ttk.Frame):
+    """Virtualized command table: a Treeview with only as many items as visible rows.
+
+    The plan (a logic.plan.Plan) is never copied into Tk: the visible rows are filled from the
+    plan by index, so loading, highlighting and scrolling cost O(visible rows) whatever the plan
+    length. set_current(index) is O(1) and can be called for every step; the redraw is coalesced
+    on the Tk idle loop. With `follow` set, the view keeps the running step in sight; scrolling
+    by hand turns it off. `timings` (PlanScheduler.timings, append-only in step order) fills the
+    actual start and lateness columns.
+    """
+
+    def __init__(self, master, **kwargs):
+        super().__init__(master, **kwargs)
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+        self.tree = ttk.Treeview(self, columns=[name for name, _ in COLUMNS], show='headings', selectmode='none')
+        for name, width in COLUMNS:
+            self.tree.heading(name, text=name)
+            self.tree.column(name, width=width, anchor="e" if name != "Comando" else "w", stretch=True)
+        self.tree.tag_configure('oddrow', background='lightgrey')
+        self.tree.tag_configure('evenrow', background='white')
+        self.tree.tag_configure('currentrow', background='yellow')
+        self.tree.grid(row=0, column=0, sticky="nsew", padx=(10, 0), pady=10)
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self._yview)
+        self.scrollbar.grid(row=0, column=1, sticky="ns", pady=10)
+        self.follow = tk.BooleanVar(value=True)
+        ttk.Checkbutton(self, text="Segui passo corrente", variable=self.follow,
+                        command=self._on_follow).grid(row=1, column=0, sticky="w", padx=10)
+        self.info = ttk.Label(self, text="Nessun piano caricato")
+        self.info.grid(row=1, column=0, sticky="e", padx=10)
+
+        self.plan = []
+        self.timings = []
+        self.current = None
+        self.top = 0
+        self.items = []  # item del Treeview riutilizzati, uno per riga visibile
+        self.shown = []  # valori e tag mostrati per riga, per non toccare le righe invariate
+        self.redraw_pending = False
+        self.redraws = 0
+        row_height = ttk.Style().lookup("Treeview", "rowheight")
+        self.row_height = int(row_height) if row_height else DEFAULT_ROW_HEIGHT
+        self._set_rows(20)
+        self.tree.config(height=20)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        for widget in (self.tree, self.scrollbar):
+            widget.bind("<MouseWheel>", self._on_wheel)
+            widget.bind("<Button-4>", lambda event: self._scroll_by(-3))
+            widget.bind("<Button-5>", lambda event: self._scroll_by(3))
+
+    # --- API ---
+
+    def set_plan(self, plan):
+        self.plan = plan
+        self.timings = []
+        self.current = None
+        self.top = 0
+        if plan:
+            self.info.config(text=f"{len(plan)} passi, durata {self._format_duration(plan.duration)}")
+        else:
+            self.info.config(text="Nessun piano caricato")
+        self._schedule_redraw()
+
+    def set_timings(self, timings):
+        self.timings = timings
+        self._schedule_redraw()
+
+    def set_current(self, index):
+        """Marks the running step (None clears the highlight)."""
+        self.current = index
+        if index is not None and self.follow.get() and not self.top <= index < self.top + len(self.items):
+            self.top = self._clamp_top(index - len(self.items) // 3)
+        self._schedule_redraw()
+
+    # --- Disegno ---
+
+    def _format_duration(self, seconds):
+        hours, rest = divmod(int(seconds), 3600)
+        return f"{hours}h{rest // 60:02d}m{rest % 60:02d}s" if hours else f"{rest // 60}m{rest % 60:02d}s"
+
+    def _set_rows(self, rows):
+        rows = max(1, rows)
+        while len(self.items) < rows:
+            self.items.append(self.tree.insert("", "end", values=()))
+            self.shown.append(None)
+        while len(self.items) > rows:
+            self.tree.delete(self.items.pop())
+            self.shown.pop()
+
+    def _clamp_top(self, top):
+        return max(0, min(top, len(self.plan) - len(self.items)))
+
+    def _schedule_redraw(self):
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.after_idle(self._redraw)
+
+    def _row(self, index):
+        command_type, value, wait_time, speed_banco = self.plan[index]
+        planned = self.plan.start(index)
+        actual = lateness = ""
+        if index < len(self.timings):
+            timing = self.timings[index]
+            actual = f"{timing.actual:.2f}"
+            lateness = f"{1000 * timing.lateness:.1f}"
+        return (index + 1, command_type or "-", _format_number(value, 2), _format_number(wait_time, 2),
+                _format_number(speed_banco, 1), f"{planned:.2f}", actual, lateness)
+
+    def _redraw(self):
+        self.redraw_pending = False
+        self.redraws += 1
+        count = len(self.plan)
+        for row, item in enumerate(self.items):
+            index = self.top + row
+            if index < count:
+                tag = 'currentrow' if index == self.current else ('evenrow' if index % 2 == 0 else 'oddrow')
+                shown = (self._row(index), tag)
+            else:
+                shown = ((), 'evenrow')
+            if shown != self.shown[row]:
+                self.shown[row] = shown
+                self.tree.item(item, values=shown[0], tags=(shown[1],))
+        if count:
+            self.scrollbar.set(self.top / count, min(1.0, (self.top + len(self.items)) / count))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    # --- Scorrimento ---
+
+    def _scroll_to(self, top):
+        top = self._clamp_top(top)
+        if top != self.top:
+            self.top = top
+            if self.current is not None:
+                self.follow.set(False)  # The user is looking elsewhere
+            self._schedule_redraw()
+
+    def _scroll_by(self, rows):
+        self._scroll_to(self.top + rows)
+
+    def _yview(self, *args):
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * len(self.plan)))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            self._scroll_by(amount * (len(self.items) - 1 if args[2] == "pages" else 1))
+
+    def _on_wheel(self, event):
+        self._scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_follow(self):
+        if self.follow.get() and self.current is not None:
+            self.top = self._clamp_top(self.current - len(self.items) // 3)
+            self._schedule_redraw()
+
+    def _on_resize(self, event):
+        rows = (event.height - HEADING_HEIGHT) // self.row_height
+        if rows != len(self.items) and rows > 0:
+            self._set_rows(rows)
+            self.top = self._clamp_top(self.top)
+            self._schedule_redraw()
@@ -0,0 +1,230 @@
+"""Esecuzione di un piano comandi senza interfaccia grafica.
+
+    python headless.py --plan piano.csv --address AA:BB:CC:DD:EE:FF --modbus-ip 192.168.0.10
+    python headless.py --plan piano.csv --simulate --modbus-ip 127.0.0.1
+    python headless.py --rigs banchi.json
+    python headless.py --replay output/20240501_101500_bike_data_log.csv --replay-speed max
+
+banchi.json elenca i banchi da eseguire in parallelo nello stesso processo (vedi logic.rigs):
+    [{"name": "banco1", "address": "AA:BB:CC:DD:EE:01", "plan": "piano1.csv", "lorenz_port": "COM5",
+      "modbus_ip": "192.168.0.10"},
+     {"name": "banco2", "address": "AA:BB:CC:DD:EE:02", "plan": "piano2.csv", "lorenz": false,
+      "backends": "both"}]
+
+--backend sceglie il formato delle sessioni: csv (predefinito), columnar (vedi logic.columnar_log) o
+both; con --rigs la chiave "backends" di un banco lo sostituisce.
+
+--replay ripassa una sessione registrata nella catena di acquisizione (fusione, registrazione) senza
+dispositivi e riporta il throughput ottenuto (vedi logic.replay).
+"""
+import argparse
+import logging
+from logging.handlers import RotatingFileHandler
+import sys
+import threading
+from logic.data_processing import BACKENDS, DataProcessor
+from logic.engine import BenchEngine
+from logic.log_pipeline import JsonFormatter, start_log_listener
+from logic.metrics import MetricsExporter
+from logic.replay import SessionReplay
+from logic.rigs import RigManager
+from logic.simulators import SIMULATED_ADDRESS, create_simulated_engine
+from logic.supervisor import STALL_INTERVALS
+
+
+def setup_logging(json_logs=False):
+    log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    file_handler = RotatingFileHandler("app.log", maxBytes=5 * 1024 * 1024, backupCount=3)
+    file_handler.setFormatter(JsonFormatter() if json_logs else log_formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(log_formatter)
+    return start_log_listener([file_handler, console_handler], level=logging.INFO)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Total Commander headless: esegue un piano comandi CSV e registra la sessione")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--plan", help="CSV del piano comandi (formato di read_brake_commands_from_csv)")
+    source.add_argument("--rigs", help="JSON con più banchi da eseguire in parallelo (vedi logic.rigs)")
+    source.add_argument("--replay", help="CSV di una sessione registrata da riprodurre (vedi logic.replay)")
+    parser.add_argument("--replay-speed", default="1",
+                        help="Con --replay: multiplo del tempo reale (1 = tempo reale) o 'max' (il più veloce possibile)")
+    parser.add_argument("--health-interval", type=float, default=10.0, help="Con --rigs: intervallo del riepilogo salute [s]")
+    parser.add_argument("--address", help="Indirizzo BLE del rullo FTMS")
+    parser.add_argument("--name", help="Se --address manca: primo dispositivo trovato il cui nome contiene questo testo")
+    parser.add_argument("--scan-timeout", type=float, default=5, help="Durata scansione BLE [s]")
+    parser.add_argument("--no-lorenz", action="store_true", help="Non connettere il sensore Lorenz")
+    parser.add_argument("--modbus-ip", help="IP del banco Modbus (se assente il banco non viene usato)")
+    parser.add_argument("--modbus-port", type=int, default=502)
+    parser.add_argument("--simulate", action="store_true", help="Usa i dispositivi simulati di logic.simulators")
+    parser.add_argument("--cl-actuator", choices=["level", "bench"], default="level",
+                        help="Attuatore dei passi potenza_lorenz/coppia_lorenz: livello freno o velocità banco")
+    parser.add_argument("--cl-kp", type=float, help="Guadagno proporzionale dell'anello chiuso")
+    parser.add_argument("--cl-ki", type=float, help="Guadagno integrale dell'anello chiuso")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="csv",
+                        help="Formato dei file di sessione (con --rigs: predefinito, \"backends\" per banco lo sostituisce)")
+    parser.add_argument("--log-json", action="store_true", help="Scrive app.log come JSON, un record per riga")
+    parser.add_argument("--metrics-file", help="File delle metriche (formato textfile Prometheus, JSON se termina in .json)")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="Intervallo di scrittura delle metriche [s]")
+    parser.add_argument("--no-supervise", action="store_true",
+                        help="Non riconnettere automaticamente rullo e Lorenz dopo una caduta (vedi logic.supervisor)")
+    parser.add_argument("--stall-intervals", type=float, default=STALL_INTERVALS,
+                        help="Campioni attesi mancanti prima di considerare interrotto un collegamento")
+    parser.add_argument("--pause-plan-on-stall", action="store_true",
+                        help="Mette in pausa il piano mentre il rullo viene riconnesso")
+    return parser.parse_args(argv)
+
+
+def start_metrics_exporter(args, registries):
+    if not args.metrics_file:
+        return None
+    return MetricsExporter(registries, args.metrics_file, args.metrics_interval).start()
+
+
+def stop_metrics_exporter(exporter):
+    if exporter is not None:
+        exporter.stop()  # Last write with the final values
+
+
+def find_address(engine, name, timeout, use_known=True):
+    if name and use_known:
+        address = engine.discovery.find_known(name)
+        if address:
+            logging.getLogger().info(f"Rullo noto {engine.discovery.name_of(address)} - {address}: connessione senza scansione")
+            return address
+    devices = engine.scan_devices(timeout=timeout)
+    for address, (device_name, rssi) in devices.items():
+        logging.getLogger().info(f"Dispositivo trovato: {device_name} - {address} - RSSI: {rssi}")
+        if name and device_name and name.lower() in device_name.lower():
+            return address
+    return None
+
+
+def run(args, engine):
+    steps = DataProcessor.read_brake_commands_from_csv(args.plan)
+    if not steps:
+        logging.getLogger().error(f"Nessun comando valido in {args.plan}")
+        return 1
+
+    if args.simulate and not (args.address or args.name):
+        args.address = SIMULATED_ADDRESS
+    address = args.address or find_address(engine, args.name, args.scan_timeout)
+    if not address:
+        logging.getLogger().error("Nessun rullo FTMS da connettere: specificare --address o --name")
+        return 1
+    try:
+        engine.connect_ble(address)
+    except Exception as e:
+        if args.address:
+            raise
+        # The known trainer may be off or replaced: look for one by name
+        logging.getLogger().warning(f"Connessione a {address} fallita ({e}), nuova ricerca")
+        address = find_address(engine, args.name, args.scan_timeout, use_known=False)
+        if not address:
+            logging.getLogger().error(f"Nessun rullo FTMS il cui nome contiene {args.name}")
+            return 1
+        engine.connect_ble(address)
+    engine.enable_data().result()
+
+    if not args.no_lorenz and not engine.connect_lorenz():
+        logging.getLogger().warning("Lorenz non disponibile: la sessione verrà registrata senza coppia")
+    if args.modbus_ip and not engine.connect_modbus(args.modbus_ip, args.modbus_port, timeout=10):
+        logging.getLogger().error(f"Connessione al banco {args.modbus_ip} fallita")
+        return 1
+
+    finished = threading.Event()
+    outcome = {}
+
+    def on_finished(completed):
+        outcome["completed"] = completed
+        finished.set()
+
+    logging.getLogger().info(f"Avvio piano {args.plan}: {len(steps)} comandi")
+    engine.start_plan(steps, on_finished=on_finished)
+    try:
+        while not finished.wait(0.5):  # Short waits keep Ctrl+C responsive on Windows
+            pass
+    except KeyboardInterrupt:
+        logging.getLogger().info("Piano interrotto da tastiera.")
+        engine.stop_plan()
+        finished.wait(5)
+    logging.getLogger().info(f"Sessione registrata in {engine.data_processor.session_path}")
+    if engine.data_processor.events:
+        logging.getLogger().info(f"Interruzioni e ripristini in {engine.data_processor.events_filename}: "
+                                 f"{engine.supervisor.stats()}")
+    return 0 if outcome.get("completed") else 2
+
+
+def run_rigs(args, manager):
+    manager.start_all()
+    try:
+        while not manager.wait(args.health_interval):
+            manager.log_health()
+    except KeyboardInterrupt:
+        logging.getLogger().info("Piani interrotti da tastiera.")
+        manager.stop_all()
+        manager.wait(5)
+    health = manager.log_health()
+    return 0 if all(status["state"] in ("completato", "acquisizione") for status in health["rigs"].values()) else 2
+
+
+def run_replay(args, engine_kwargs):
+    speed = None if args.replay_speed == "max" else float(args.replay_speed)
+    replay = SessionReplay(args.replay, speed=speed, **engine_kwargs)
+    exporter = start_metrics_exporter(args, [replay.metrics])
+    try:
+        report = replay.run()
+    except KeyboardInterrupt:
+        logging.getLogger().info("Riproduzione interrotta da tastiera.")
+        replay.stop()
+        replay.engine.close()
+        return 2
+    finally:
+        stop_metrics_exporter(exporter)
+    return 0 if report["rows_dropped"] == 0 else 2
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log_listener = setup_logging(args.log_json)
+    gains = {name: value for name, value in (("kp", args.cl_kp), ("ki", args.cl_ki)) if value is not None}
+    engine_kwargs = {"closed_loop_actuator": args.cl_actuator, "closed_loop_gains": gains,
+                     "supervise": not args.no_supervise, "stall_intervals": args.stall_intervals,
+                     "pause_plan_on_stall": args.pause_plan_on_stall, "backends": BACKENDS[args.backend]}
+    if args.replay:
+        try:
+            return run_replay(args, engine_kwargs)
+        except (OSError, ValueError) as e:
+            logging.getLogger().error(f"Riproduzione di {args.replay} fallita: {e}")
+            return 1
+        finally:
+            log_listener.stop()
+    if args.rigs:
+        try:
+            manager = RigManager.from_config(args.rigs, simulate=args.simulate, **engine_kwargs)
+        except Exception as e:
+            logging.getLogger().error(f"Configurazione banchi non valida: {e}")
+            log_listener.stop()
+            return 1
+        exporter = start_metrics_exporter(args, lambda: [rig.engine.metrics for rig in manager.rigs.values()])
+        try:
+            return run_rigs(args, manager)
+        finally:
+            manager.close()
+            stop_metrics_exporter(exporter)
+            log_listener.stop()
+    engine = create_simulated_engine(**engine_kwargs) if args.simulate else BenchEngine(**engine_kwargs)
+    exporter = start_metrics_exporter(args, [engine.metrics])
+    try:
+        return run(args, engine)
+    except Exception as e:
+        logging.getLogger().error(f"Errore esecuzione headless: {e}")
+        return 1
+    finally:
+        engine.close()
+        stop_metrics_exporter(exporter)
+        log_listener.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+"""Analisi a posteriori di una sessione registrata, per passo del piano comandi (richiede numpy).
+
+    python -m logic.analysis output/20240101_120000_bike_data_log.csv piano.csv [--report report.csv]
+
+La sessione (CSV di DataProcessor o directory .cols di logic.columnar_log) viene caricata in
+array numpy e suddivisa per passo: con il file <stamp>_plan_timing.csv accanto alla sessione si
+usano gli istanti effettivi dei passi, altrimenti gli istanti previsti dal piano più
+--plan-start. Per ogni passo: tempo di assestamento, finestra a regime e, nella finestra,
+errore della potenza FTMS rispetto alla potenza Lorenz (medio, RMS, percentuale) e scarto della
+grandezza misurata dall'obiettivo del comando.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import numpy as np
+from logic.data_processing import timing_path_for
+from logic.plan import compile_plan
+
+REL_TOLERANCE = 0.03  # banda di regime relativa al valore finale del passo
+ABS_TOLERANCE = 2.0  # banda minima, nell'unità della grandezza (W o Nm)
+TAIL_FRACTION = 0.3  # parte finale del passo usata per stimare il valore di regime
+# Grandezza confrontata con l'obiettivo per tipo di comando
+TARGET_FIELDS = {"potenza": "power_lorenz", "potenza_lorenz": "power_lorenz", "coppia_lorenz": "torque_lorenz"}
+REPORT_COLUMNS = ["step", "command", "value", "start_s", "duration_s", "samples", "steady_samples", "settling_s",
+                  "power_ftms", "power_lorenz", "error_mean_w", "error_rms_w", "error_pct", "target_error",
+                  "target_error_pct"]
+
+
+def load_session(path, cache=True):
+    """Returns {column: float64 array} and the time axis "t" [s] from the ms column (deciseconds).
+
+    Parsing a day-long CSV takes a couple of seconds, so the arrays are cached next to it
+    (<session>.npz, invalidated when the CSV size or mtime changes); .cols sessions are mapped directly.
+    """
+    if os.path.isdir(path):
+        from logic.columnar_log import INT_MISSING, ColumnarSession
+        with ColumnarSession(path) as session:
+            columns = {}
+            for name, array in session.to_numpy().items():
+                if name == "timestamp":
+                    continue
+                values = np.asarray(array, dtype=np.float64)
+                if array.dtype.kind == "i":
+                    values[array == INT_MISSING] = np.nan
+                columns[name] = values
+    else:
+        columns = _load_csv_cached(path) if cache else _parse_csv(path)
+    columns["t"] = columns["ms"] / 10.0
+    return columns
+
+
+def _parse_csv(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    header, _, body = data.partition(b"\n")
+    names = header.decode().strip().split(";")
+    # Missing values are empty fields: make them NaN so the whole file parses in C (two passes cover runs of ;;;)
+    body = body.replace(b"\r", b"").replace(b";;", b";nan;").replace(b";;", b";nan;").replace(b";\n", b";nan\n")
+    if body.endswith(b";"):
+        body += b"nan"
+    if not body.strip():
+        return {name: np.empty(0) for name in names[1:]}
+    values = np.loadtxt(io.BytesIO(body), delimiter=";", usecols=range(1, len(names)), dtype=np.float64, ndmin=2)
+    return {name: np.ascontiguousarray(values[:, i]) for i, name in enumerate(names[1:])}
+
+
+def _load_csv_cached(path):
+    stat = os.stat(path)
+    signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    cache_path = os.path.splitext(path)[0] + ".npz"
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path) as cached:
+                if np.array_equal(cached["_signature"], signature):
+                    return {name: cached[name] for name in cached.files if name != "_signature"}
+        except (OSError, ValueError, KeyError):
+            pass
+    columns = _parse_csv(path)
+    try:
+        temp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, _signature=signature, **columns)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass  # Read-only directory: no cache
+    return columns
+
+
+def read_plan_timing(timing_path):
+    """Executed steps from a plan_timing.csv: ([(command_type, value, wait_time, None)], starts [s, session]).
+
+    starts has one more element than steps (end of the last step); None if the file predates
+    the session_s/wait_s columns.
+    """
+    with open(timing_path, newline="") as file:
+        rows = list(csv.DictReader(file, delimiter=";"))
+    if not rows or "session_s" not in rows[0] or "wait_s" not in rows[0]:
+        return None
+    steps = []
+    for row in rows:
+        value = float(row["value"]) if row["value"] not in ("", "None") else None
+        steps.append((row["command"] if row["command"] not in ("", "None") else None, value, float(row["wait_s"]),
+                      None))
+    starts = np.array([float(row["session_s"]) for row in rows] + [float(rows[-1]["session_s"]) + steps[-1][2]])
+    return steps, starts
+
+
+def load_step_starts(session_path, plan, plan_start=None):
+    """Start of every plan step in session seconds: actual (from plan_timing.csv) or planned + plan_start."""
+    timing_path = timing_path_for(session_path) if plan_start is None else None
+    if timing_path and os.path.exists(timing_path):
+        with open(timing_path, newline="") as file:
+            rows = list(csv.DictReader(file, delimiter=";"))
+        if rows and "session_s" in rows[0]:
+            starts = np.full(len(plan) + 1, np.nan)
+            for row in rows:
+                step = int(row["step"])
+                if not 0 <= step < len(plan):
+                    raise ValueError(f"{timing_path}: il passo {step} non esiste nel piano ({len(plan)} passi); "
+                                     f"il file del piano è stato modificato dopo la sessione?")
+                starts[step] = float(row["session_s"])
+            executed = int(np.count_nonzero(~np.isnan(starts[:-1])))
+            # Steps never reached stay NaN; the last executed step ends after its planned duration
+            starts[executed] = starts[executed - 1] + plan[executed - 1][2] if executed else np.nan
+            return starts[:executed + 1]
+    planned = np.fromiter((plan.start(i) for i in range(len(plan) + 1)), dtype=np.float64, count=len(plan) + 1)
+    return planned + (plan_start or 0.0)
+
+
+def _segment_sums(values, bounds):
+    """Per-segment sums of values over [bounds[k], bounds[k+1]) via one cumulative sum."""
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    return cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+
+
+def analyze(session, plan, starts):
+    """Vectorized per-step statistics; returns {column: array} with REPORT_COLUMNS."""
+    t = session["t"]
+    steps = len(starts) - 1
+    if steps < 1:
+        raise ValueError("Nessun passo del piano eseguito nella sessione")
+    bounds = np.searchsorted(t, starts, side="left")  # Samples of step k: [bounds[k], bounds[k+1])
+    lengths = np.diff(bounds)
+    step_of = np.repeat(np.arange(steps), lengths)
+    first, last = bounds[0], bounds[-1]
+    index = np.arange(first, last)
+
+    power = session["power"][first:last]
+    lorenz = session["power_lorenz"][first:last]
+    # Settling on the Lorenz power (the physical brake load), on FTMS power if Lorenz is missing
+    measured = lorenz if np.any(~np.isnan(lorenz)) else power
+    valid_measured = ~np.isnan(measured)
+    filled = np.where(valid_measured, measured, 0.0)
+    local = bounds - first
+
+    # Final value: mean over the last TAIL_FRACTION of each step
+    tail_starts = np.searchsorted(t, starts[:-1] + (1 - TAIL_FRACTION) * np.diff(starts), side="left") - first
+    tail_bounds = np.clip(tail_starts, local[:-1], local[1:])
+    tail_sum = _segment_sums(filled, np.stack([tail_bounds, local[1:]], axis=1).ravel())[::2]
+    tail_count = _segment_sums(valid_measured.astype(np.float64),
+                               np.stack([tail_bounds, local[1:]], axis=1).ravel())[::2]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        final = tail_sum / tail_count
+    tolerance = np.maximum(REL_TOLERANCE * np.abs(final), ABS_TOLERANCE)
+
+    # Settling: the step is steady after the last sample outside the band around its final value
+    outside = valid_measured & (np.abs(measured - final[step_of]) > tolerance[step_of])
+    last_outside = np.full(steps, -1)
+    marked = np.where(outside, index, -1)
+    nonempty = np.flatnonzero(lengths)
+    if nonempty.size:
+        last_outside[nonempty] = np.maximum.reduceat(marked, local[nonempty])
+        # reduceat runs each segment up to the next non-empty start: clip to the step's own samples
+        last_outside = np.where(last_outside >= bounds[1:], -1, last_outside)
+    settled_index = np.where(last_outside >= 0, last_outside + 1, bounds[:-1])
+    never_settled = settled_index >= bounds[1:]
+    with np.errstate(invalid="ignore"):
+        settling = np.where(never_settled | (lengths == 0), np.nan,
+                            t[np.minimum(settled_index, len(t) - 1)] - starts[:-1])
+    settling = np.maximum(settling, 0.0)
+
+    steady = index >= settled_index[step_of]
+    both = steady & ~np.isnan(power) & ~np.isnan(lorenz)
+    error = np.where(both, power - lorenz, 0.0)
+    count = _segment_sums(both.astype(np.float64), local)
+    steady_count = _segment_sums(steady.astype(np.float64), local)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        power_mean = _segment_sums(np.where(both, power, 0.0), local) / count
+        lorenz_mean = _segment_sums(np.where(both, lorenz, 0.0), local) / count
+        error_mean = _segment_sums(error, local) / count
+        error_rms = np.sqrt(_segment_sums(error * error, local) / count)
+        error_pct = 100.0 * error_mean / lorenz_mean
+
+    command_types = [plan[i][0] for i in range(steps)]
+    values = np.array([np.nan if plan[i][1] is None else plan[i][1] for i in range(steps)], dtype=np.float64)
+    target_error = np.full(steps, np.nan)
+    for field in set(TARGET_FIELDS.values()):
+        rows = np.array([TARGET_FIELDS.get(command) == field for command in command_types], dtype=bool)
+        if not rows.any():
+            continue
+        signal = session[field][first:last]
+        ok = steady & ~np.isnan(signal)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = _segment_sums(np.where(ok, signal, 0.0), local) / _segment_sums(ok.astype(np.float64), local)
+        target_error[rows] = (mean - values)[rows]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        target_error_pct = 100.0 * target_error / values
+
+    return {
+        "step": np.arange(steps), "command": np.array([command or "-" for command in command_types]),
+        "value": values, "start_s": starts[:-1], "duration_s": np.diff(starts), "samples": lengths,
+        "steady_samples": steady_count.astype(np.int64), "settling_s": settling, "power_ftms": power_mean,
+        "power_lorenz": lorenz_mean, "error_mean_w": error_mean, "error_rms_w": error_rms, "error_pct": error_pct,
+        "target_error": target_error, "target_error_pct": target_error_pct,
+    }
+
+
+def analyze_session(session_path, plan_path, plan_start=None):
+    session = load_session(session_path)
+    plan = compile_plan(plan_path)
+    return analyze(session, plan, load_step_starts(session_path, plan, plan_start))
+
+
+def _format(value):
+    if isinstance(value, (float, np.floating)):
+        return "" if np.isnan(value) else f"{value:.2f}"
+    return str(value)
+
+
+def save_report(report, path):
+    with open(path, mode="w", newline="") as file:
+        writer = csv.writer(file, delimiter=";")
+        writer.writerow(REPORT_COLUMNS)
+        for i in range(len(report["step"])):
+            writer.writerow([_format(report[column][i]) for column in REPORT_COLUMNS])
+
+
+def format_report(report):
+    """Compact text table plus the session-wide error (steady samples only)."""
+    shown = ["step", "command", "value", "duration_s", "settling_s", "power_ftms", "power_lorenz", "error_mean_w",
+             "error_rms_w", "error_pct", "target_error"]
+    lines = [" ".join(f"{column:>12}" for column in shown)]
+    for i in range(len(report["step"])):
+        lines.append(" ".join(f"{_format(report[column][i]):>12}" for column in shown))
+    weights = report["steady_samples"].astype(np.float64)
+    ok = ~np.isnan(report["error_mean_w"]) & (weights > 0)
+    if ok.any():
+        mean = np.average(report["error_mean_w"][ok], weights=weights[ok])
+        rms = np.sqrt(np.average(report["error_rms_w"][ok] ** 2, weights=weights[ok]))
+        lines.append(f"Errore FTMS-Lorenz a regime: medio {mean:.2f} W, RMS {rms:.2f} W "
+                     f"su {int(weights[ok].sum())} campioni")
+    settled = report["settling_s"][~np.isnan(report["settling_s"])]
+    if settled.size:
+        lines.append(f"Assestamento: mediano {np.median(settled):.2f} s, massimo {settled.max():.2f} s, "
+                     f"{int(np.isnan(report['settling_s']).sum())} passi non assestati")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analisi per passo di una sessione registrata")
+    parser.add_argument("session", help="CSV della sessione o directory .cols")
+    parser.add_argument("plan", help="CSV del piano comandi eseguito")
+    parser.add_argument("--plan-start", type=float,
+                        help="Avvio del piano [s dall'inizio sessione]; se assente usa <stamp>_plan_timing.csv")
+    parser.add_argument("--report", help="Salva il rapporto per passo in CSV")
+    args = parser.parse_args(argv)
+    try:
+        report = analyze_session(args.session, args.plan, args.plan_start)
+    except (OSError, ValueError) as e:  # PlanError included
+        print(f"Errore: {e}", file=sys.stderr)
+        return 1
+    print(format_report(report))
+    if args.report:
+        save_report(report, args.report)
+        print(f"Rapporto salvato in {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
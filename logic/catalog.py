@@ -0,0 +1,315 @@
+"""Catalogo SQLite delle sessioni registrate in output/.
+
+    python -m logic.catalog update [--root output] [--workers 4]
+    python -m logic.catalog query --since 2024-05-01 --min-error-pct 5 [--rig banco1]
+    python -m logic.catalog sql "SELECT rig, COUNT(*) FROM sessions GROUP BY rig"
+
+`update` riassume in parallelo (un processo per file) solo le sessioni nuove o modificate
+(dimensione, mtime del CSV e del relativo plan_timing.csv) e rimuove quelle cancellate; le
+interrogazioni leggono solo l'indice. Il riassunto richiede numpy (logic.analysis),
+l'interrogazione no.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import logging
+import os
+import re
+import sqlite3
+import sys
+import time
+from logic.data_processing import timing_path_for
+
+DEFAULT_DB = os.path.join("output", "catalog.sqlite")
+SCHEMA_VERSION = 1
+GAP_MIN_S = 1.0  # buco: intervallo tra campioni oltre max(GAP_MIN_S, 5 periodi mediani)
+SESSION_NAME = re.compile(r"^(\d{8}_\d{6})(?:_(.*?))?(?:-\d+)?_bike_data_log\.(csv|cols)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    timing_mtime_ns INTEGER,
+    rig TEXT,
+    started TEXT,
+    rows INTEGER,
+    duration_s REAL,
+    sample_rate_hz REAL,
+    gaps INTEGER,
+    max_gap_s REAL,
+    power_mean REAL,
+    lorenz_coverage REAL,
+    plan_steps INTEGER,
+    error_mean_w REAL,
+    error_rms_w REAL,
+    error_pct REAL,
+    max_step_error_pct REAL,
+    settling_median_s REAL,
+    failure TEXT,
+    indexed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE INDEX IF NOT EXISTS sessions_rig ON sessions (rig, started);
+CREATE TABLE IF NOT EXISTS steps (
+    path TEXT NOT NULL REFERENCES sessions (path) ON DELETE CASCADE,
+    step INTEGER NOT NULL,
+    command TEXT,
+    value REAL,
+    duration_s REAL,
+    settling_s REAL,
+    power_ftms REAL,
+    power_lorenz REAL,
+    error_mean_w REAL,
+    error_rms_w REAL,
+    error_pct REAL,
+    target_error REAL,
+    PRIMARY KEY (path, step)
+);
+"""
+STEP_COLUMNS = ["step", "command", "value", "duration_s", "settling_s", "power_ftms", "power_lorenz", "error_mean_w",
+                "error_rms_w", "error_pct", "target_error"]
+
+
+def find_sessions(root):
+    """Session paths under root: *_bike_data_log.csv, or the .cols directory when there is no CSV."""
+    sessions = []
+    for directory, dirnames, filenames in os.walk(root):
+        names = set(filenames)
+        for name in filenames:
+            if SESSION_NAME.match(name) and name.endswith(".csv"):
+                sessions.append(os.path.join(directory, name))
+        for name in list(dirnames):
+            if SESSION_NAME.match(name):
+                dirnames.remove(name)  # Do not walk into columnar sessions
+                if name[:-len(".cols")] + ".csv" not in names:
+                    sessions.append(os.path.join(directory, name))
+    return sessions
+
+
+def _signature(path):
+    stat = os.stat(path)
+    if os.path.isdir(path):
+        size = sum(entry.stat().st_size for entry in os.scandir(path))
+        mtime_ns = max([stat.st_mtime_ns] + [entry.stat().st_mtime_ns for entry in os.scandir(path)])
+    else:
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+    timing_path = timing_path_for(path)
+    timing_mtime_ns = os.stat(timing_path).st_mtime_ns if timing_path and os.path.exists(timing_path) else None
+    return size, mtime_ns, timing_mtime_ns
+
+
+def _number(value):
+    """numpy scalar -> float/int for SQLite, NaN -> NULL."""
+    if value is None:
+        return None
+    value = value.item() if hasattr(value, "item") else value
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def summarize_session(path):
+    """Runs in a worker process: (session summary, step rows) of one session."""
+    import numpy as np
+    from logic import analysis
+
+    session = analysis.load_session(path, cache=False)  # No .npz next to every archived file
+    t = session["t"]
+    rows = len(t)
+    summary = {"rows": rows}
+    if rows:
+        duration = float(t[-1] - t[0])
+        dt = np.diff(t)
+        median_dt = float(np.median(dt)) if dt.size else 0.0
+        gap = np.maximum(GAP_MIN_S, 5 * median_dt)
+        summary.update({
+            "duration_s": duration,
+            "sample_rate_hz": (rows - 1) / duration if duration > 0 else None,
+            "gaps": int(np.count_nonzero(dt > gap)),
+            "max_gap_s": float(dt.max()) if dt.size else 0.0,
+            "power_mean": float(np.nanmean(session["power"])) if np.any(~np.isnan(session["power"])) else None,
+            "lorenz_coverage": float(np.mean(~np.isnan(session["power_lorenz"]))),
+        })
+    steps = []
+    timing_path = timing_path_for(path)
+    timing = analysis.read_plan_timing(timing_path) if rows and timing_path and os.path.exists(timing_path) else None
+    if timing is not None:
+        plan, starts = timing
+        report = analysis.analyze(session, plan, starts)
+        weights = report["steady_samples"].astype(np.float64)
+        ok = ~np.isnan(report["error_mean_w"]) & (weights > 0)
+        lorenz_ok = ok & ~np.isnan(report["power_lorenz"])
+        summary["plan_steps"] = len(plan)
+        if ok.any():
+            summary["error_mean_w"] = float(np.average(report["error_mean_w"][ok], weights=weights[ok]))
+            summary["error_rms_w"] = float(np.sqrt(np.average(report["error_rms_w"][ok] ** 2, weights=weights[ok])))
+        if lorenz_ok.any():
+            lorenz_mean = np.average(report["power_lorenz"][lorenz_ok], weights=weights[lorenz_ok])
+            if lorenz_mean:
+                summary["error_pct"] = float(100.0 * summary["error_mean_w"] / lorenz_mean)
+            step_pct = np.abs(report["error_pct"][lorenz_ok])
+            step_pct = step_pct[np.isfinite(step_pct)]
+            if step_pct.size:
+                summary["max_step_error_pct"] = float(step_pct.max())
+        settled = report["settling_s"][~np.isnan(report["settling_s"])]
+        if settled.size:
+            summary["settling_median_s"] = float(np.median(settled))
+        for i in range(len(plan)):
+            steps.append([_number(report[column][i]) if column != "command" else str(report[column][i])
+                          for column in STEP_COLUMNS])
+    return summary, steps
+
+
+def _summarize_safely(path):
+    try:
+        return path, summarize_session(path), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+class SessionCatalog:
+    """SQLite index of session summaries, updated incrementally by file size and mtime."""
+
+    def __init__(self, db_path=DEFAULT_DB):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def update(self, root="output", workers=None, batch=50):
+        """Summarizes new or changed sessions in a process pool; returns counters of the run."""
+        t0 = time.monotonic()
+        known = {row["path"]: (row["size"], row["mtime_ns"], row["timing_mtime_ns"])
+                 for row in self.connection.execute("SELECT path, size, mtime_ns, timing_mtime_ns FROM sessions")}
+        paths = [os.path.normpath(path) for path in find_sessions(root)]
+        signatures = {}
+        for path in paths:
+            try:
+                signatures[path] = _signature(path)
+            except OSError:
+                continue  # Removed while scanning
+        changed = [path for path, signature in signatures.items() if known.get(path) != signature]
+        removed = [path for path in known if path not in signatures and path.startswith(os.path.normpath(root))]
+        with self.connection:
+            self.connection.executemany("DELETE FROM sessions WHERE path = ?", [(path,) for path in removed])
+
+        stats = {"sessions": len(signatures), "updated": 0, "unchanged": len(signatures) - len(changed),
+                 "removed": len(removed), "failed": 0}
+        if changed:
+            pending = 0
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_summarize_safely, path) for path in changed]
+                for future in as_completed(futures):
+                    path, result, failure = future.result()
+                    self._store(path, signatures[path], result, failure)
+                    stats["failed" if failure else "updated"] += 1
+                    if failure:
+                        logging.getLogger().warning(f"Sessione {path} non analizzabile: {failure}")
+                    pending += 1
+                    if pending >= batch:
+                        self.connection.commit()
+                        pending = 0
+            self.connection.commit()
+        stats["elapsed_s"] = round(time.monotonic() - t0, 3)
+        return stats
+
+    def _store(self, path, signature, result, failure):
+        match = SESSION_NAME.match(os.path.basename(path.rstrip("/\\")))
+        started = rig = None
+        if match:
+            started = datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").isoformat()
+            rig = match.group(2)
+        summary, steps = result if result else ({}, [])
+        record = {"path": path, "size": signature[0], "mtime_ns": signature[1], "timing_mtime_ns": signature[2],
+                  "rig": rig, "started": started, "failure": failure,
+                  "indexed_at": datetime.now().isoformat(timespec="seconds"), **summary}
+        columns = ", ".join(record)
+        placeholders = ", ".join("?" for _ in record)
+        self.connection.execute("DELETE FROM sessions WHERE path = ?", (path,))
+        self.connection.execute(f"INSERT INTO sessions ({columns}) VALUES ({placeholders})", list(record.values()))
+        self.connection.executemany(
+            f"INSERT INTO steps (path, {', '.join(STEP_COLUMNS)}) VALUES (?{', ?' * len(STEP_COLUMNS)})",
+            [[path, *step] for step in steps])
+
+    def query(self, since=None, until=None, rig=None, min_error_pct=None, order="started"):
+        """Sessions filtered on start date (ISO), rig and |error_pct| or worst step error >= min_error_pct."""
+        clauses, params = [], []
+        if since:
+            clauses.append("started >= ?")
+            params.append(since)
+        if until:
+            clauses.append("started < ?")
+            params.append(until)
+        if rig:
+            clauses.append("rig = ?")
+            params.append(rig)
+        if min_error_pct is not None:
+            clauses.append("(ABS(error_pct) >= ? OR max_step_error_pct >= ?)")
+            params += [min_error_pct, min_error_pct]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = order if order in ("started", "error_pct", "duration_s", "rig") else "started"
+        return self.connection.execute(f"SELECT * FROM sessions {where} ORDER BY {order}", params).fetchall()
+
+    def sql(self, statement, params=()):
+        return self.connection.execute(statement, params).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def _print_rows(rows, columns=None):
+    if not rows:
+        print("Nessuna sessione")
+        return
+    columns = columns or rows[0].keys()
+    print(";".join(columns))
+    for row in rows:
+        print(";".join("" if row[column] is None else
+                       f"{row[column]:.2f}" if isinstance(row[column], float) else str(row[column])
+                       for column in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catalogo SQLite delle sessioni registrate")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+    update = commands.add_parser("update", help="Indicizza le sessioni nuove o modificate")
+    update.add_argument("--root", default="output")
+    update.add_argument("--workers", type=int, help="Processi paralleli (default: numero di CPU)")
+    query = commands.add_parser("query", help="Elenca le sessioni indicizzate")
+    query.add_argument("--since", help="Data ISO di inizio (inclusa)")
+    query.add_argument("--until", help="Data ISO di fine (esclusa)")
+    query.add_argument("--rig")
+    query.add_argument("--min-error-pct", type=float, help="Errore FTMS-Lorenz minimo [%%] (sessione o passo peggiore)")
+    query.add_argument("--order", default="started")
+    sql = commands.add_parser("sql", help="Esegue una query SQL sull'indice")
+    sql.add_argument("statement")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    catalog = SessionCatalog(args.db)
+    try:
+        if args.command == "update":
+            print(catalog.update(args.root, args.workers))
+        elif args.command == "query":
+            t0 = time.perf_counter()
+            rows = catalog.query(args.since, args.until, args.rig, args.min_error_pct, args.order)
+            _print_rows(rows, ["started", "rig", "duration_s", "sample_rate_hz", "gaps", "plan_steps", "error_pct",
+                               "max_step_error_pct", "path"])
+            print(f"{len(rows)} sessioni in {1000 * (time.perf_counter() - t0):.1f} ms")
+        else:
+            _print_rows(catalog.sql(args.statement))
+    finally:
+        catalog.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
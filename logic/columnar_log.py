@@ -0,0 +1,218 @@
+"""Typed, fixed-width columnar session format.
+
+A session is a directory (``<stamp>_bike_data_log.cols``) with a ``schema.json`` and
+one raw little-endian file per column. Rows are appended to every column file in
+chunks, so a column can be mapped with ``mmap`` or ``numpy.memmap`` without parsing.
+Missing values are NaN for float columns and INT_MISSING for integer columns. Sample values
+are stored as float64, so fractional values (e.g. FTMS resistance, 0.1 resolution) are kept
+exactly as the CSV log writes them; sessions written with integer value columns stay readable,
+since schema.json records the type of every column.
+
+    python -m logic.columnar_log output/20240101_120000_bike_data_log.cols [out.csv]
+"""
+from array import array
+import csv
+from datetime import datetime
+import json
+import math
+import mmap
+import os
+import sys
+
+FORMAT_VERSION = 1
+INT_MISSING = -2 ** 31
+
+# (colonna, typecode array/memoryview, dtype numpy); stesso ordine di data_processing.CSV_HEADER
+COLUMNS = [
+    ("timestamp", "q", "<i8"),  # wall clock, ns since epoch
+    ("ms", "i", "<i4"),  # decimi di secondo dall'avvio sessione, come nel CSV
+    ("speed", "d", "<f8"),
+    ("cadence", "d", "<f8"),
+    ("power", "d", "<f8"),
+    ("total_distance", "d", "<f8"),
+    ("resistance", "d", "<f8"),
+    ("elapsed_time", "d", "<f8"),
+    ("offset", "d", "<f8"),
+    ("speed_avg", "d", "<f8"),
+    ("torque_lorenz", "d", "<f8"),
+    ("power_lorenz", "d", "<f8"),
+    ("bench_speed", "d", "<f8"),  # velocità rulli letta dal banco [km/h]
+]
+SCHEMA_FILE = "schema.json"
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, f"{name}.bin")
+
+
+def _to_int(value):
+    if value is None or value == "":
+        return INT_MISSING
+    return int(round(float(value)))
+
+
+def _to_float(value):
+    if value is None or value == "":
+        return math.nan
+    return float(value)
+
+
+class ColumnarSessionSink:
+    """SessionWriter sink that appends samples (logic.sample) to per-column files in chunks.
+
+    Each column has a buffer of chunk_rows values allocated once; batches are copied into it
+    and a full chunk is written with a single tofile() per column.
+    """
+
+    def __init__(self, directory, timebase, chunk_rows=4096, extra_fields=()):
+        self.filename = directory
+        self.timebase = timebase
+        self.chunk_rows = chunk_rows
+        self.columns = COLUMNS + [(field, "d", "<f8") for field in extra_fields]
+        os.makedirs(directory, exist_ok=True)
+        schema_path = os.path.join(directory, SCHEMA_FILE)
+        if not os.path.exists(schema_path):
+            with open(schema_path, "w") as file:
+                json.dump({"version": FORMAT_VERSION, "byteorder": "little", "int_missing": INT_MISSING,
+                           "columns": [{"name": name, "dtype": dtype} for name, _, dtype in self.columns]}, file,
+                          indent=2)
+        self.files = [open(_column_path(directory, name), "ab") for name, _, _ in self.columns]
+        self.buffers = [array(typecode, bytes(array(typecode).itemsize * chunk_rows)) for _, typecode, _ in self.columns]
+        self.rows = 0  # righe occupate nei buffer
+        self.converters = [_to_float if typecode == "d" else _to_int for _, typecode, _ in self.columns[2:]]
+
+    def write_rows(self, items):
+        start_time, start_ns = self.timebase.start_time, self.timebase.start_monotonic_ns
+        timestamps, ms = self.buffers[0], self.buffers[1]
+        value_columns = list(zip(self.buffers[2:], self.converters))
+        for sample in items:
+            if self.rows == self.chunk_rows:
+                self._write_chunk()
+            row = self.rows
+            wall_time = start_time + (sample.t_ns - start_ns) / 1e9
+            timestamps[row] = int(wall_time * 1e9)
+            ms[row] = int((wall_time - start_time) * 10)
+            for (buffer, convert), value in zip(value_columns, sample.values):
+                buffer[row] = convert(value)
+            self.rows = row + 1
+        if self.rows == self.chunk_rows:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if not self.rows:
+            return
+        for file, buffer in zip(self.files, self.buffers):
+            chunk = buffer if self.rows == self.chunk_rows else buffer[:self.rows]
+            if sys.byteorder != "little":
+                chunk = array(chunk.typecode, chunk)
+                chunk.byteswap()
+            chunk.tofile(file)
+        self.rows = 0
+
+    def flush(self):
+        self._write_chunk()
+        for file in self.files:
+            file.flush()
+
+    def fsync(self):
+        for file in self.files:
+            os.fsync(file.fileno())
+
+    def close(self):
+        self._write_chunk()
+        for file in self.files:
+            file.close()
+
+
+class ColumnarSession:
+    """Read-only view of a columnar session; columns are memory mapped, not copied."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, SCHEMA_FILE)) as file:
+            self.schema = json.load(file)
+        if self.schema.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Versione formato colonnare non supportata: {self.schema.get('version')}")
+        self.dtypes = {column["name"]: column["dtype"] for column in self.schema["columns"]}
+        self.names = list(self.dtypes)
+        self._maps = {}
+        # A crash can leave the last chunk partially written: the session length is the shortest column
+        self.rows = min(os.path.getsize(_column_path(directory, name)) // int(dtype[-1])
+                        for name, dtype in self.dtypes.items())
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        """Zero-copy memoryview over the column file (native typecode 'q', 'i' or 'd')."""
+        dtype = self.dtypes[name]
+        itemsize = int(dtype[-1])
+        typecode = {"<i8": "q", "<i4": "i", "<f8": "d"}[dtype]
+        if self.rows == 0:
+            return memoryview(array(typecode))
+        if sys.byteorder != "little":
+            values = array(typecode)
+            with open(_column_path(self.directory, name), "rb") as file:
+                values.fromfile(file, self.rows)
+            values.byteswap()
+            return memoryview(values)
+        if name not in self._maps:
+            with open(_column_path(self.directory, name), "rb") as file:
+                self._maps[name] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._maps[name])[:self.rows * itemsize].cast(typecode)
+
+    def to_numpy(self):
+        """Returns {column: numpy.memmap}; requires numpy."""
+        import numpy as np
+        return {name: np.memmap(_column_path(self.directory, name), dtype=dtype, mode="r", shape=(self.rows,))
+                for name, dtype in self.dtypes.items()}
+
+    def iter_rows(self):
+        columns = [self.column(name) for name in self.names]
+        for i in range(self.rows):
+            yield [column[i] for column in columns]
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _format_value(value):
+    if value is None or value == INT_MISSING or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)  # 200.0 -> "200", as the CSV sink writes it
+    return value
+
+
+def export_csv(directory, csv_path=None):
+    """Writes the session in the semicolon CSV layout of DataProcessor.initialize_csv.
+
+    Whole numbers are written without decimals (200.0 -> 200), as the CSV sink does, so both backends
+    give the same text.
+
+    Never overwrites: raises FileExistsError if the target CSV already exists.
+    """
+    if csv_path is None:
+        csv_path = directory[:-len(".cols")] + ".csv" if directory.endswith(".cols") else directory + ".csv"
+    with ColumnarSession(directory) as session, open(csv_path, mode="x", newline="") as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(session.names)
+        for row in session.iter_rows():
+            timestamp = datetime.fromtimestamp(row[0] / 1e9).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+            writer.writerow([timestamp, row[1], *(_format_value(value) for value in row[2:])])
+    return csv_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python -m logic.columnar_log <sessione.cols> [uscita.csv]")
+        sys.exit(1)
+    print(export_csv(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
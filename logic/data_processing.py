@@ -1,73 +1,187 @@
 import csv
+import itertools
+import logging
 from datetime import datetime
 import time
 import os
+import threading
+from logic.columnar_log import ColumnarSessionSink
+from logic.plan import PlanError, compile_plan
+from logic.sample import SampleSchema, SessionTimebase
+from logic.session_writer import CsvSessionSink, SessionWriter
+
+# Campi del campione, nell'ordine delle colonne dopo "timestamp" e "ms"
+DATA_FIELDS = ["speed", "cadence", "power", "total_distance", "resistance", "elapsed_time", "offset", "speed_avg",
+               "torque_lorenz", "power_lorenz", "bench_speed"]
+CSV_HEADER = ["timestamp", "ms", *DATA_FIELDS]
+EVENTS_HEADER = ["timestamp", "ms", "event", "link", "detail"]
+# Formati della sessione selezionabili da riga di comando (--backend) o per banco ("backends" in logic.rigs)
+BACKENDS = {"csv": ("csv",), "columnar": ("columnar",), "both": ("csv", "columnar")}
+
+
+def timing_path_for(session_path):
+    """<stamp>_plan_timing.csv written by the engine next to a session (CSV or .cols), None for other files."""
+    base = session_path.rstrip("/\\")
+    for suffix in ("bike_data_log.csv", "bike_data_log.cols"):
+        if base.endswith(suffix):
+            return base[:-len(suffix)] + "plan_timing.csv"
+    return None
+
 
 class DataProcessor:
-    def __init__(self):
-        self.start_time = time.time()
-        self.output_dir = "output"
-        self.create_output_dir()
-        self.csv_filename = os.path.join(self.output_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_bike_data_log.csv")
-        self.initialize_csv()
+    def __init__(self, fsync_policy="close", flush_interval=1.0, backends=("csv",), extra_fields=(), name=None,
+                 output_dir="output", metrics=None):
+        # backends: "csv" (log testuale storico) e/o "columnar" (colonne binarie, vedi logic.columnar_log);
+        # anche una chiave di BACKENDS ("both")
+        # extra_fields: colonne aggiuntive accodate allo schema standard (es. statistiche Lorenz della fusione)
+        # name: nome del banco, inserito nel nome file (più banchi nello stesso processo, vedi logic.rigs)
+        # metrics: MetricsRegistry del banco (vedi logic.metrics)
+        # The session (time origin, files, writer thread) starts with start() or the first sample
+        self.fsync_policy = fsync_policy
+        self.flush_interval = flush_interval
+        if isinstance(backends, str):
+            backends = BACKENDS.get(backends, (backends,))
+        unknown = [backend for backend in backends if backend not in BACKENDS["both"]]
+        if unknown or not backends:
+            raise ValueError(f"Formato sessione non valido: {', '.join(unknown) or 'nessuno'} "
+                             f"(ammessi {', '.join(BACKENDS)})")
+        self.backends = tuple(backends)
+        self.extra_fields = extra_fields
+        self.name = name
+        self.metrics = metrics
+        self.fields = DATA_FIELDS + list(extra_fields)
+        self.schema = SampleSchema(self.fields, derived=extra_fields)  # Layout of the recorded samples
+        self.timebase = SessionTimebase()
+        self.output_dir = output_dir
+        self.csv_filename = None
+        self.columnar_dirname = None
+        self.events_filename = None
+        self.writer = None
+        self.start_lock = threading.Lock()
+        self.events_lock = threading.Lock()
+        self.events = 0
+
+    # Session time origin, shared with the sinks that convert sample times when writing
+    @property
+    def start_time(self):
+        return self.timebase.start_time
+
+    @start_time.setter
+    def start_time(self, value):
+        self.timebase.start_time = value
+
+    @property
+    def session_path(self):
+        """File (or .cols directory, without the csv backend) of the current session, None before it starts."""
+        return self.csv_filename if "csv" in self.backends else self.columnar_dirname
+
+    @property
+    def start_monotonic_ns(self):
+        return self.timebase.start_monotonic_ns
+
+    @start_monotonic_ns.setter
+    def start_monotonic_ns(self, value):
+        self.timebase.start_monotonic_ns = value
+
+    def start(self):
+        """Starts the recording session: time origin, session files and writer thread (idempotent)."""
+        with self.start_lock:
+            if self.writer is not None:
+                return
+            self.start_time = time.time()
+            self.start_monotonic_ns = time.monotonic_ns()
+            self.create_output_dir()
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            prefix = f"{stamp}_{self.name}" if self.name else stamp
+            # Sessions started in the same second get a -2, -3... suffix instead of sharing a file
+            for n in itertools.count(1):
+                base = prefix if n == 1 else f"{prefix}-{n}"
+                self.csv_filename = os.path.join(self.output_dir, f"{base}_bike_data_log.csv")
+                self.columnar_dirname = self.csv_filename[:-len(".csv")] + ".cols"
+                if os.path.exists(self.columnar_dirname):
+                    continue
+                if "csv" in self.backends:
+                    if self.initialize_csv():
+                        break
+                elif not os.path.exists(self.csv_filename):
+                    break
+            sinks = []
+            if "csv" in self.backends:
+                sinks.append(CsvSessionSink(self.csv_filename, self.timebase))
+            if "columnar" in self.backends:
+                sinks.append(ColumnarSessionSink(self.columnar_dirname, self.timebase, extra_fields=self.extra_fields))
+            self.events_filename = self.csv_filename[:-len("bike_data_log.csv")] + "events.csv"
+            self.writer = SessionWriter(sinks, flush_interval=self.flush_interval, fsync_policy=self.fsync_policy,
+                                        metrics=self.metrics)
+        logging.getLogger().info(f"Sessione di registrazione {self.session_path} avviata")
+
+    def is_started(self):
+        return self.writer is not None
 
     def create_output_dir(self):
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
     def initialize_csv(self):
+        """Creates the CSV with its header; returns False if the file already exists."""
         try:
             with open(self.csv_filename, mode='x', newline='') as file:
                 writer = csv.writer(file, delimiter=';')
-                writer.writerow(["timestamp", "ms", "speed", "cadence", "power", "total_distance", "resistance", "elapsed_time", "offset", "speed_avg", "torque_lorenz", "power_lorenz"])
+                writer.writerow(CSV_HEADER + self.fields[len(DATA_FIELDS):])
         except FileExistsError:
-            pass
-
-    def handle_bike_data(self, data):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        elapsed_deciseconds = int((time.time() - self.start_time) * 10)
-        row = [
-            timestamp,
-            elapsed_deciseconds,
-            data.get("speed", ""),
-            data.get("cadence", ""),
-            data.get("power", ""),
-            data.get("total_distance", ""),
-            data.get("resistance", ""),
-            data.get("elapsed_time", ""),
-            data.get("offset", ""),
-            data.get("speed_avg", ""),
-            data.get("torque_lorenz", ""),
-            data.get("power_lorenz", "")
-        ]
-        with open(self.csv_filename, mode='a', newline='') as file:
-            writer = csv.writer(file, delimiter=';')
-            writer.writerow(row)
+            return False
+        return True
+
+    def record(self, sample):
+        # Called on the acquisition path: the sample (logic.sample.Sample, laid out by self.schema) is queued
+        # as is; wall time, ms and formatting are computed by the sinks on the writer thread.
+        if self.writer is None:
+            self.start()
+        self.writer.submit(sample)
+
+    def handle_bike_data(self, data, t_ns=None):
+        """Records a row given as a dict of fields; t_ns is the time.monotonic_ns() it refers to (default: now)."""
+        self.record(self.schema.from_dict(time.monotonic_ns() if t_ns is None else t_ns, data))
+
+    def mark_event(self, event, link, detail="", t_ns=None):
+        """Appends a marker (e.g. "gap"/"resume" of a link) to the session events file, on the data time base.
+
+        Events are rare, so they are written and flushed immediately; the file is created at the first one.
+        """
+        self.start()
+        now = self.timebase.wall(time.monotonic_ns() if t_ns is None else t_ns)
+        timestamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        try:
+            with self.events_lock:
+                new = not os.path.exists(self.events_filename)
+                with open(self.events_filename, mode='a', newline='') as file:
+                    writer = csv.writer(file, delimiter=';')
+                    if new:
+                        writer.writerow(EVENTS_HEADER)
+                    writer.writerow([timestamp, int((now - self.start_time) * 10), event, link, detail])
+                self.events += 1
+        except OSError as e:
+            logging.getLogger().error(f"Impossibile scrivere l'evento {event} in {self.events_filename}: {e}")
+
+    def writer_stats(self):
+        if self.writer is None:
+            return {"submitted": 0, "written": 0, "dropped": 0, "backlog": 0, "max_backlog": 0, "errors": 0}
+        return self.writer.stats()
+
+    def close(self):
+        if self.writer is None:
+            return  # No session was recorded
+        self.writer.close()
+        stats = self.writer.stats()
+        logging.getLogger().info(f"Sessione {self.session_path} chiusa: {stats['written']} righe scritte, {stats['dropped']} scartate")
 
     @staticmethod
     def read_brake_commands_from_csv(file_path):
-        brake_commands = []
+        """Compiled plan (see logic.plan), or an empty list if the file is missing or invalid."""
         try:
-            with open(file_path, mode='r') as file:
-                reader = csv.reader(file, delimiter=';')
-                next(reader)  # Salta la prima riga (intestazione)
-                for row in reader:
-                    if row[1]:  # Se c'è un valore nella seconda colonna
-                        command_type = "livelli"
-                        value = int(row[1])
-                    elif row[2]:  # Se c'è un valore nella terza colonna
-                        command_type = "potenza"
-                        value = int(row[2])
-                    elif row[3]:  # Se c'è un valore nella quarta colonna
-                        command_type = "simulazione"
-                        value = int(row[3])
-
-                    speed_banco = None
-                    if len(row) >= 5: # Assicurati che la riga abbia almeno 5 colonne
-                        speed_banco = int(row[4]) if row[4] else None
-
-                    wait_time = int(row[0])
-                    brake_commands.append((command_type, value, wait_time, speed_banco))
-        except Exception as e:
-            print(e)
-        return brake_commands
+            return compile_plan(file_path)
+        except PlanError as e:
+            logging.getLogger().error(str(e))
+        except OSError as e:
+            logging.getLogger().error(f"Impossibile leggere il piano {file_path}: {e}")
+        return []
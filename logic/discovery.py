@@ -0,0 +1,253 @@
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+import threading
+import time
+from logic.startup import resolve
+
+KNOWN_TRAINERS_FILE = "known_trainers.json"
+MAX_KNOWN_TRAINERS = 20
+RSSI_ALPHA = 0.3  # peso dell'ultima lettura nella media esponenziale dell'RSSI
+DEVICE_STALE_S = 10  # dispositivi non visti da più di tanto sono considerati non aggiornati
+DEVICE_EXPIRE_S = 6 * DEVICE_STALE_S  # ... e tolti dalla cache (rulli noti esclusi)
+_known_lock = threading.Lock()  # più banchi nello stesso processo condividono il file
+
+
+class DiscoveredDevice:
+    __slots__ = ("address", "name", "rssi", "last_rssi", "first_seen", "last_seen", "seen")
+
+    def __init__(self, address, name, rssi, now):
+        self.address = address
+        self.name = name
+        self.rssi = rssi  # media esponenziale
+        self.last_rssi = rssi
+        self.first_seen = now
+        self.last_seen = now
+        self.seen = 1
+
+    def age(self, now=None):
+        return (now if now is not None else time.monotonic()) - self.last_seen
+
+
+def load_known_trainers(path=KNOWN_TRAINERS_FILE):
+    """{address: {"name", "last_connected", "connections"}}, empty if the file is missing or unreadable."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            known = json.load(file)
+        return known if isinstance(known, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.getLogger().warning(f"File rulli noti {path} non leggibile: {e}")
+        return {}
+
+
+class DeviceDiscovery:
+    """Background BLE scanner on the AsyncioWorker loop with a cache of the devices seen.
+
+    Short scans (`scan_window` s, every `scan_window + scan_pause` s) refresh each device's
+    name, exponentially smoothed RSSI and last-seen time; readers take snapshots and use
+    `version` to redraw only after a change. Scanning pauses while a connection is being set up
+    (paused()) and, unless scan_while_connected, while a trainer is connected, so it never
+    competes with the link that carries the notifications and brake commands.
+    Devices not seen for `expire_after` s are dropped from the cache at the next scan (phones with
+    random addresses would otherwise pile up); known trainers are always listed.
+    Trainers connected successfully are remembered in `known_path`, so a known address can be
+    connected directly, without waiting for a scan.
+    """
+
+    def __init__(self, worker, ble_manager, scan_window=2.0, scan_pause=1.0, scan_while_connected=False,
+                 known_path=KNOWN_TRAINERS_FILE, expire_after=DEVICE_EXPIRE_S):
+        self.worker = worker
+        self.ble_manager = ble_manager
+        self.scan_window = scan_window
+        self.scan_pause = scan_pause
+        self.scan_while_connected = scan_while_connected
+        self.expire_after = expire_after
+        self.known_path = known_path
+        self.known = load_known_trainers(known_path) if known_path else {}
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.version = 0
+        self.scans = 0
+        self.errors = 0
+        self.pauses = 0
+        self.interrupted = 0
+        self.expired = 0
+        self.running = False
+        self.task = None
+        self.scan_task = None
+        self.loop = None
+
+    # --- Scansione ---
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        resolve(self.ble_manager)  # A lazily built manager is created here, never on the event loop
+        self.worker.run_coroutine(self._start()).result()
+        logging.getLogger().info("Ricerca dispositivi BLE in background avviata")
+
+    async def _start(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.task is not None:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+            self.task = None
+        logging.getLogger().info("Ricerca dispositivi BLE in background fermata")
+
+    def is_running(self):
+        return self.running
+
+    @contextmanager
+    def paused(self):
+        """Suspends scanning for the duration of the block (e.g. while connecting); a scan in progress is cut short."""
+        with self.lock:
+            self.pauses += 1
+            scan = self.scan_task
+        if scan is not None:
+            self.loop.call_soon_threadsafe(scan.cancel)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.pauses -= 1
+
+    def _can_scan(self):
+        if self.pauses:
+            return False
+        return self.scan_while_connected or not self.ble_manager.get_connection_status()
+
+    async def _run(self):
+        while self.running:
+            if not self._can_scan():
+                await asyncio.sleep(0.2)
+                continue
+            with self.lock:
+                self.scan_task = asyncio.ensure_future(self.ble_manager.scan_devices(timeout=self.scan_window))
+            try:
+                found = await self.scan_task
+                self._merge(found)
+                self.scans += 1
+            except asyncio.CancelledError:
+                if not self.running:
+                    raise
+                self.interrupted += 1  # Paused for a connection: start over when it is done
+                continue
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1 or self.errors % 20 == 0:
+                    logging.getLogger().error(f"Errore durante la scansione BLE ({self.errors} errori): {e}")
+            finally:
+                with self.lock:
+                    self.scan_task = None
+            await asyncio.sleep(self.scan_pause)
+
+    def _merge(self, found):
+        now = time.monotonic()
+        with self.lock:
+            for address, (name, rssi) in found.items():
+                device = self.devices.get(address)
+                if device is None:
+                    self.devices[address] = DiscoveredDevice(address, name, rssi, now)
+                    logging.getLogger().info(f"Dispositivo trovato: {name} - {address} - RSSI: {rssi}")
+                    continue
+                if name:
+                    device.name = name
+                if rssi is not None:
+                    device.rssi = rssi if device.rssi is None else device.rssi + RSSI_ALPHA * (rssi - device.rssi)
+                    device.last_rssi = rssi
+                device.last_seen = now
+                device.seen += 1
+            expired = [address for address, device in self.devices.items()
+                       if device.age(now) > self.expire_after and address not in self.known]
+            for address in expired:
+                del self.devices[address]
+            self.expired += len(expired)
+            self.version += 1
+
+    def snapshot(self):
+        """[(address, name, smoothed rssi, seconds since last seen, known)], known trainers first.
+
+        Known trainers that were not seen yet are included with rssi and age None.
+        """
+        now = time.monotonic()
+        with self.lock:
+            seen = {address: (device.name, device.rssi, device.age(now)) for address, device in self.devices.items()}
+            known = dict(self.known)
+        entries = []
+        for address, info in sorted(known.items(), key=lambda item: item[1].get("last_connected", ""), reverse=True):
+            name, rssi, age = seen.pop(address, (info.get("name"), None, None))
+            entries.append((address, name or info.get("name"), rssi, age, True))
+        for address, (name, rssi, age) in sorted(seen.items(), key=lambda item: -(item[1][1] or -999)):
+            entries.append((address, name, rssi, age, False))
+        return entries
+
+    def scan_once(self, timeout=5.0):
+        """Blocking one-off scan merged into the cache; returns {address: (name, rssi)} as scan_devices."""
+        found = self.worker.run_coroutine(self.ble_manager.scan_devices(timeout=timeout)).result()
+        self._merge(found)
+        return found
+
+    def stats(self):
+        return {"running": self.running, "devices": len(self.devices), "known": len(self.known), "scans": self.scans,
+                "interrupted": self.interrupted, "expired": self.expired, "errors": self.errors}
+
+    # --- Rulli noti ---
+
+    def name_of(self, address):
+        with self.lock:
+            device = self.devices.get(address)
+            if device is not None and device.name:
+                return device.name
+            return self.known.get(address, {}).get("name")
+
+    def find_known(self, name):
+        """Address of the most recently used known trainer whose name contains `name` (case-insensitive)."""
+        name = name.lower()
+        with self.lock:
+            candidates = [(info.get("last_connected", ""), address) for address, info in self.known.items()
+                          if name in (info.get("name") or "").lower()]
+        return max(candidates)[1] if candidates else None
+
+    def remember(self, address, name=None):
+        """Records a successful connection in the known-trainers file (most recent MAX_KNOWN_TRAINERS kept)."""
+        name = name or self.name_of(address)
+        with _known_lock:
+            known = load_known_trainers(self.known_path) if self.known_path else dict(self.known)
+            entry = known.get(address, {})
+            known[address] = {"name": name or entry.get("name"),
+                              "last_connected": datetime.now().isoformat(timespec="seconds"),
+                              "connections": entry.get("connections", 0) + 1}
+            if len(known) > MAX_KNOWN_TRAINERS:
+                newest = sorted(known.items(), key=lambda item: item[1].get("last_connected", ""), reverse=True)
+                known = dict(newest[:MAX_KNOWN_TRAINERS])
+            self._save_known(known)
+
+    def forget(self, address):
+        with _known_lock:
+            known = load_known_trainers(self.known_path) if self.known_path else dict(self.known)
+            known.pop(address, None)
+            self._save_known(known)
+
+    def _save_known(self, known):
+        if self.known_path:
+            try:
+                temporary = f"{self.known_path}.{os.getpid()}.tmp"
+                with open(temporary, "w", encoding="utf-8") as file:
+                    json.dump(known, file, indent=1)
+                os.replace(temporary, self.known_path)
+            except OSError as e:
+                logging.getLogger().warning(f"Impossibile salvare i rulli noti in {self.known_path}: {e}")
+        with self.lock:
+            self.known = known
+            self.version += 1
@@ -0,0 +1,163 @@
+from concurrent.futures import Future
+import heapq
+import itertools
+import logging
+import threading
+import time
+from logic.metrics import MetricsRegistry
+
+# Priorità: valori più bassi vengono eseguiti prima
+PRIORITY_CONTROL = 0  # setpoint freno / banco
+PRIORITY_NORMAL = 1  # connessioni, letture offset
+PRIORITY_DISCOVERY = 2  # scansioni
+
+
+class _Command:
+    __slots__ = ("priority", "seq", "key", "fn", "args", "kwargs", "future", "enqueued")
+
+    def __init__(self, priority, seq, key, fn, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class CommandLane:
+    """One worker thread per device with a priority queue.
+
+    Commands submitted with a coalesce_key replace a still-queued command with the same key
+    (latest wins): the newer function/arguments take the older slot and the older future is cancelled.
+    Queue wait is measured from the submission of the command that actually runs.
+    """
+
+    def __init__(self, name, metrics=None):
+        self.name = name
+        self.heap = []
+        self.pending_by_key = {}
+        self.condition = threading.Condition()
+        self.seq = itertools.count()
+        self.closed = False
+        self.submitted = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_last = 0.0
+        self.running = None
+        metrics = metrics or MetricsRegistry()
+        labels = {"lane": name}
+        self.wait_seconds = metrics.histogram("command_wait_seconds", "Attesa in coda dei comandi", labels)
+        self.run_seconds = metrics.histogram("command_run_seconds", "Durata di esecuzione dei comandi", labels)
+        metrics.gauge("command_queue_depth", "Comandi in coda", labels, fn=self.depth)
+        metrics.counter("commands_submitted_total", "Comandi inviati alla corsia", labels, fn=lambda: self.submitted)
+        metrics.counter("commands_coalesced_total", "Comandi sostituiti da uno più recente", labels,
+                        fn=lambda: self.coalesced)
+        metrics.counter("command_errors_total", "Comandi terminati con errore", labels, fn=lambda: self.errors)
+        self.thread = threading.Thread(target=self._run, name=f"Lane-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, priority=PRIORITY_NORMAL, coalesce_key=None, **kwargs):
+        with self.condition:
+            if self.closed:
+                raise RuntimeError(f"Corsia comandi {self.name} chiusa")
+            self.submitted += 1
+            queued = self.pending_by_key.get(coalesce_key) if coalesce_key is not None else None
+            if queued is not None:
+                queued.future.cancel()
+                queued.fn, queued.args, queued.kwargs = fn, args, kwargs
+                queued.future = Future()
+                queued.enqueued = time.monotonic()
+                self.coalesced += 1
+                if priority < queued.priority:
+                    queued.priority = priority
+                    heapq.heapify(self.heap)
+                return queued.future
+            command = _Command(priority, next(self.seq), coalesce_key, fn, args, kwargs)
+            heapq.heappush(self.heap, command)
+            if coalesce_key is not None:
+                self.pending_by_key[coalesce_key] = command
+            self.max_depth = max(self.max_depth, len(self.heap))
+            self.condition.notify()
+            return command.future
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.heap and not self.closed:
+                    self.condition.wait()
+                if not self.heap:
+                    return
+                command = heapq.heappop(self.heap)
+                if command.key is not None:
+                    del self.pending_by_key[command.key]
+                self.running = command
+            wait = time.monotonic() - command.enqueued
+            self.wait_last = wait
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.wait_seconds.observe(wait)
+            if command.future.set_running_or_notify_cancel():
+                t0 = time.perf_counter()
+                try:
+                    command.future.set_result(command.fn(*command.args, **command.kwargs))
+                except Exception as e:
+                    self.errors += 1
+                    logging.getLogger().error(f"Errore comando su corsia {self.name}: {e}")
+                    command.future.set_exception(e)
+                self.run_seconds.observe_since(t0)
+            self.executed += 1
+            self.running = None
+
+    def depth(self):
+        return len(self.heap)
+
+    def stats(self):
+        executed = self.executed or 1
+        return {
+            "depth": self.depth(),
+            "max_depth": self.max_depth,
+            "busy": self.running is not None,
+            "submitted": self.submitted,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "wait_ms_last": 1000 * self.wait_last,
+            "wait_ms_mean": 1000 * self.wait_total / executed,
+            "wait_ms_max": 1000 * self.wait_max,
+        }
+
+    def shutdown(self, wait=True, timeout=10.0):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if wait:
+            self.thread.join(timeout)
+
+
+class CommandDispatcher:
+    """Independent command lanes per device, so a slow operation on one device never delays another."""
+
+    def __init__(self, lane_names, metrics=None):
+        self.lanes = {name: CommandLane(name, metrics) for name in lane_names}
+
+    def submit(self, lane, fn, *args, priority=PRIORITY_NORMAL, coalesce_key=None, **kwargs):
+        return self.lanes[lane].submit(fn, *args, priority=priority, coalesce_key=coalesce_key, **kwargs)
+
+    def stats(self):
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def shutdown(self, wait=True):
+        for lane in self.lanes.values():
+            lane.shutdown(wait=False)
+        if wait:
+            for lane in self.lanes.values():
+                lane.thread.join(10.0)
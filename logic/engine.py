@@ -0,0 +1,502 @@
+import logging
+import time
+from logic.data_processing import DataProcessor, timing_path_for
+from logic.discovery import KNOWN_TRAINERS_FILE, DeviceDiscovery
+from logic.dispatcher import PRIORITY_CONTROL, CommandDispatcher
+from logic.fusion import INTERVAL_STAT_FIELDS, StreamFusion
+from logic.lorenz_acquisition import LorenzAcquisition
+from logic.metrics import MetricsRegistry
+from logic.modbus_client import AsyncModbusBanco
+from logic.power_control import DEFAULT_GAINS, OUTPUT_LIMITS, PowerController
+from logic.scheduler import PlanScheduler
+from logic.startup import STARTUP, LazyDevice, created
+from logic.supervisor import STALL_INTERVALS, ConnectionSupervisor
+
+COMMAND_TIMEOUT = 5.0  # s, attesa massima di un comando freno sul loop BLE
+# Comandi di piano in anello chiuso -> grandezza Lorenz controllata
+CLOSED_LOOP_COMMANDS = {"potenza_lorenz": "power", "coppia_lorenz": "torque"}
+
+
+def _start_asyncio_worker():
+    with STARTUP.phase("import shared_lib.bluetooth_manager"):
+        from shared_lib.bluetooth_manager import AsyncioWorker
+    worker = AsyncioWorker()
+    worker.start()
+    return worker
+
+
+def _create_ble_manager(worker):
+    with STARTUP.phase("import shared_lib.bluetooth_manager"):
+        from shared_lib.bluetooth_manager import BLEManager
+    return BLEManager(worker)
+
+
+def _create_lorenz_reader():
+    with STARTUP.phase("import shared_lib.LorenzLib"):
+        from shared_lib.LorenzLib import LorenzReader
+    return LorenzReader()
+
+
+def _create_modbus():
+    with STARTUP.phase("import shared_lib.modbus_utils"):
+        from shared_lib.modbus_utils import ModbusBancoCollaudo
+    return ModbusBancoCollaudo()
+
+
+def _find_lorenz_port(description):
+    with STARTUP.phase("import shared_lib.funzioni_accessorie"):
+        from shared_lib.funzioni_accessorie import trova_porta_usb_serial
+    return trova_porta_usb_serial(description)
+
+
+class RigLogAdapter(logging.LoggerAdapter):
+    """Prefixes messages with the rig name, so several engines can share one log."""
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra}] {msg}", kwargs
+
+
+class BenchEngine:
+    """Acquisition and control core of a bench: devices, command dispatch, plan execution and recording.
+
+    It has no GUI dependency: MainWindow and headless.py are both clients. Blocking device
+    operations (scan, connect, offset) are plain methods meant to run off the UI thread, usually
+    through `dispatcher` (one lane per device: "ftms", "discovery", "lorenz"); the Modbus bench is
+    driven by its own asynchronous client (`bench`, see logic.modbus_client).
+    send_* and setspeed_modbus are fire-and-forget control commands: they outrank everything
+    else on their lane and coalesce, so only the newest queued setpoint is sent.
+    Listeners registered with add_data_listener receive every FTMS sample (on the BLE thread).
+    `discovery` (logic.discovery) scans in background when started and remembers the trainers
+    connected, in `known_trainers_path` (None: in memory only).
+    Devices not injected are built on first use (logic.startup.LazyDevice), so creating the engine
+    imports no driver and opens no session file: the session starts with enable_data or start_plan.
+    FTMS and Lorenz samples are aligned by StreamFusion before recording (fusion_mode "ftms" or
+    "rate", see logic.fusion); fusion_mode=None records the raw merge at BLE arrival time.
+    `metrics` (logic.metrics.MetricsRegistry, labelled with the rig name) collects the hot-path
+    counters and latency histograms of the engine and of its components.
+    With `supervise`, a ConnectionSupervisor (logic.supervisor) reconnects the FTMS and Lorenz
+    links after a drop or a stall and re-applies the last brake setpoint.
+    """
+
+    def __init__(self, worker=None, ble_manager=None, lorenz_reader=None, modbus=None, data_processor=None,
+                 fusion_mode="ftms", fusion_rate_hz=10.0, lorenz_interval_stats=False, find_lorenz_port=None,
+                 bench_poll_hz=2.0, closed_loop_actuator="level", closed_loop_rate_hz=10.0, closed_loop_gains=None,
+                 name=None, lorenz_port=None, bench=None, clock=time.monotonic_ns, metrics=None,
+                 known_trainers_path=KNOWN_TRAINERS_FILE, supervise=True, stall_intervals=STALL_INTERVALS,
+                 pause_plan_on_stall=False, backends=("csv",)):
+        # backends: formats of the session files when data_processor is not given (see DataProcessor)
+        # name: rig name, used in log messages and session file names (see logic.rigs)
+        # lorenz_port: fixed Lorenz COM port (e.g. "COM5") instead of the USB auto-detection
+        # bench: stand-in for the asynchronous Modbus client; clock: time base of the samples (see logic.replay)
+        self.clock = clock
+        self.metrics = metrics or MetricsRegistry({"rig": name} if name else None)
+        self.ftms_notifications = self.metrics.counter("ftms_notifications_total", "Notifiche FTMS ricevute")
+        self.ingest_seconds = self.metrics.histogram("handle_bike_data_seconds",
+                                                     "Durata di handle_bike_data (listener, fusione, registrazione)")
+        self.listener_seconds = self.metrics.histogram("data_listeners_seconds",
+                                                       "Durata dei listener dei dati FTMS (es. update_data_fields)")
+        self.name = name
+        self.log = RigLogAdapter(logging.getLogger(), name) if name else logging.getLogger()
+        self.lorenz_port = lorenz_port
+        # The shared_lib drivers are imported only when no device is injected (e.g. logic.simulators),
+        # and then at the first use of the device
+        self.owns_worker = worker is None  # A worker passed in is shared: close() leaves it running
+        if worker is None:
+            worker = LazyDevice(_start_asyncio_worker, "AsyncioWorker")
+        self.worker = worker
+        if ble_manager is None:
+            ble_manager = LazyDevice(lambda: _create_ble_manager(self.worker), "BLEManager")
+        self.ble_manager = ble_manager
+        self.discovery = DeviceDiscovery(self.worker, self.ble_manager, known_path=known_trainers_path)
+        self.metrics.counter("ble_scans_total", "Scansioni BLE completate", fn=lambda: self.discovery.scans)
+        self.metrics.gauge("ble_devices", "Dispositivi BLE nella cache di ricerca", fn=lambda: len(self.discovery.devices))
+        if lorenz_reader is None:
+            lorenz_reader = LazyDevice(_create_lorenz_reader, "LorenzReader")
+        self.lorenz_reader = lorenz_reader
+        if modbus is None and bench is None:
+            modbus = LazyDevice(_create_modbus, "ModbusBancoCollaudo")
+        self.modbus = modbus
+        self.find_lorenz_port = find_lorenz_port or _find_lorenz_port
+        if data_processor is None:
+            data_processor = DataProcessor(extra_fields=INTERVAL_STAT_FIELDS if lorenz_interval_stats else (), name=name,
+                                           backends=backends, metrics=self.metrics)
+        self.data_processor = data_processor
+        self.lorenz_acquisition = LorenzAcquisition(self.lorenz_reader, clock=clock, metrics=self.metrics)
+        self.fusion = None
+        if fusion_mode is not None:
+            self.fusion = StreamFusion(self.lorenz_acquisition.buffer, self._record,
+                                       lorenz_active=self.lorenz_acquisition.is_running, mode=fusion_mode,
+                                       rate_hz=fusion_rate_hz, interval_stats=lorenz_interval_stats, clock=clock)
+            self.fusion.start()
+            self.metrics.counter("fusion_rows_total", "Righe emesse dalla fusione", fn=lambda: self.fusion.emitted)
+            self.metrics.counter("fusion_missing_lorenz_total", "Righe senza campioni Lorenz vicini",
+                                 fn=lambda: self.fusion.missing_lorenz)
+            self.metrics.gauge("fusion_pending", "Campioni FTMS in attesa dei dati Lorenz",
+                               fn=lambda: len(self.fusion.pending))
+        self.dispatcher = CommandDispatcher(["ftms", "discovery", "lorenz"], metrics=self.metrics)
+        self.bench = bench or AsyncModbusBanco(self.worker, self.modbus, poll_rate_hz=bench_poll_hz,
+                                               metrics=self.metrics)
+        self.plan_scheduler = None
+        self.power_controller = None
+        self.closed_loop_mode = None  # (grandezza, attuatore) del controllore attivo
+        self.closed_loop_actuator = closed_loop_actuator
+        self.closed_loop_rate_hz = closed_loop_rate_hz
+        self.closed_loop_gains = closed_loop_gains or {}  # override di kp, ki, rate_limit
+        self.last_level = 0
+        self.last_bench_speed = 0.0
+        self.brake_setpoint = None  # (tipo comando, valore) dell'ultimo setpoint freno inviato
+        # Links the user asked for, as opposed to their current state: what the supervisor restores
+        self.ble_address = None
+        self.data_enabled = False
+        self.lorenz_expected = False
+        self.data_listeners = []
+        self.record_listeners = []
+        self.closed = False
+        self.supervisor = ConnectionSupervisor(self, stall_intervals=stall_intervals, pause_plan=pause_plan_on_stall)
+        if supervise:
+            self.supervisor.start()
+
+    # --- BLE FTMS ---
+
+    def scan_devices(self, timeout=5):
+        return self.discovery.scan_once(timeout)
+
+    def connect_ble(self, address, timeout=None):
+        """Connects by address, with no scan first; background scanning is paused meanwhile."""
+        self.log.info(f"Tentativo connessione a {address}")
+        t0 = time.perf_counter()
+        with self.discovery.paused():
+            self.worker.run_coroutine(self.ble_manager.connect_to_device(address)).result(timeout)
+        self.log.info(f"Connesso a {address} in {time.perf_counter() - t0:.2f}s")
+        self.ble_address = address
+        self.discovery.remember(address)
+
+    def disconnect_ble(self):
+        self.ble_address = None  # Wanted: not a drop for the supervisor
+        self.data_enabled = False
+        return self.worker.run_coroutine(self.ble_manager.disconnect_device()).result()
+
+    def is_ble_connected(self):
+        return created(self.ble_manager) and self.ble_manager.get_connection_status()
+
+    def enable_data(self):
+        self.log.info("Dati BLE abilitati")
+        self.data_processor.start()  # The recording session (and its files) starts with the data
+        self.data_enabled = True
+        return self.worker.run_coroutine(self.ble_manager.enable_indoor_bike_data_notifications(self.handle_bike_data))
+
+    def disable_data(self):
+        self.data_enabled = False
+        return self.worker.run_coroutine(self.ble_manager.disable_indoor_bike_data_notifications())
+
+    def add_data_listener(self, listener):
+        self.data_listeners.append(listener)
+
+    def add_record_listener(self, listener):
+        """listener(sample, t_ns) receives every recorded sample (FTMS and Lorenz fused, logic.sample.Sample,
+        read-only) on the recording path."""
+        self.record_listeners.append(listener)
+
+    def _record(self, sample):
+        self.data_processor.record(sample)
+        if self.record_listeners:
+            for listener in self.record_listeners:
+                try:
+                    listener(sample, sample.t_ns)
+                except Exception as e:
+                    self.log.error(f"Errore nel listener di registrazione: {e}")
+
+    def handle_bike_data(self, bike_data):
+        t0 = time.perf_counter()
+        t_ns = self.clock()
+        self.ftms_notifications.inc()
+        if self.data_listeners:
+            for listener in self.data_listeners:
+                try:
+                    listener(bike_data)
+                except Exception as e:
+                    self.log.error(f"Errore nel listener dati BLE: {e}")
+            self.listener_seconds.observe_since(t0)
+
+        # From here on the notification travels as one fixed-layout sample; bench telemetry goes with it
+        sample = self.data_processor.schema.from_ftms(t_ns, bike_data, self.bench.actual_speed())
+        if self.fusion is not None:
+            self.fusion.push_ftms(sample)
+            self.ingest_seconds.observe_since(t0)
+            return
+
+        if self.lorenz_acquisition.is_running():
+            self.lorenz_acquisition.fill_latest(sample)  # Lorenz slots stay None if not connected
+        self._record(sample)
+        self.ingest_seconds.observe_since(t0)
+
+    # --- Comandi freno ---
+
+    def send_level_command(self, level):
+        self.stop_closed_loop()  # An explicit setpoint takes over from the closed loop
+        return self.dispatcher.submit("ftms", self._send_level_command, level, priority=PRIORITY_CONTROL,
+                                      coalesce_key="brake")
+
+    def _send_level_command(self, level, log_level=logging.INFO):
+        try:
+            self.log.log(log_level, f"Invio comando livello: {level}/200")
+            self.last_level = int(level)
+            self.brake_setpoint = ("livelli", level)
+            self.worker.run_coroutine(self.ble_manager.set_brake_percentage(int(level))).result(timeout=COMMAND_TIMEOUT)
+        except Exception as e:
+            self.log.error(f"Errore invio comando livello: {e}")
+
+    def send_power_command(self, power):
+        self.stop_closed_loop()
+        return self.dispatcher.submit("ftms", self._send_power_command, power, priority=PRIORITY_CONTROL,
+                                      coalesce_key="brake")
+
+    def _send_power_command(self, power):
+        try:
+            self.log.info(f"Invio comando potenza: {power}W")
+            self.brake_setpoint = ("potenza", power)
+            self.worker.run_coroutine(self.ble_manager.set_brake_power(int(power))).result(timeout=COMMAND_TIMEOUT)
+        except Exception as e:
+            self.log.error(f"Errore invio comando potenza: {e}")
+
+    def send_simulation_command(self, simulation):
+        self.stop_closed_loop()
+        return self.dispatcher.submit("ftms", self._send_simulation_command, simulation, priority=PRIORITY_CONTROL,
+                                      coalesce_key="brake")
+
+    def _send_simulation_command(self, simulation):
+        try:
+            self.log.info(f"Invio comando simulazione: {simulation}%")
+            self.brake_setpoint = ("simulazione", simulation)
+            self.worker.run_coroutine(self.ble_manager.set_brake_simulation(grade=int(simulation))).result(timeout=COMMAND_TIMEOUT)
+        except Exception as e:
+            self.log.error(f"Errore invio comando simulazione: {e}")
+
+    def reapply_setpoint(self):
+        """Sends the last brake setpoint again (e.g. after a reconnection); the closed loop, if any, keeps running."""
+        if self.brake_setpoint is None:
+            return None
+        command_type, value = self.brake_setpoint
+        send = {"livelli": self._send_level_command, "potenza": self._send_power_command,
+                "simulazione": self._send_simulation_command}[command_type]
+        self.log.info(f"Ripristino setpoint freno: {command_type} {value}")
+        return self.dispatcher.submit("ftms", send, value, priority=PRIORITY_CONTROL, coalesce_key="brake")
+
+    # --- Lorenz ---
+
+    def is_lorenz_connected(self):
+        return bool(self.lorenz_reader and created(self.lorenz_reader) and self.lorenz_reader.is_connected())
+
+    def connect_lorenz(self):
+        porta_com_lorenz = self.lorenz_port or self.find_lorenz_port("Lorenz USB sensor interface Port")
+        if not porta_com_lorenz:
+            self.log.warning("Porta Lorenz non trovata.")
+            return False
+        try:
+            self.log.info(f"Trovata porta Lorenz: {porta_com_lorenz}")
+            success = self.lorenz_reader.open_connection(int(porta_com_lorenz.split("COM")[-1]))
+        except Exception as e:
+            self.log.error(f"Errore durante la connessione al Lorenz: {e}")
+            return False
+        if success:
+            self.lorenz_acquisition.start()
+            self.lorenz_expected = True
+        return success
+
+    def disconnect_lorenz(self):
+        self.lorenz_expected = False
+        self.lorenz_acquisition.stop()
+        if self.is_lorenz_connected():
+            if self.lorenz_reader.close_connection():
+                self.log.info("Lorenz Disconnesso")
+                return True
+            self.log.warning("Problema durante la disconnessione del Lorenz.")
+        else:
+            self.log.info("Lorenz già disconnesso o non inizializzato.")
+        return False
+
+    def read_lorenz_offset(self):
+        with self.lorenz_acquisition.driver_lock:
+            self.lorenz_reader.read_offset()
+        self.log.info(f"Comando lettura offset Lorenz inviato.")
+
+    def get_lorenz_data(self):
+        return self.lorenz_acquisition.latest_data()
+
+    # --- Banco Modbus ---
+
+    def is_modbus_connected(self):
+        return self.bench.is_connected()
+
+    def connect_modbus(self, ip, port=502, timeout=None):
+        """Non-blocking; with a timeout, waits for the connection and returns whether it succeeded."""
+        self.bench.connect(ip, port)
+        if timeout is not None:
+            return self.bench.wait_connected(timeout)
+        return None
+
+    def disconnect_modbus(self):
+        self.bench.disconnect()
+
+    def setspeed_modbus(self, speedkmh):
+        try:
+            if speedkmh is None:
+                raise ValueError("La velocità non può essere None")
+            if not (0 <= speedkmh <= 80):  # Allow 0 km/h
+                raise ValueError(
+                    f"La velocità richiesta ({speedkmh} km/h) è fuori dal range consentito (0-80 km/h). Comando rifiutato.")
+        except ValueError as ve:
+            self.log.error(f"Errore valore velocità banco: {ve}")
+            return
+        if self.bench.set_speed(speedkmh):
+            self.last_bench_speed = speedkmh
+
+    # --- Anello chiuso su misura Lorenz ---
+
+    def _lorenz_mean(self, field, window):
+        now = self.clock()
+        _, columns = self.lorenz_acquisition.buffer.window(now - int(window * 1e9), now, [field])
+        values = [value for value in columns[field] if value == value]  # Skip NaN
+        return sum(values) / len(values) if values else None
+
+    def start_closed_loop(self, kind, target, actuator=None):
+        """Holds Lorenz power ("power", W) or torque ("torque", Nm) at target via brake level or bench speed.
+
+        If a loop with the same quantity and actuator is running only its target changes.
+        Returns the controller, or None if the actuator is the bench and no bench is configured.
+        """
+        actuator = actuator or self.closed_loop_actuator
+        if self.power_controller and self.power_controller.is_running() and self.closed_loop_mode == (kind, actuator):
+            self.power_controller.set_target(target)
+            return self.power_controller
+        self.stop_closed_loop()
+        if actuator == "bench" and self.bench.target is None:
+            self.log.error("Anello chiuso su velocità banco non avviato: banco non configurato")
+            return None
+        params = {**DEFAULT_GAINS[(kind, actuator)], **self.closed_loop_gains}
+        field = "power_lorenz" if kind == "power" else "torque_lorenz"
+        if actuator == "level":
+            def actuate(level):
+                self.last_level = int(level)
+                return self.dispatcher.submit("ftms", self._send_level_command, int(level), logging.DEBUG,
+                                              priority=PRIORITY_CONTROL, coalesce_key="brake")
+            initial_output, quantum = self.last_level, 1
+        else:
+            def actuate(speed):
+                self.last_bench_speed = speed
+                return self.bench.set_speed(speed)  # Completed when written: actuation latency
+            initial_output, quantum = self.last_bench_speed, 0.1
+        self.power_controller = PowerController(
+            lambda: self._lorenz_mean(field, 1.0 / self.closed_loop_rate_hz), actuate, target,
+            params["kp"], params["ki"], OUTPUT_LIMITS[actuator], params["rate_limit"], initial_output,
+            rate_hz=self.closed_loop_rate_hz, quantum=quantum, name=f"{kind}/{actuator}")
+        self.closed_loop_mode = (kind, actuator)
+        self.power_controller.start()
+        return self.power_controller
+
+    def stop_closed_loop(self):
+        if self.power_controller and self.power_controller.is_running():
+            self.power_controller.stop()
+
+    def closed_loop_stats(self):
+        if self.power_controller and self.power_controller.is_running():
+            return self.power_controller.stats()
+        return None
+
+    # --- Piano comandi ---
+
+    def execute_plan_step(self, index, step):
+        command_type, value, wait_time, speed_banco = step
+        if command_type in CLOSED_LOOP_COMMANDS:
+            controller = self.start_closed_loop(CLOSED_LOOP_COMMANDS[command_type], float(value))
+            if controller is not None and speed_banco is not None and self.closed_loop_mode[1] == "bench":
+                self.log.warning("Velocità banco del piano ignorata: il banco è l'attuatore dell'anello chiuso")
+                return
+        elif command_type == "potenza":
+            self.send_power_command(value)
+        elif command_type == "livelli":
+            self.send_level_command(value)
+        elif command_type == "simulazione":
+            self.send_simulation_command(value)
+
+        if speed_banco is not None:
+            self.setspeed_modbus(float(speed_banco))
+        else:
+            self.log.debug("Nessuna impostazione velocità banco per questo comando.")
+
+    def start_plan(self, steps, on_step=None, on_finished=None):
+        """Starts the plan on a PlanScheduler; on_step/on_finished are extra client hooks (scheduler thread)."""
+        if self.plan_scheduler and self.plan_scheduler.is_running():
+            raise RuntimeError("Piano comandi già in corso")
+        self.data_processor.start()  # Plan timings are saved next to the session
+
+        def run_step(index, step):
+            self.execute_plan_step(index, step)
+            if on_step:
+                on_step(index, step)
+
+        def finished(completed):
+            scheduler = self.plan_scheduler
+            self.log.info(f"Temporizzazione piano: {scheduler.jitter_stats()}")
+            try:
+                session_offset = scheduler.start_monotonic - self.data_processor.start_monotonic_ns / 1e9
+                scheduler.save_timings(timing_path_for(self.data_processor.session_path), session_offset)
+            except OSError as e:
+                self.log.error(f"Errore salvataggio temporizzazione piano: {e}")
+            self.stop_closed_loop()
+            if on_finished:
+                on_finished(completed)
+
+        self.plan_scheduler = PlanScheduler(steps, run_step, finished, metrics=self.metrics)
+        self.plan_scheduler.start()
+        return self.plan_scheduler
+
+    def stop_plan(self):
+        if self.plan_scheduler:
+            self.plan_scheduler.stop()
+        self.stop_closed_loop()
+
+    def is_plan_running(self):
+        return bool(self.plan_scheduler and self.plan_scheduler.is_running())
+
+    def pause_plan(self):
+        if self.is_plan_running():
+            self.plan_scheduler.pause()
+
+    def resume_plan(self):
+        if self.plan_scheduler:
+            self.plan_scheduler.resume()
+
+    def is_plan_paused(self):
+        return self.is_plan_running() and self.plan_scheduler.is_paused()
+
+    # --- Chiusura ---
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.supervisor.stop()
+        links = self.supervisor.stats()
+        if any(link["stalls"] for link in links.values()):
+            self.log.info(f"Supervisore collegamenti: {links}")
+        self.stop_plan()
+        self.discovery.stop()
+        self.dispatcher.shutdown(wait=True)  # Let queued commands finish while devices are still connected
+        self.log.info(f"Corsie comandi: {self.dispatcher.stats()}")
+        if self.fusion is not None:
+            self.fusion.stop()  # Emits the rows still waiting for Lorenz samples
+        self.lorenz_acquisition.stop()
+        if self.is_lorenz_connected():
+            self.lorenz_reader.close_connection()
+        try:
+            if self.is_ble_connected():
+                self.worker.run_coroutine(self.ble_manager.disconnect_device()).result(timeout=5)
+        except Exception as e:
+            self.log.error(f"Errore durante la disconnessione BLE: {e}")
+        self.bench.close()
+        self.log.info(f"Client banco: {self.bench.stats()}")
+        if self.owns_worker and created(self.worker):
+            self.worker.stop()  # Ensure asyncio worker is stopped
+        self.data_processor.close()  # Drain queued rows to disk before exiting
+
@@ -0,0 +1,171 @@
+from bisect import bisect_left
+from collections import deque
+import math
+import threading
+import time
+STAT_SOURCE_FIELDS = ["torque_lorenz", "power_lorenz"]
+INTERVAL_STAT_FIELDS = [f"{field}_{stat}" for field in STAT_SOURCE_FIELDS for stat in ("mean", "min", "max")]
+FUSION_MODES = ("ftms", "rate")
+
+
+def _clean(value):
+    return None if value is None or math.isnan(value) else value
+
+
+class StreamFusion:
+    """Aligns FTMS samples and the Lorenz ring buffer on a common monotonic time base.
+
+    mode "ftms": one row per FTMS sample, Lorenz interpolated at the FTMS timestamp.
+    mode "rate": one row every 1/rate_hz s, FTMS held (sample-and-hold), Lorenz interpolated.
+    A row is emitted once the Lorenz buffer has a sample at or after its timestamp, or after
+    max_delay s, so interpolation never extrapolates from data older than the sample.
+    With interval_stats, rows also carry Lorenz mean/min/max over the interval since the previous row.
+    FTMS samples are logic.sample.Sample records whose Lorenz (and statistics) slots are filled in
+    place; emit(sample) is called from the thread that pushed or polled.
+    `clock` is the time base of the timestamps (time.monotonic_ns, or a replay clock, see logic.replay).
+    """
+
+    def __init__(self, lorenz_buffer, emit, lorenz_active=None, mode="ftms", rate_hz=10.0, interval_stats=False,
+                 max_delay=0.5, max_gap=0.25, ftms_hold=2.0, clock=time.monotonic_ns):
+        if mode not in FUSION_MODES:
+            raise ValueError(f"Modalità fusione non valida: {mode}")
+        self.lorenz_buffer = lorenz_buffer
+        self.emit = emit
+        self.lorenz_active = lorenz_active or (lambda: True)
+        self.mode = mode
+        self.clock = clock
+        self.period_ns = int(1e9 / rate_hz)
+        self.interval_stats = interval_stats
+        self.max_delay_ns = int(max_delay * 1e9)
+        self.max_gap_ns = int(max_gap * 1e9)
+        self.ftms_hold_ns = int(ftms_hold * 1e9)
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.last_row_t = None
+        self.held_ftms = None  # ultimo Sample FTMS, modalità "rate"
+        self.next_tick = None
+        self.emitted = 0
+        self.interpolated = 0
+        self.held_lorenz = 0
+        self.missing_lorenz = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def extra_fields(self):
+        return INTERVAL_STAT_FIELDS if self.interval_stats else []
+
+    def start(self, poll_interval=0.05):
+        """Polls periodically so rows are emitted even when FTMS notifications pause."""
+        def run():
+            while not self._stop_event.wait(poll_interval):
+                self.poll()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=run, name="StreamFusion", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(2.0)
+            self._thread = None
+        self.poll(flush=True)
+
+    def push_ftms(self, sample):
+        with self.lock:
+            self.pending.append(sample)
+        self.poll()
+
+    def poll(self, flush=False):
+        now = self.clock()
+        with self.lock:
+            if self.mode == "ftms":
+                self._poll_ftms(now, flush)
+            else:
+                self._poll_rate(now, flush)
+
+    def _ready(self, t, now, flush):
+        if t > now:
+            return False
+        if flush or not self.lorenz_active():
+            return True
+        latest = self.lorenz_buffer.latest()
+        if latest is not None and latest[0] >= t:
+            return True
+        return now - t >= self.max_delay_ns
+
+    def _poll_ftms(self, now, flush):
+        while self.pending and self._ready(self.pending[0].t_ns, now, flush):
+            self._emit_row(self.pending.popleft())
+
+    def _poll_rate(self, now, flush):
+        if self.next_tick is None:
+            if not self.pending:
+                return
+            self.next_tick = self.pending[0].t_ns
+        while self._ready(self.next_tick, now, flush):
+            while self.pending and self.pending[0].t_ns <= self.next_tick:
+                self.held_ftms = self.pending.popleft()
+            if self.held_ftms is None or self.next_tick - self.held_ftms.t_ns > self.ftms_hold_ns:
+                # FTMS silent for too long: restart the time base at the next notification
+                self.held_ftms = None
+                self.next_tick = self.pending[0].t_ns if self.pending else None
+                if self.next_tick is None:
+                    return
+                continue
+            self._emit_row(self.held_ftms.copy(self.next_tick))  # The held sample may be emitted again
+            self.next_tick += self.period_ns
+
+    def _emit_row(self, sample):
+        t, values, schema = sample.t_ns, sample.values, sample.schema
+        if self.lorenz_active():
+            self._fill_lorenz(t, values, schema)
+            if self.interval_stats:
+                self._fill_interval_stats(t, values, schema)
+        else:
+            for slot in schema.lorenz_slots:
+                values[slot] = None
+        self.last_row_t = t
+        self.emitted += 1
+        self.emit(sample)
+
+    def _fill_lorenz(self, t, values, schema):
+        times, columns = self.lorenz_buffer.window(t - self.max_gap_ns, t + self.max_gap_ns, schema.lorenz_fields)
+        if not times:
+            self.missing_lorenz += 1
+            for slot in schema.lorenz_slots:
+                values[slot] = None
+            return
+        i = bisect_left(times, t)
+        if i < len(times) and times[i] == t:
+            for slot, field in schema.lorenz_slot_fields:
+                values[slot] = _clean(columns[field][i])
+            return
+        if 0 < i < len(times):
+            t0, t1 = times[i - 1], times[i]
+            w = (t - t0) / (t1 - t0)
+            self.interpolated += 1
+            for slot, field in schema.lorenz_slot_fields:
+                column = columns[field]
+                values[slot] = _clean(column[i - 1] + w * (column[i] - column[i - 1]))
+            return
+        # Only one side available (sensor just started or stopped): nearest sample within max_gap
+        self.held_lorenz += 1
+        j = 0 if i == 0 else len(times) - 1
+        for slot, field in schema.lorenz_slot_fields:
+            values[slot] = _clean(columns[field][j])
+
+    def _fill_interval_stats(self, t, values, schema):
+        start = self.last_row_t + 1 if self.last_row_t is not None else t - self.period_ns
+        _, columns = self.lorenz_buffer.window(start, t, STAT_SOURCE_FIELDS)
+        index = schema.index
+        for field in STAT_SOURCE_FIELDS:
+            column = [value for value in columns[field] if not math.isnan(value)]
+            stats = (sum(column) / len(column), min(column), max(column)) if column else (None, None, None)
+            for stat, value in zip(("mean", "min", "max"), stats):
+                slot = index.get(f"{field}_{stat}")
+                if slot is not None:
+                    values[slot] = value
+
+    def stats(self):
+        return {"emitted": self.emitted, "pending": len(self.pending), "interpolated": self.interpolated,
+                "held_lorenz": self.held_lorenz, "missing_lorenz": self.missing_lorenz}
@@ -0,0 +1,178 @@
+from array import array
+import math
+import threading
+
+NAN = math.nan
+RECENT_WINDOWS_S = (60, 300, 900)  # finestre del grafico: un livello di slot per ciascuna
+RECENT_SLOTS = 600  # slot per livello: il costo di recent() non dipende da frequenza né durata
+
+
+class RecentEnvelope:
+    """Min/max of the last `slots` time slots of `width_ns` each, kept in a ring.
+
+    push() updates one slot per field, so its cost does not depend on the rate; slots of
+    a previous turn of the ring are recognised by their stamp and restarted.
+    """
+
+    def __init__(self, fields, width_ns, slots):
+        self.fields = list(fields)
+        self.width_ns = width_ns
+        self.slots = slots
+        self.span_ns = width_ns * slots
+        self.stamps = array('q', [-1]) * slots  # numero assoluto dello slot in ciascuna posizione
+        self.mins = {field: array('d', [NAN]) * slots for field in self.fields}
+        self.maxs = {field: array('d', [NAN]) * slots for field in self.fields}
+
+    def push(self, t_ns, values):
+        slot = t_ns // self.width_ns
+        position = slot % self.slots
+        if self.stamps[position] != slot:
+            self.stamps[position] = slot
+            for field in self.fields:
+                self.mins[field][position] = NAN
+                self.maxs[field][position] = NAN
+        for field, value in zip(self.fields, values):
+            if value is None or value != value:
+                continue
+            mins, maxs = self.mins[field], self.maxs[field]
+            if not mins[position] <= value:  # Also true when the slot is empty (NaN)
+                mins[position] = value
+            if not maxs[position] >= value:
+                maxs[position] = value
+
+    def copy(self):
+        """Arrays of the ring (stamps, mins, maxs), copied so they can be read without the lock."""
+        return (array('q', self.stamps), {field: array('d', column) for field, column in self.mins.items()},
+                {field: array('d', column) for field, column in self.maxs.items()})
+
+
+class SessionOverview:
+    """Whole-session min/max envelope in constant memory.
+
+    `buckets` fixed slots cover the session; when the time runs past the last slot, adjacent
+    pairs are merged and the slot width doubles, so an 8-hour session costs the same memory
+    and drawing time as a 5-minute one.
+    """
+
+    def __init__(self, fields, buckets=1024, initial_width_s=1.0):
+        self.fields = list(fields)
+        self.buckets = buckets
+        self.width_ns = int(initial_width_s * 1e9)
+        self.t0 = None
+        self.used = 0
+        self.mins = {field: array('d', [NAN]) * buckets for field in self.fields}
+        self.maxs = {field: array('d', [NAN]) * buckets for field in self.fields}
+
+    def push(self, t_ns, values):
+        if self.t0 is None:
+            self.t0 = t_ns
+        index = (t_ns - self.t0) // self.width_ns
+        while index >= self.buckets:
+            self._compact()
+            index = (t_ns - self.t0) // self.width_ns
+        if index < 0:
+            return
+        for field, value in zip(self.fields, values):
+            if value is None or value != value:
+                continue
+            mins, maxs = self.mins[field], self.maxs[field]
+            if not mins[index] <= value:  # Also true when the slot is empty (NaN)
+                mins[index] = value
+            if not maxs[index] >= value:
+                maxs[index] = value
+        self.used = max(self.used, index + 1)
+
+    def _compact(self):
+        half = self.buckets // 2
+        for field in self.fields:
+            for column, pick in ((self.mins[field], min), (self.maxs[field], max)):
+                for i in range(half):
+                    a, b = column[2 * i], column[2 * i + 1]
+                    column[i] = a if b != b else b if a != a else pick(a, b)
+                for i in range(half, self.buckets):
+                    column[i] = NAN
+        self.width_ns *= 2
+        self.used = (self.used + 1) // 2
+
+    def envelope(self, field):
+        """[(t_ns, min, max)] of the used slots, t_ns at the slot centre."""
+        if self.t0 is None:
+            return []
+        mins, maxs = self.mins[field], self.maxs[field]
+        return [(self.t0 + i * self.width_ns + self.width_ns // 2, mins[i], maxs[i])
+                for i in range(self.used) if mins[i] == mins[i]]
+
+
+class LiveSeries:
+    """Data behind the live chart: recent samples at full rate plus a whole-session envelope.
+
+    Recent data is kept as per-slot min/max envelopes, one level of `recent_slots` slots per
+    window in `recent_windows` (e.g. 0.1 s slots for 1 min). push() is called on the recording
+    thread and is O(fields) under a short lock; the chart reads recent() / overview() from the
+    Tk thread at its own rate, so drawing cost depends neither on the sample rate nor on the
+    window or session length. `version` changes on every push, to skip redraws when nothing arrived.
+    """
+
+    def __init__(self, fields, recent_windows=RECENT_WINDOWS_S, recent_slots=RECENT_SLOTS, overview_buckets=1024):
+        self.fields = list(fields)
+        self.levels = [RecentEnvelope(self.fields, max(1, int(window * 1e9) // recent_slots), recent_slots)
+                       for window in sorted(recent_windows)]
+        self.overview_data = SessionOverview(self.fields, overview_buckets)
+        self.lock = threading.Lock()
+        self.latest_t = None
+        self.version = 0
+
+    def push(self, t_ns, values):
+        row = [values.get(field) for field in self.fields]
+        with self.lock:
+            for level in self.levels:
+                level.push(t_ns, row)
+            self.overview_data.push(t_ns, row)
+            self.latest_t = t_ns
+            self.version += 1
+
+    def recent(self, window_s, buckets, now_ns=None):
+        """{field: [(t_ns, value)]} of the last window_s seconds: min and max of at most `buckets` intervals.
+
+        Points sit at the centre of their interval, min first; windows longer than the longest
+        level are cut to that level.
+        """
+        window_ns = int(window_s * 1e9)
+        level = next((level for level in self.levels if level.span_ns >= window_ns), self.levels[-1])
+        with self.lock:
+            if self.latest_t is None:
+                return {field: [] for field in self.fields}
+            end = now_ns if now_ns is not None else self.latest_t
+            stamps, mins, maxs = level.copy()
+        width = level.width_ns
+        last = end // width
+        first = max((end - window_ns) // width, last - level.slots + 1)
+        group = max(1, -(-(last - first + 1) // buckets))  # Slots merged into one output interval
+        data = {}
+        for field in self.fields:
+            field_mins, field_maxs = mins[field], maxs[field]
+            points = []
+            for group_start in range(first, last + 1, group):
+                low = high = NAN
+                for slot in range(group_start, min(group_start + group, last + 1)):
+                    position = slot % level.slots
+                    if stamps[position] != slot:
+                        continue
+                    value = field_mins[position]
+                    if not low <= value:
+                        low = value if value == value else low
+                    value = field_maxs[position]
+                    if not high >= value:
+                        high = value if value == value else high
+                if low == low:
+                    t = group_start * width + group * width // 2
+                    points.append((t, low))
+                    if high != low:
+                        points.append((t, high))
+            data[field] = points
+        return data
+
+    def overview(self):
+        """{field: [(t_ns, min, max)]} for the whole session."""
+        with self.lock:
+            return {field: self.overview_data.envelope(field) for field in self.fields}
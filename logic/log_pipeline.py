@@ -0,0 +1,84 @@
+import copy
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log files meant to be parsed."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "created": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller: when the queue is full the record is dropped and counted."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare, the message is merged with its args now (a snapshot of their values),
+        # but exc_info/exc_text are kept so each handler formats the traceback itself (JsonFormatter: "exc_info")
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+class _LogListener(QueueListener):
+    sentinel_timeout = 10.0  # s, attesa di spazio in coda per il segnale di fine
+
+    def stop(self):
+        """Detaches the queue handler from the root logger, then flushes the queued records."""
+        if self._thread is None:
+            return
+        logging.getLogger().removeHandler(self.queue_handler)  # No new records while draining
+        super().stop()
+
+    def enqueue_sentinel(self):
+        # The queue is bounded and may be full during a burst: wait for the listener to make room
+        try:
+            self.queue.put(self._sentinel, timeout=self.sentinel_timeout)
+        except queue.Full:
+            # Handlers stuck for sentinel_timeout: drop the oldest record to make room
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(self._sentinel)
+
+
+def start_log_listener(handlers, level=logging.INFO, max_queue=10000):
+    """Routes the root logger through a bounded queue to `handlers`, which run on a listener thread.
+
+    Returns the QueueListener; call stop() at exit to flush the remaining records and restore the root logger.
+    """
+    log_queue = queue.Queue(maxsize=max_queue)
+    queue_handler = BoundedQueueHandler(log_queue)
+    logger = logging.getLogger()
+    logger.setLevel(level)
+    logger.addHandler(queue_handler)
+    listener = _LogListener(log_queue, *handlers, respect_handler_level=True)
+    listener.queue_handler = queue_handler
+    listener.start()
+    return listener
@@ -0,0 +1,116 @@
+import logging
+import math
+import threading
+import time
+from logic.metrics import MetricsRegistry
+from logic.ring_buffer import TimestampedRingBuffer
+
+LORENZ_FIELDS = ["speed_avg", "torque_lorenz", "power_lorenz", "offset_lorenz"]
+
+
+class LorenzAcquisition:
+    """Samples the Lorenz sensor on its own thread and publishes timestamped samples in a ring buffer.
+
+    Consumers (UI, recorder, analysis) read `buffer` or latest_data() and never call the driver.
+    Calls into the driver from other threads (e.g. read_offset) must hold `driver_lock`.
+    rate_hz=None runs free, for drivers whose get_data() already blocks until a new sample.
+    push() publishes samples from another source instead of the driver (session replay, see logic.replay);
+    `clock` is then the time base of those samples.
+    """
+
+    def __init__(self, lorenz_reader, rate_hz=100, capacity=65536, max_age=1.0, clock=time.monotonic_ns,
+                 metrics=None):
+        self.lorenz_reader = lorenz_reader
+        self.rate_hz = rate_hz
+        self.clock = clock
+        self.external = False  # campioni forniti da push() invece che dal thread di acquisizione
+        self.max_age_ns = int(max_age * 1e9)
+        self.buffer = TimestampedRingBuffer(LORENZ_FIELDS, capacity)
+        self.driver_lock = threading.Lock()
+        self.samples = 0
+        self.errors = 0
+        self.max_read_time = 0.0
+        metrics = metrics or MetricsRegistry()
+        self.read_seconds = metrics.histogram("lorenz_read_seconds", "Durata di LorenzReader.get_data()")
+        metrics.counter("lorenz_samples_total", "Campioni Lorenz acquisiti", fn=lambda: self.samples)
+        metrics.counter("lorenz_errors_total", "Errori di lettura Lorenz", fn=lambda: self.errors)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="LorenzAcquisition", daemon=True)
+        self._thread.start()
+        logging.getLogger().info(f"Acquisizione Lorenz avviata ({self.rate_hz or 'max'} Hz)")
+
+    def stop(self, timeout=2.0):
+        self.external = False
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        return self.external or self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        period = 1.0 / self.rate_hz if self.rate_hz else 0.0
+        next_deadline = time.monotonic()
+        while not self._stop_event.is_set():
+            t0 = time.monotonic_ns()
+            try:
+                with self.driver_lock:
+                    data = self.lorenz_reader.get_data()
+            except Exception as e:
+                self.errors += 1
+                if self.errors == 1 or self.errors % 100 == 0:
+                    logging.getLogger().error(f"Errore lettura Lorenz ({self.errors} errori): {e}")
+                data = None
+            t1 = time.monotonic_ns()
+            read_time = (t1 - t0) / 1e9
+            self.read_seconds.observe(read_time)
+            if read_time > self.max_read_time:
+                self.max_read_time = read_time
+            if data:
+                # The sample is stamped at the middle of the driver call
+                self.buffer.append((t0 + t1) // 2, [data.get(field) for field in LORENZ_FIELDS])
+                self.samples += 1
+
+            if period:
+                next_deadline += period
+                delay = next_deadline - time.monotonic()
+                if delay < 0:  # Overrun: resync instead of bursting to catch up
+                    next_deadline = time.monotonic()
+                elif self._stop_event.wait(delay):
+                    break
+
+    def push(self, t_ns, data):
+        self.external = True
+        self.buffer.append(t_ns, [data.get(field) for field in LORENZ_FIELDS])
+        self.samples += 1
+
+    def latest_data(self):
+        """Latest sample as the dict returned by LorenzReader.get_data(), or None values if stale."""
+        latest = self.buffer.latest()
+        if latest is None or self.clock() - latest[0] > self.max_age_ns:
+            return {field: None for field in LORENZ_FIELDS}
+        return {field: None if math.isnan(value) else value for field, value in latest[1].items()}
+
+    def fill_latest(self, sample):
+        """Writes the latest values into the Lorenz slots of a logic.sample.Sample (None if stale)."""
+        latest = self.buffer.latest_values()
+        values = sample.values
+        if latest is None or self.clock() - latest[0] > self.max_age_ns:
+            for slot in sample.schema.lorenz_slots:
+                values[slot] = None
+            return
+        row = latest[1]
+        for slot, column in sample.schema.lorenz_columns:
+            value = row[column]
+            values[slot] = None if math.isnan(value) else value
+
+    def stats(self):
+        return {"samples": self.samples, "errors": self.errors, "max_read_ms": 1000 * self.max_read_time,
+                "buffered": len(self.buffer)}
@@ -0,0 +1,268 @@
+"""Process metrics: counters, gauges and fixed-bucket latency histograms, exported as a Prometheus textfile or JSON.
+
+Each BenchEngine owns a MetricsRegistry (labelled with the rig name) and passes it to its
+components, which register their own metrics. Updates are plain attribute increments with no
+lock: every metric is written by one thread (BLE callback, lane worker, writer thread...), and a
+rare lost increment under contention is acceptable for monitoring. Values that components
+already count are exposed through callbacks (fn=...), which cost nothing on the hot path.
+
+    MetricsExporter([engine.metrics], "metrics/bench.prom", interval=10).start()
+
+writes the file atomically every interval, for the node exporter textfile collector (a ".json"
+path writes snapshot() instead).
+"""
+from bisect import bisect_left
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+NAMESPACE = "bench"
+# s: da 50 µs a 10 s, sufficienti per callback BLE, letture Lorenz, scritture su disco e Modbus
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+class Counter:
+    __slots__ = ("value", "fn")
+    kind = "counter"
+
+    def __init__(self, fn=None):
+        self.value = 0
+        self.fn = fn
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+
+class Gauge:
+    __slots__ = ("value", "fn")
+    kind = "gauge"
+
+    def __init__(self, fn=None):
+        self.value = 0.0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.fn() if self.fn else self.value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with Prometheus `le` semantics (value <= bound)."""
+    __slots__ = ("bounds", "counts", "sum", "count")
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # ultimo: +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def observe_since(self, t0):
+        """Observes time.perf_counter() - t0."""
+        self.observe(time.perf_counter() - t0)
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket; None when empty."""
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]  # Beyond the last bound: its value is the best lower estimate
+                low = self.bounds[i - 1] if i else 0.0
+                return low + (self.bounds[i] - low) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def get(self):
+        return {"count": self.count, "sum": self.sum, "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+                "p99": self.quantile(0.99)}
+
+
+class MetricsRegistry:
+    """Named metrics with constant labels (e.g. {"rig": "banco1"}) plus per-metric labels.
+
+    counter/gauge/histogram return the existing metric when called again with the same name and
+    labels, so components can look metrics up lazily (e.g. one histogram per Modbus operation).
+    """
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.metrics = {}  # (nome, etichette) -> metrica
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = cls(**kwargs)
+                    self.help.setdefault(name, (cls.kind, help))
+        return metric
+
+    def counter(self, name, help="", labels=None, fn=None):
+        return self._get(Counter, name, help, labels, fn=fn)
+
+    def gauge(self, name, help="", labels=None, fn=None):
+        return self._get(Gauge, name, help, labels, fn=fn)
+
+    def histogram(self, name, help="", labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def items(self):
+        """[(name, {label: value}, metric)] including the registry labels."""
+        with self.lock:
+            entries = list(self.metrics.items())
+        return [(name, {**self.labels, **dict(labels)}, metric) for (name, labels), metric in entries]
+
+    def snapshot(self):
+        """JSON-ready {name: [{"labels": ..., "value": ...}]}; histogram values are count/sum/p50/p95/p99."""
+        snapshot = {}
+        for name, labels, metric in self.items():
+            try:
+                value = metric.get()
+            except Exception as e:
+                logging.getLogger().debug(f"Metrica {name} non disponibile: {e}")
+                continue
+            snapshot.setdefault(name, []).append({"labels": labels, "value": value})
+        return snapshot
+
+
+def _format_labels(labels, extra=None):
+    labels = {**labels, **(extra or {})}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value) if value != int(value) else str(int(value))
+
+
+def _render_metric(full_name, kind, labels, metric):
+    if kind != "histogram":
+        return [f"{full_name}{_format_labels(labels)} {_format_value(metric.get())}"]
+    lines = []
+    cumulative = 0
+    for bound, count in zip(metric.bounds + (math.inf,), list(metric.counts)):
+        cumulative += count
+        lines.append(f"{full_name}_bucket{_format_labels(labels, {'le': _format_value(bound)})} {cumulative}")
+    lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(metric.sum)}")
+    lines.append(f"{full_name}_count{_format_labels(labels)} {cumulative}")
+    return lines
+
+
+def render_prometheus(registries):
+    """Prometheus text exposition format of one or more registries (same name: one HELP/TYPE block)."""
+    groups = {}
+    kinds = {}
+    for registry in registries:
+        for name, labels, metric in registry.items():
+            groups.setdefault(name, []).append((labels, metric))
+            kinds.setdefault(name, registry.help.get(name, (metric.kind, "")))
+    lines = []
+    for name, entries in groups.items():
+        kind, help = kinds[name]
+        full_name = f"{NAMESPACE}_{name}"
+        if help:
+            lines.append(f"# HELP {full_name} {help}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        for labels, metric in entries:
+            try:  # One failing metric (callback error, unexpected value) must not lose the others
+                lines.extend(_render_metric(full_name, kind, labels, metric))
+            except Exception as e:
+                logging.getLogger().debug(f"Metrica {name} non disponibile: {e}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(registries, path):
+    """Atomic write (temporary file + rename), as required by the textfile collector."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if path.endswith(".json"):
+        merged = {}
+        for registry in registries:
+            for name, values in registry.snapshot().items():
+                merged.setdefault(name, []).extend(values)
+        text = json.dumps({"time": time.time(), "metrics": merged}, indent=1)
+    else:
+        text = render_prometheus(registries)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", newline="\n") as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+class MetricsExporter:
+    """Writes the registries to `path` every `interval` seconds on a daemon thread, and once more on stop().
+
+    `registries` is a list or a callable returning one (the rigs of a RigManager can change).
+    """
+
+    def __init__(self, registries, path, interval=10.0):
+        self.registries = registries
+        self.path = path
+        self.interval = interval
+        self.writes = 0
+        self.errors = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="MetricsExporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+        self.write()
+
+    def write(self):
+        try:
+            registries = self.registries() if callable(self.registries) else self.registries
+            write_metrics(registries, self.path)
+            self.writes += 1
+        except Exception as e:  # Never let the exporter thread die: the next interval tries again
+            self.errors += 1
+            if self.errors == 1 or self.errors % 100 == 0:
+                logging.getLogger().error(f"Errore scrittura metriche su {self.path}: {e}")
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write()
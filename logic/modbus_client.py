@@ -0,0 +1,252 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import threading
+import time
+from logic.metrics import MetricsRegistry
+from logic.startup import resolve
+
+
+class AsyncModbusBanco:
+    """Drives ModbusBancoCollaudo from a supervisor coroutine on the AsyncioWorker loop.
+
+    The synchronous driver runs on a single dedicated thread, so neither the Tk thread nor the
+    plan scheduler ever waits on TCP. The connection is kept open and re-established with
+    exponential backoff; speed setpoints coalesce (only the newest pending value is written,
+    and it is re-applied after a reconnect). Setpoints are refused while no bench is configured,
+    and a disconnect discards the pending one, so a later connect never spins the roller by itself.
+    set_speed returns a Future completed when the value is written (cancelled if superseded). Bench telemetry (actual roller speed, km/h) is
+    polled at poll_rate_hz through `telemetry_reader` (default: the driver's get_motor_speed,
+    in km/h * 10, if it has one).
+    """
+
+    def __init__(self, worker, modbus, poll_rate_hz=2.0, max_backoff=10.0, telemetry_reader=None, metrics=None):
+        self.worker = worker
+        self.modbus = modbus
+        self.poll_period = 1.0 / poll_rate_hz if poll_rate_hz else None
+        self.max_backoff = max_backoff
+        self.telemetry_reader = telemetry_reader  # None: the driver's get_motor_speed, resolved on first connect
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Modbus")  # driver is not thread-safe
+        self.target = None  # (ip, port) desiderati, None = disconnesso
+        self.connected = False
+        self.connected_event = threading.Event()
+        self.pending_speed = None
+        self.pending_future = None
+        self.pending_lock = threading.Lock()
+        self.latest_speed = None
+        self.latest_speed_t = 0.0
+        self.closing = False
+        self.writes = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.reconnects = 0
+        self.errors = 0
+        self.polls = 0
+        self.write_time_max = 0.0
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics.gauge("modbus_connected", "Banco Modbus connesso (0/1)", fn=lambda: int(self.connected))
+        self.metrics.counter("modbus_errors_total", "Errori di comunicazione con il banco", fn=lambda: self.errors)
+        self.metrics.counter("modbus_reconnects_total", "Riconnessioni al banco", fn=lambda: self.reconnects)
+        self.loop = None
+        self.wake = None
+        self.task = None
+        self.start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # The supervisor task starts at the first command, so an unused bench costs no worker or driver
+        with self.start_lock:
+            if self.task is None:
+                self.worker.run_coroutine(self._start()).result()
+
+    async def _start(self):
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.task = self.loop.create_task(self._run())
+
+    def _notify(self):
+        self._ensure_started()
+        self.loop.call_soon_threadsafe(self.wake.set)
+
+    # --- API thread-safe ---
+
+    def connect(self, ip, port=502):
+        self.target = (ip, port)
+        self._notify()
+
+    def disconnect(self):
+        self.target = None
+        self._drop_pending()
+        self._notify()
+
+    def is_connected(self):
+        return self.connected
+
+    def is_connecting(self):
+        return self.target is not None and not self.connected
+
+    def wait_connected(self, timeout):
+        return self.connected_event.wait(timeout)
+
+    def set_speed(self, speedkmh):
+        """Queues a setpoint and returns its Future; returns None (and logs) if no bench is configured."""
+        if self.target is None:
+            self.rejected += 1
+            logging.getLogger().error(f"Banco non connesso: velocità {speedkmh} km/h non impostata")
+            return None
+        future = Future()
+        with self.pending_lock:
+            if self.pending_future is not None:
+                self.coalesced += 1
+                self.pending_future.cancel()
+            self.pending_speed, self.pending_future = speedkmh, future
+        self._notify()
+        return future
+
+    def _take_pending(self):
+        with self.pending_lock:
+            pending = self.pending_speed, self.pending_future
+            self.pending_speed = self.pending_future = None
+        return pending
+
+    def _drop_pending(self):
+        _, future = self._take_pending()
+        if future is not None:
+            future.cancel()
+
+    def actual_speed(self):
+        """Last polled roller speed [km/h], or None if telemetry is stale."""
+        if self.latest_speed is None or time.monotonic() - self.latest_speed_t > 3 * (self.poll_period or 1.0):
+            return None
+        return self.latest_speed
+
+    def stats(self):
+        return {"connected": self.connected, "writes": self.writes, "coalesced": self.coalesced,
+                "rejected": self.rejected, "reconnects": self.reconnects, "errors": self.errors, "polls": self.polls,
+                "write_ms_max": 1000 * self.write_time_max}
+
+    def close(self, timeout=5.0):
+        self.closing = True
+        self.target = None
+        if self.task is not None:
+            try:
+                self.worker.run_coroutine(self._stop()).result(timeout)
+            except Exception as e:
+                logging.getLogger().error(f"Errore chiusura client banco: {e}")
+        self.executor.shutdown(wait=True)
+
+    async def _stop(self):
+        self.wake.set()
+        await self.task
+
+    # --- Supervisore sul loop asyncio ---
+
+    async def _call(self, fn, *args):
+        histogram = self.metrics.histogram("modbus_call_seconds", "Durata delle chiamate al driver Modbus",
+                                           {"op": getattr(fn, "__name__", "call")})
+        t0 = time.perf_counter()
+        try:
+            return await self.loop.run_in_executor(self.executor, fn, *args)
+        finally:
+            histogram.observe_since(t0)
+
+    def _set_connected(self, connected):
+        self.connected = connected
+        if connected:
+            self.connected_event.set()
+        else:
+            self.connected_event.clear()
+
+    async def _run(self):
+        backoff = 0.5
+        retry_at = 0.0
+        next_poll = self.loop.time()
+        was_connected = False
+        while True:
+            self.wake.clear()
+            now = self.loop.time()
+            try:
+                if self.target is None:
+                    self._drop_pending()
+                    if self.connected:
+                        await self._call(self.modbus.disconnetti)
+                        self._set_connected(False)
+                        logging.getLogger().info("Banco disconnesso")
+                    if self.closing:
+                        return
+                elif not self.connected and now >= retry_at:
+                    ip, port = self.target
+                    if self.telemetry_reader is None:
+                        # The first use may build the driver (logic.startup.LazyDevice): keep it off the loop
+                        modbus = await self.loop.run_in_executor(self.executor, resolve, self.modbus)
+                        self.telemetry_reader = getattr(modbus, "get_motor_speed", None) or False
+                    await self._call(self.modbus.connetti, ip, port)
+                    if await self._call(self.modbus.is_connesso):
+                        self._set_connected(True)
+                        backoff = 0.5
+                        if was_connected:
+                            self.reconnects += 1
+                        was_connected = True
+                        next_poll = self.loop.time()
+                        logging.getLogger().info(f"Banco connesso a {ip}:{port}")
+                    else:
+                        retry_at = self.loop.time() + backoff
+                        logging.getLogger().warning(f"Connessione al banco {ip}:{port} fallita, nuovo tentativo tra {backoff:.1f}s")
+                        backoff = min(backoff * 2, self.max_backoff)
+
+                if self.connected and self.pending_speed is not None:
+                    speed, future = self._take_pending()
+                    t0 = time.monotonic()
+                    logging.getLogger().info(f"Impostazione velocità banco a {speed} km/h")
+                    try:
+                        await self._call(self.modbus.set_motor_speed, int(speed * 10))  # Assuming API needs speed * 10
+                    except Exception:
+                        with self.pending_lock:
+                            if self.pending_speed is None and self.target is not None:
+                                # Re-applied after reconnecting
+                                self.pending_speed, self.pending_future = speed, future
+                                future = None
+                        if future is not None:
+                            future.cancel()
+                        raise
+                    if future.set_running_or_notify_cancel():
+                        future.set_result(None)
+                    self.writes += 1
+                    self.write_time_max = max(self.write_time_max, time.monotonic() - t0)
+
+                if self.connected and self.poll_period and self.loop.time() >= next_poll:
+                    if self.telemetry_reader:
+                        value = await self._call(self.telemetry_reader)
+                        if value is not None:  # No reading this time: the last one just ages out
+                            self.latest_speed = value / 10
+                            self.latest_speed_t = time.monotonic()
+                    elif not await self._call(self.modbus.is_connesso):
+                        raise ConnectionError("connessione persa")
+                    self.polls += 1
+                    next_poll += self.poll_period
+                    if next_poll < self.loop.time():
+                        next_poll = self.loop.time() + self.poll_period
+            except Exception as e:
+                self.errors += 1
+                logging.getLogger().error(f"Errore comunicazione banco: {e}")
+                if self.connected:
+                    self._set_connected(False)
+                    try:
+                        await self._call(self.modbus.disconnetti)
+                    except Exception:
+                        pass
+                retry_at = self.loop.time() + backoff
+                backoff = min(backoff * 2, self.max_backoff)
+
+            if self.target is None and self.closing and not self.connected:
+                return
+            timeout = None
+            if self.connected and self.pending_speed is not None:
+                timeout = 0
+            elif self.connected and self.poll_period:
+                timeout = max(0.0, next_poll - self.loop.time())
+            elif self.target is not None and not self.connected:
+                timeout = max(0.0, retry_at - self.loop.time())
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,337 @@
+"""Compilatore dei piani comandi CSV.
+
+Formato (separatore ';', la prima riga è l'intestazione):
+
+    wait;livelli;potenza;simulazione;speed_banco;potenza_lorenz;coppia_lorenz
+
+Ogni riga ha un tempo [s] e al più un comando; una riga con solo la velocità banco (o vuota oltre
+al tempo) mantiene il freno invariato. Estensioni:
+
+- rampa lineare: "100..200" in una colonna comando e/o velocità; il tempo della riga è la durata
+  totale, suddivisa in passi da RAMP_STEP_S secondi ("100..200/20" per 20 passi espliciti);
+- blocchi ripetuti: una riga "ripeti N" (o "repeat N") nella prima colonna apre il blocco,
+  "fine" (o "end") lo chiude; i blocchi possono essere annidati;
+- righe che iniziano con "#" sono commenti.
+
+Il piano compilato è immutabile e compatto (array tipizzati) e si indicizza come una sequenza di
+tuple (command_type, value, wait_time, speed_banco). I piani compilati sono memorizzati per
+hash del file, così ricaricare un piano già visto non lo rianalizza.
+"""
+from array import array
+from collections import OrderedDict
+import csv
+import hashlib
+import io
+from itertools import accumulate
+import logging
+import math
+import os
+import pickle
+import threading
+
+COMPILER_VERSION = 1  # da incrementare se cambia il formato compilato o la semantica
+RAMP_STEP_S = 1.0  # durata di default di un passo di rampa
+MAX_STEPS = 10_000_000
+MAX_ERRORS = 50
+DEFAULT_CACHE_DIR = os.path.join("output", "plan_cache")
+
+# Colonna CSV -> tipo di comando; l'indice in COMMAND_TYPES è il codice memorizzato nel piano
+COLUMN_COMMANDS = {1: "livelli", 2: "potenza", 3: "simulazione", 5: "potenza_lorenz", 6: "coppia_lorenz"}
+COMMAND_TYPES = (None, "livelli", "potenza", "simulazione", "potenza_lorenz", "coppia_lorenz")
+FLOAT_COMMANDS = {"coppia_lorenz"}
+VALUE_LIMITS = {"livelli": (0, 200), "potenza": (0, None), "potenza_lorenz": (0, None), "coppia_lorenz": (0, None)}
+SPEED_COLUMN = 4
+SPEED_LIMITS = (0, 80)
+
+
+class PlanError(ValueError):
+    """Invalid plan; `errors` lists (line, message) for every problem found (up to MAX_ERRORS)."""
+
+    def __init__(self, source, errors):
+        self.source = source
+        self.errors = errors
+        details = "\n".join(f"  riga {line}: {message}" for line, message in errors)
+        super().__init__(f"Piano {source} non valido ({len(errors)} errori):\n{details}")
+
+
+class Plan:
+    """Compiled, immutable command plan: a sequence of (command_type, value, wait_time, speed_banco).
+
+    Steps are stored column-wise in typed arrays (about 40 bytes per step) and tuples are built
+    only when a step is read, so the scheduler iterates lazily. start(i) is the planned start of
+    step i in seconds and line(i) the CSV line it comes from.
+    """
+
+    __slots__ = ("_kinds", "_values", "_waits", "_speeds", "_starts", "_lines", "source", "digest")
+
+    def __init__(self, kinds, values, waits, speeds, lines, source=None, digest=None):
+        self._kinds = kinds
+        self._values = values
+        self._waits = waits
+        self._speeds = speeds
+        self._lines = lines
+        self.source = source
+        self.digest = digest
+        self._starts = array('d', accumulate(waits, initial=0.0))  # Last: the plan is frozen from here on
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        command_type = COMMAND_TYPES[self._kinds[index]]
+        value = self._values[index]
+        if command_type is None:
+            value = None
+        elif command_type not in FLOAT_COMMANDS:
+            value = int(value)
+        speed = self._speeds[index]
+        if speed != speed:  # NaN = nessuna velocità banco
+            speed = None
+        elif speed.is_integer():
+            speed = int(speed)
+        return command_type, value, self._waits[index], speed
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "_starts"):
+            raise AttributeError("Plan è immutabile")
+        object.__setattr__(self, name, value)
+
+    def start(self, index):
+        return self._starts[index]
+
+    def line(self, index):
+        return self._lines[index]
+
+    @property
+    def duration(self):
+        return self._starts[-1]
+
+    def __repr__(self):
+        return f"Plan({self.source!r}, {len(self)} passi, {self.duration:.1f}s)"
+
+    # --- Serializzazione per la cache ---
+
+    def _to_bytes(self):
+        return pickle.dumps({"version": COMPILER_VERSION,
+                             "arrays": {name: (getattr(self, name).typecode, getattr(self, name).tobytes())
+                                        for name in ("_kinds", "_values", "_waits", "_speeds", "_lines")}},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def _from_bytes(cls, data, source, digest):
+        payload = pickle.loads(data)
+        if payload.get("version") != COMPILER_VERSION:
+            raise ValueError("versione del piano compilato diversa")
+        arrays = {}
+        for name, (typecode, raw) in payload["arrays"].items():
+            arrays[name] = array(typecode)
+            arrays[name].frombytes(raw)
+        return cls(arrays["_kinds"], arrays["_values"], arrays["_waits"], arrays["_speeds"], arrays["_lines"],
+                   source, digest)
+
+
+class _PlanBuilder:
+    def __init__(self):
+        self.kinds = array('b')
+        self.values = array('d')
+        self.waits = array('d')
+        self.speeds = array('d')
+        self.lines = array('i')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, kind, value, wait, speed, line):
+        self.kinds.append(kind)
+        self.values.append(value)
+        self.waits.append(wait)
+        self.speeds.append(speed)
+        self.lines.append(line)
+
+    def repeat(self, start, count):
+        for column in (self.kinds, self.values, self.waits, self.speeds, self.lines):
+            block = column[start:]
+            for _ in range(count - 1):
+                column.extend(block)
+
+
+def _parse_number(text, integer):
+    try:
+        value = float(text)
+    except ValueError:
+        value = math.nan
+    if not math.isfinite(value):
+        raise ValueError(f"numero non valido: {text!r}")
+    if integer and not value.is_integer():
+        raise ValueError(f"{text} non è un intero")
+    return value
+
+
+def _parse_cell(text, integer):
+    """Returns (start, end, steps): end is None for a constant, steps None unless given as 'a..b/N'."""
+    if ".." not in text:
+        return _parse_number(text, integer), None, None
+    ramp, _, steps = text.partition("/")
+    start, _, end = ramp.partition("..")
+    steps = int(steps) if steps else None
+    if steps is not None and steps < 1:
+        raise ValueError(f"numero di passi della rampa non valido: {steps}")
+    return _parse_number(start.strip(), integer), _parse_number(end.strip(), integer), steps
+
+
+def _check_limits(name, values, limits):
+    low, high = limits
+    for value in values:
+        if value is None:
+            continue
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise ValueError(f"{name} {value:g} fuori dal range consentito ({low}-{high if high is not None else '∞'})")
+
+
+def _ramp(start, end, steps, integer):
+    if end is None:
+        return [start] * steps
+    if steps == 1:
+        return [end]
+    values = [start + (end - start) * k / (steps - 1) for k in range(steps)]
+    return [float(round(value)) for value in values] if integer else values
+
+
+def _read_rows(reader, errors):
+    """Rows of `reader`; a file that cannot be read as CSV text ends the plan with an error."""
+    try:
+        yield from reader
+    except (csv.Error, UnicodeDecodeError) as e:
+        errors.append((reader.line_num + 1, f"file non leggibile: {e}"))
+
+
+def compile_stream(file, source="<piano>", ramp_step=RAMP_STEP_S, digest=None):
+    """Compiles a plan from an open text file, row by row; raises PlanError listing every invalid line."""
+    builder = _PlanBuilder()
+    errors = []
+    blocks = []  # (indice del primo passo, ripetizioni, riga) dei blocchi aperti
+    reader = csv.reader(file, delimiter=';')
+    rows = _read_rows(reader, errors)
+    next(rows, None)  # Intestazione
+    for row in rows:
+        line = reader.line_num
+        cells = [cell.strip() for cell in row]
+        if not any(cells) or cells[0].startswith("#"):
+            continue
+        try:
+            words = cells[0].lower().split()
+            if not words:
+                raise ValueError("tempo mancante nella prima colonna")
+            if words[0] in ("ripeti", "repeat"):
+                if len(words) != 2 or not words[1].isdigit() or int(words[1]) < 1:
+                    raise ValueError(f"ripetizione non valida: {cells[0]!r} (atteso 'ripeti N' con N >= 1)")
+                blocks.append((len(builder), int(words[1]), line))
+                continue
+            if words[0] in ("fine", "end"):
+                if not blocks:
+                    raise ValueError("'fine' senza 'ripeti' corrispondente")
+                start, count, _ = blocks.pop()
+                if len(builder) + (len(builder) - start) * (count - 1) > MAX_STEPS:
+                    raise ValueError(f"il piano supera {MAX_STEPS} passi")
+                builder.repeat(start, count)
+                continue
+
+            wait = _parse_number(cells[0], integer=False)
+            if wait < 0:
+                raise ValueError(f"tempo negativo: {cells[0]}")
+            commands = [(column, COLUMN_COMMANDS[column]) for column in COLUMN_COMMANDS
+                        if column < len(cells) and cells[column]]
+            if len(commands) > 1:
+                raise ValueError(f"più comandi nella stessa riga: {', '.join(name for _, name in commands)}")
+
+            kind, value_cell = 0, (math.nan, None, None)
+            if commands:
+                column, command_type = commands[0]
+                kind = COMMAND_TYPES.index(command_type)
+                value_cell = _parse_cell(cells[column], integer=command_type not in FLOAT_COMMANDS)
+            speed_cell = (math.nan, None, None)
+            if SPEED_COLUMN < len(cells) and cells[SPEED_COLUMN]:
+                speed_cell = _parse_cell(cells[SPEED_COLUMN], integer=False)
+
+            explicit = {cell[2] for cell in (value_cell, speed_cell) if cell[2] is not None}
+            if len(explicit) > 1:
+                raise ValueError("rampe con numero di passi diverso nella stessa riga")
+            is_ramp = value_cell[1] is not None or speed_cell[1] is not None
+            steps = explicit.pop() if explicit else (max(1, round(wait / ramp_step)) if is_ramp else 1)
+            if len(builder) + steps > MAX_STEPS:
+                raise ValueError(f"il piano supera {MAX_STEPS} passi")
+
+            integer = kind != 0 and COMMAND_TYPES[kind] not in FLOAT_COMMANDS
+            values = _ramp(value_cell[0], value_cell[1], steps, integer)
+            speeds = _ramp(speed_cell[0], speed_cell[1], steps, integer=False)
+            if kind:
+                _check_limits(COMMAND_TYPES[kind], [v for v in value_cell[:2] if v is not None],
+                              VALUE_LIMITS.get(COMMAND_TYPES[kind], (None, None)))
+            _check_limits("velocità banco", [v for v in speed_cell[:2] if v is not None and v == v], SPEED_LIMITS)
+            for value, speed in zip(values, speeds):
+                builder.append(kind, value, wait / steps, speed, line)
+        except Exception as e:  # Any parse failure is reported as a plan error, never raised as is
+            errors.append((line, str(e) if isinstance(e, ValueError) else f"riga non interpretabile ({e!r})"))
+            if len(errors) >= MAX_ERRORS:
+                break
+    for _, _, line in blocks:
+        errors.append((line, "'ripeti' senza 'fine'"))
+    if errors:
+        raise PlanError(source, errors)
+    return Plan(builder.kinds, builder.values, builder.waits, builder.speeds, builder.lines, source, digest)
+
+
+# Piani già compilati in questo processo, per hash del file
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+MEMORY_CACHE_SIZE = 8
+
+
+def compile_plan(file_path, cache_dir=DEFAULT_CACHE_DIR, ramp_step=RAMP_STEP_S):
+    """Compiles a plan CSV; cached (in memory and, unless cache_dir is None, on disk) by content hash."""
+    hasher = hashlib.sha256(f"{COMPILER_VERSION};{ramp_step}".encode())
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+
+    with _memory_cache_lock:
+        plan = _memory_cache.get(digest)
+        if plan is not None:
+            _memory_cache.move_to_end(digest)
+            return plan
+    cache_path = os.path.join(cache_dir, f"{digest}.plan") if cache_dir else None
+    plan = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as file:
+                plan = Plan._from_bytes(file.read(), file_path, digest)
+        except Exception as e:
+            logging.getLogger().warning(f"Cache del piano {cache_path} non leggibile, ricompilo: {e}")
+    if plan is None:
+        with open(file_path, mode='r', newline='') as file:
+            plan = compile_stream(file, source=file_path, ramp_step=ramp_step, digest=digest)
+        if cache_path:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                temp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(temp_path, "wb") as file:
+                    file.write(plan._to_bytes())
+                os.replace(temp_path, cache_path)
+            except OSError as e:
+                logging.getLogger().warning(f"Impossibile salvare la cache del piano: {e}")
+    with _memory_cache_lock:
+        _memory_cache[digest] = plan
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+    return plan
+
+
+def compile_text(text, source="<testo>", ramp_step=RAMP_STEP_S):
+    return compile_stream(io.StringIO(text), source=source, ramp_step=ramp_step)
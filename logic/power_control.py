@@ -0,0 +1,167 @@
+from collections import deque
+import logging
+import threading
+import time
+
+STATS_WINDOW = 1000  # ultimi periodi e latenze di attuazione conservati per stats()
+
+# Guadagni di default per (grandezza controllata, attuatore): uscita in livelli /200 o km/h
+DEFAULT_GAINS = {
+    ("power", "level"): {"kp": 0.1, "ki": 0.2, "rate_limit": 40.0},
+    ("torque", "level"): {"kp": 15.0, "ki": 30.0, "rate_limit": 40.0},
+    ("power", "bench"): {"kp": 0.02, "ki": 0.04, "rate_limit": 5.0},
+    ("torque", "bench"): {"kp": 3.0, "ki": 6.0, "rate_limit": 5.0},
+}
+OUTPUT_LIMITS = {"level": (0, 200), "bench": (0, 80)}
+
+
+class PowerController:
+    """PI loop holding a measured quantity (Lorenz power or torque) at a target.
+
+    measure() returns the latest measurement or None; actuate(output) applies the output and may
+    return a Future, whose completion time is the actuation latency. The loop runs on its own
+    thread at absolute deadlines. The output is clamped to output_limits and slew-limited to
+    rate_limit units/s; the integrator is frozen while the output is saturated in the direction
+    of the error (anti-windup). Settling time is measured after every target change: the time
+    until the error stays within tolerance for settle_hold seconds.
+    """
+
+    def __init__(self, measure, actuate, target, kp, ki, output_limits, rate_limit, initial_output,
+                 rate_hz=10.0, tolerance=0.03, tolerance_abs=2.0, settle_hold=1.0, quantum=None, name="potenza"):
+        self.measure = measure
+        self.actuate = actuate
+        self.kp = kp
+        self.ki = ki
+        self.output_min, self.output_max = output_limits
+        self.rate_limit = rate_limit
+        self.period = 1.0 / rate_hz
+        self.tolerance = tolerance
+        self.tolerance_abs = tolerance_abs
+        self.settle_hold = settle_hold
+        self.quantum = quantum  # risoluzione dell'attuatore (es. 1 livello): evita comandi identici
+        self.name = name
+        self.output = min(max(initial_output, self.output_min), self.output_max)
+        self.base_output = self.output
+        self.integral = 0.0
+        self.last_sent = None
+        self.lock = threading.Lock()
+        self.target = target
+        self.target_changed = time.monotonic()
+        self.in_band_since = None
+        self.settled = False
+        self.settling_times = []
+        self.periods = deque(maxlen=STATS_WINDOW)
+        self.actuation_latencies = deque(maxlen=STATS_WINDOW)
+        self.missing = 0
+        self.saturated = 0
+        self.ticks = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def set_target(self, target):
+        with self.lock:
+            if target != self.target:
+                self.target = target
+                self.target_changed = time.monotonic()
+                self.in_band_since = None
+                self.settled = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="PowerController", daemon=True)
+        self._thread.start()
+        logging.getLogger().info(f"Controllo in anello chiuso ({self.name}) avviato: obiettivo {self.target}")
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        logging.getLogger().info(f"Controllo in anello chiuso ({self.name}) fermato: {self.stats()}")
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        next_deadline = time.monotonic()
+        last_tick = None
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if last_tick is not None:
+                self.periods.append(now - last_tick)
+            last_tick = now
+            try:
+                self._tick(now)
+            except Exception as e:
+                logging.getLogger().error(f"Errore nel controllo in anello chiuso: {e}")
+            next_deadline += self.period
+            delay = next_deadline - time.monotonic()
+            if delay < 0:
+                next_deadline = time.monotonic()
+            elif self._stop_event.wait(delay):
+                break
+
+    def _tick(self, now):
+        self.ticks += 1
+        measured = self.measure()
+        if measured is None:
+            self.missing += 1
+            if self.missing == 1 or self.missing % 50 == 0:
+                logging.getLogger().warning(f"Controllo anello chiuso: nessuna misura Lorenz ({self.missing})")
+            return
+        with self.lock:
+            target = self.target
+        error = target - measured
+        self._update_settling(now, error, target)
+
+        dt = self.period
+        candidate_integral = self.integral + error * dt
+        output = self.base_output + self.kp * error + self.ki * candidate_integral
+        saturated_high = output > self.output_max and error > 0
+        saturated_low = output < self.output_min and error < 0
+        if saturated_high or saturated_low:
+            self.saturated += 1  # Anti-windup: keep the previous integral
+            output = self.base_output + self.kp * error + self.ki * self.integral
+        else:
+            self.integral = candidate_integral
+        output = min(max(output, self.output_min), self.output_max)
+        max_step = self.rate_limit * dt
+        output = min(max(output, self.output - max_step), self.output + max_step)
+        self.output = output
+
+        command = round(output / self.quantum) * self.quantum if self.quantum else round(output, 2)
+        if command != self.last_sent:
+            self.last_sent = command
+            sent = time.monotonic()
+            future = self.actuate(command)
+            if future is not None:
+                future.add_done_callback(lambda done: done.cancelled() or
+                                         self.actuation_latencies.append(time.monotonic() - sent))
+
+    def _update_settling(self, now, error, target):
+        if self.settled:
+            return
+        if abs(error) <= max(self.tolerance * abs(target), self.tolerance_abs):
+            if self.in_band_since is None:
+                self.in_band_since = now
+            elif now - self.in_band_since >= self.settle_hold:
+                self.settled = True
+                settling = self.in_band_since - self.target_changed
+                self.settling_times.append(settling)
+                logging.getLogger().info(f"Anello chiuso ({self.name}): obiettivo {target} raggiunto in {settling:.2f}s")
+        else:
+            self.in_band_since = None
+
+    def stats(self):
+        periods = list(self.periods)
+        latencies = list(self.actuation_latencies)
+        return {
+            "target": self.target,
+            "output": round(self.output, 2),
+            "ticks": self.ticks,
+            "loop_period_ms_mean": 1000 * sum(periods) / len(periods) if periods else None,
+            "loop_period_ms_max": 1000 * max(periods) if periods else None,
+            "actuation_ms_mean": 1000 * sum(latencies) / len(latencies) if latencies else None,
+            "actuation_ms_max": 1000 * max(latencies) if latencies else None,
+            "settling_s": [round(t, 2) for t in self.settling_times],
+            "missing": self.missing,
+            "saturated": self.saturated,
+        }
@@ -0,0 +1,264 @@
+"""Replay of a recorded session through the acquisition pipeline of BenchEngine.
+
+    python headless.py --replay output/20240501_101500_bike_data_log.csv --replay-speed max
+
+The rows of a session CSV (DataProcessor layout) become FTMS notifications, Lorenz samples and
+bench telemetry again, and enter the engine where live data does: the BLE notification callback
+(handle_bike_data), the Lorenz ring buffer and the bench client. Fusion, recording and record
+listeners run unchanged on a virtual clock that follows the recorded timestamps, so the session
+can be replayed in real time, at any multiple of it, or as fast as the pipeline goes.
+"""
+import csv
+from datetime import datetime
+import logging
+import threading
+import time
+from logic.data_processing import DATA_FIELDS, DataProcessor
+from logic.fusion import INTERVAL_STAT_FIELDS
+from logic.lorenz_acquisition import LORENZ_FIELDS
+from logic.metrics import MetricsRegistry
+from logic.simulators import SimulatedAsyncioWorker
+
+REPLAY_ADDRESS = "REPLAY:00:00:00:00:01"
+BACKPRESSURE_CHECK = 256  # righe tra due controlli della coda di scrittura, a velocità massima
+MAX_CLOCK_SKEW = 0.2  # s, scarto massimo tra timestamp e colonna ms oltre il quale vale ms
+
+
+def _value(text):
+    if not text:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def read_session(path):
+    """Yields (wall_time, ms, {field: value}) for each row of a session CSV."""
+    epochs = {}  # "YYYY-mm-dd HH:MM" -> epoch: strptime once per minute, not once per row
+    with open(path, newline='') as file:
+        reader = csv.reader(file, delimiter=';')
+        header = next(reader)
+        fields = header[2:]
+        for row in reader:
+            if len(row) < 2:
+                continue
+            stamp = row[0]
+            minute = epochs.get(stamp[:16])
+            if minute is None:
+                minute = epochs[stamp[:16]] = datetime.strptime(stamp[:16], "%Y-%m-%d %H:%M").timestamp()
+            yield minute + float(stamp[17:]), int(row[1]), dict(zip(fields, map(_value, row[2:])))
+
+
+def session_fields(path):
+    with open(path, newline='') as file:
+        return next(csv.reader(file, delimiter=';'))[2:]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(1000 * seconds, 3)
+
+
+class ReplayClock:
+    """Virtual monotonic clock in ns, advanced by the replay to the time of the sample being fed."""
+
+    def __init__(self):
+        self.now_ns = time.monotonic_ns()
+
+    def __call__(self):
+        return self.now_ns
+
+
+class ReplayBLEManager:
+    """Enough of BLEManager to deliver the recorded FTMS samples as notifications; brake commands are ignored."""
+
+    def __init__(self):
+        self.connected = False
+        self.callback = None
+
+    async def scan_devices(self, timeout=5):
+        return {REPLAY_ADDRESS: ("Replay", 0)}
+
+    async def connect_to_device(self, address):
+        self.connected = True
+
+    async def disconnect_device(self):
+        self.callback = None
+        self.connected = False
+        return True
+
+    def get_connection_status(self):
+        return self.connected
+
+    async def enable_indoor_bike_data_notifications(self, callback):
+        self.callback = callback
+
+    async def disable_indoor_bike_data_notifications(self):
+        self.callback = None
+
+    async def set_brake_power(self, power):
+        pass
+
+    async def set_brake_percentage(self, level):
+        pass
+
+    async def set_brake_simulation(self, grade=0):
+        pass
+
+
+class ReplayLorenzReader:
+    """The Lorenz samples are pushed into the acquisition buffer by the replay: the driver is never read."""
+
+    def is_connected(self):
+        return False
+
+
+class ReplayBench:
+    """Recorded bench telemetry in place of logic.modbus_client.AsyncModbusBanco; setpoints are ignored."""
+
+    def __init__(self):
+        self.speed = None
+        self.target = None
+
+    def actual_speed(self):
+        return self.speed
+
+    def set_speed(self, speed):
+        self.target = speed
+
+    def connect(self, ip, port=502):
+        pass
+
+    def wait_connected(self, timeout):
+        return False
+
+    def is_connected(self):
+        return False
+
+    def is_connecting(self):
+        return False
+
+    def disconnect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {"connected": False}
+
+
+class SessionReplay:
+    """Feeds a recorded session to a BenchEngine built on replay devices and a virtual clock.
+
+    speed: 1.0 is real time, 10.0 ten times faster, None as fast as possible (the session writer
+    is never allowed to drop rows: the replay waits when its queue is half full). The replayed
+    session is recorded under output_dir with the original timestamps and ms. run() returns the
+    throughput report.
+    """
+
+    def __init__(self, path, speed=1.0, output_dir="output/replay", record_listeners=(), **engine_kwargs):
+        from logic.engine import BenchEngine
+        if speed is not None and speed <= 0:
+            raise ValueError(f"Velocità di riproduzione non valida: {speed}")
+        self.path = path
+        self.speed = speed
+        fields = session_fields(path)
+        self.lorenz_fields = [field for field in LORENZ_FIELDS if field in fields]
+        self.ftms_fields = [field for field in DATA_FIELDS if field in fields and field not in LORENZ_FIELDS
+                            and field != "bench_speed"]
+        interval_stats = all(field in fields for field in INTERVAL_STAT_FIELDS)
+        self.clock = ReplayClock()
+        self.bench = ReplayBench()
+        self.ble_manager = ReplayBLEManager()
+        worker = SimulatedAsyncioWorker()
+        worker.start()
+        self.metrics = MetricsRegistry({"rig": "replay"})
+        data_processor = DataProcessor(extra_fields=INTERVAL_STAT_FIELDS if interval_stats else (),
+                                       backends=engine_kwargs.pop("backends", ("csv",)), name="replay",
+                                       output_dir=output_dir, metrics=self.metrics)
+        self.engine = BenchEngine(worker=worker, ble_manager=self.ble_manager, lorenz_reader=ReplayLorenzReader(),
+                                  bench=self.bench, find_lorenz_port=lambda description: None,
+                                  data_processor=data_processor, lorenz_interval_stats=interval_stats,
+                                  clock=self.clock, metrics=self.metrics, known_trainers_path=None,
+                                  **{**engine_kwargs, "supervise": False})  # Stalls are meaningless on a virtual clock
+        self.engine.owns_worker = True
+        for listener in record_listeners:
+            self.engine.add_record_listener(listener)
+        self.samples = 0
+        self.max_lag = 0.0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        engine = self.engine
+        engine.connect_ble(REPLAY_ADDRESS)
+        engine.enable_data().result()
+        notify = self.ble_manager.callback
+        writer = engine.data_processor.writer
+        lorenz = engine.lorenz_acquisition
+        origin_ns = self.clock.now_ns
+        first_wall = first_ms = last_t = None
+        t0 = time.perf_counter()
+        for wall_time, ms, values in read_session(self.path):
+            if self._stop_event.is_set():
+                break
+            if first_wall is None:
+                first_wall = wall_time
+                # Same wall time and ms reference as the recorded session (middle of the first ms step)
+                engine.data_processor.start_time = wall_time - (ms + 0.5) / 10
+                engine.data_processor.start_monotonic_ns = origin_ns - (ms * 10 + 5) * 10_000_000
+                first_ms = ms
+            offset = wall_time - first_wall
+            if abs(offset - (ms - first_ms) / 10) > MAX_CLOCK_SKEW:
+                offset = (ms - first_ms) / 10  # Wall-clock step (clock sync, older logs): trust the ms column
+            t_ns = origin_ns + int(offset * 1e9)
+            if last_t is not None and t_ns < last_t:
+                t_ns = last_t  # The buffers need non-decreasing timestamps
+            last_t = t_ns
+            if self.speed is not None:
+                delay = t0 + (t_ns - origin_ns) / 1e9 / self.speed - time.perf_counter()
+                if delay > 0:
+                    if self._stop_event.wait(delay):
+                        break
+                else:
+                    self.max_lag = max(self.max_lag, -delay)
+            elif self.samples % BACKPRESSURE_CHECK == 0:
+                while writer.backlog() > writer.queue.maxsize // 2:
+                    time.sleep(0.001)
+
+            self.clock.now_ns = t_ns
+            lorenz_sample = {field: values.get(field) for field in self.lorenz_fields}
+            if any(value is not None for value in lorenz_sample.values()):
+                lorenz.push(t_ns, lorenz_sample)
+            self.bench.speed = values.get("bench_speed")
+            notify({field: values.get(field) for field in self.ftms_fields})
+            self.samples += 1
+        fed = time.perf_counter() - t0
+        engine.close()  # Flushes the fusion and drains the session writer
+        elapsed = time.perf_counter() - t0
+        return self._report(fed, elapsed, (last_t - origin_ns) / 1e9 if last_t is not None else 0.0)
+
+    def _report(self, fed, elapsed, duration):
+        writer = self.engine.data_processor.writer_stats()
+        report = {
+            "session": self.path,
+            "output": self.engine.data_processor.session_path,
+            "speed": self.speed or "max",
+            "samples": self.samples,
+            "rows_written": writer["written"],
+            "rows_dropped": writer["dropped"],
+            "session_s": round(duration, 3),
+            "elapsed_s": round(elapsed, 3),
+            "samples_per_s": round(self.samples / fed, 1) if fed > 0 else None,
+            "realtime_factor": round(duration / elapsed, 1) if elapsed > 0 else None,
+            "max_lag_ms": round(1000 * self.max_lag, 1),
+            "handle_bike_data_p99_ms": _ms(self.engine.ingest_seconds.quantile(0.99)),
+            "session_write_p99_ms": _ms(self.engine.data_processor.writer.write_seconds.quantile(0.99)),
+        }
+        if self.engine.fusion is not None:
+            report["fusion"] = self.engine.fusion.stats()
+        logging.getLogger().info(f"Riproduzione {self.path}: {report}")
+        return report
@@ -0,0 +1,219 @@
+import json
+import logging
+import re
+import threading
+import time
+from logic.data_processing import DataProcessor
+
+RIG_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")  # finisce nei nomi file della sessione
+CONNECT_TIMEOUT = 20.0  # s, attesa massima per connessione BLE e abilitazione dati
+MODBUS_CONNECT_TIMEOUT = 10.0
+
+
+class Rig:
+    """One rig of a RigManager: its configuration, BenchEngine and run state."""
+
+    def __init__(self, name, engine, address=None, plan=None, lorenz=True, modbus_ip=None, modbus_port=502):
+        self.name = name
+        self.engine = engine
+        self.address = address
+        self.plan = plan
+        self.lorenz = lorenz
+        self.modbus_ip = modbus_ip
+        self.modbus_port = modbus_port
+        self.state = "pronto"  # pronto, connessione, piano, completato, interrotto, errore
+        self.error = None
+        self.finished = threading.Event()
+        self.thread = None
+        self.last_written = 0
+        self.last_health = time.monotonic()
+
+
+class RigManager:
+    """Runs several independent rigs (trainer, Lorenz, bench, plan, recorder) in one process.
+
+    All engines share one AsyncioWorker event loop; everything else (command lanes, Lorenz
+    acquisition, fusion, plan scheduler, session writer) is per rig. Session files carry the
+    rig name, and a Lorenz port can be claimed by one rig only. With simulate=True every rig
+    gets its own simulated trainer (logic.simulators).
+    """
+
+    def __init__(self, worker=None, simulate=False):
+        self.simulate = simulate
+        self.owns_worker = worker is None
+        if worker is None:
+            if simulate:
+                from logic.simulators import SimulatedAsyncioWorker as AsyncioWorker
+            else:
+                from shared_lib.bluetooth_manager import AsyncioWorker
+            worker = AsyncioWorker()
+            worker.start()
+        self.worker = worker
+        self.rigs = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, path, simulate=False, **engine_kwargs):
+        """Builds a manager from a JSON file: a list of rigs (or {"rigs": [...]}) with the add_rig arguments."""
+        with open(path) as file:
+            config = json.load(file)
+        manager = cls(simulate=simulate)
+        try:
+            for rig_config in config["rigs"] if isinstance(config, dict) else config:
+                manager.add_rig(**{**engine_kwargs, **rig_config})
+        except Exception:
+            manager.close()
+            raise
+        return manager
+
+    def add_rig(self, name, address=None, plan=None, lorenz=True, lorenz_port=None, modbus_ip=None, modbus_port=502,
+                **engine_kwargs):
+        if not RIG_NAME_PATTERN.match(name):
+            raise ValueError(f"Nome banco non valido: {name!r} (ammessi lettere, cifre, '_', '-', '.')")
+        with self.lock:
+            if name in self.rigs:
+                raise ValueError(f"Banco {name} già presente")
+            for rig in self.rigs.values():
+                if address and rig.address == address:
+                    raise ValueError(f"Il rullo {address} è già assegnato al banco {rig.name}")
+                if lorenz and rig.lorenz and rig.engine.lorenz_port == lorenz_port:
+                    raise ValueError(f"Porta Lorenz {lorenz_port or 'automatica'} già usata dal banco {rig.name}: "
+                                     f"con più banchi indicare lorenz_port per ciascuno")
+            if self.simulate:
+                from logic.simulators import create_simulated_engine
+                address = address or f"SIM:00:00:00:00:{len(self.rigs) + 1:02X}"
+                engine = create_simulated_engine(worker=self.worker, address=address, name=name,
+                                                 lorenz_port=lorenz_port, **engine_kwargs)
+            else:
+                from logic.engine import BenchEngine
+                engine = BenchEngine(worker=self.worker, name=name, lorenz_port=lorenz_port, **engine_kwargs)
+            rig = Rig(name, engine, address, plan, lorenz, modbus_ip, modbus_port)
+            self.rigs[name] = rig
+        logging.getLogger().info(f"Banco {name} aggiunto")
+        return rig
+
+    # --- Esecuzione ---
+
+    def start(self, name):
+        """Connects the rig's devices and starts its plan on a dedicated thread."""
+        rig = self.rigs[name]
+        rig.finished.clear()
+        rig.thread = threading.Thread(target=self._run_rig, args=(rig,), name=f"Rig-{name}", daemon=True)
+        rig.thread.start()
+
+    def start_all(self):
+        for name in self.rigs:
+            self.start(name)
+
+    def _run_rig(self, rig):
+        engine = rig.engine
+        try:
+            rig.state = "connessione"
+            steps = DataProcessor.read_brake_commands_from_csv(rig.plan) if rig.plan else []
+            if rig.plan and not steps:
+                raise ValueError(f"nessun comando valido in {rig.plan}")
+            if not rig.address:
+                raise ValueError("indirizzo del rullo mancante")
+            engine.connect_ble(rig.address)
+            engine.enable_data().result(timeout=CONNECT_TIMEOUT)
+            if rig.lorenz and not engine.connect_lorenz():
+                engine.log.warning("Lorenz non connesso: registrazione senza dati Lorenz")
+            if rig.modbus_ip and not engine.connect_modbus(rig.modbus_ip, rig.modbus_port,
+                                                           timeout=MODBUS_CONNECT_TIMEOUT):
+                engine.log.warning("Banco Modbus non raggiungibile, riprovo in background")
+            if not steps:
+                rig.state = "acquisizione"
+                return
+
+            def on_finished(completed):
+                rig.state = "completato" if completed else "interrotto"
+                rig.finished.set()
+            rig.state = "piano"
+            engine.start_plan(steps, on_finished=on_finished)
+        except Exception as e:
+            rig.state = "errore"
+            rig.error = str(e)
+            engine.log.error(f"Errore avvio banco: {e}")
+            rig.finished.set()
+
+    def stop_all(self):
+        for rig in self.rigs.values():
+            rig.engine.stop_plan()
+
+    def wait(self, timeout=None):
+        """Waits until every rig with a plan has finished it (or failed); returns whether all did."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for rig in self.rigs.values():
+            if rig.thread is not None:
+                rig.thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            if rig.plan or rig.state == "errore":
+                if not rig.finished.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                    return False
+        return True
+
+    # --- Salute aggregata ---
+
+    def health(self):
+        """Per-rig and aggregate health: connections, plan progress, recording throughput and losses."""
+        now = time.monotonic()
+        rigs = {}
+        total = {"rows_per_s": 0.0, "written": 0, "dropped": 0, "backlog": 0, "errors": 0}
+        for name, rig in self.rigs.items():
+            engine = rig.engine
+            writer = engine.data_processor.writer_stats()
+            elapsed = now - rig.last_health
+            rate = (writer["written"] - rig.last_written) / elapsed if elapsed > 0 else 0.0
+            rig.last_written, rig.last_health = writer["written"], now
+            scheduler = engine.plan_scheduler
+            lanes = engine.dispatcher.stats()
+            errors = writer["errors"] + sum(lane["errors"] for lane in lanes.values())
+            links = engine.supervisor.stats()
+            rigs[name] = {
+                "state": rig.state,
+                "error": rig.error,
+                "ble": bool(engine.is_ble_connected()),
+                "lorenz": engine.is_lorenz_connected(),
+                "bench": engine.is_modbus_connected() if rig.modbus_ip else None,
+                "plan_step": scheduler.current_index if scheduler else None,
+                "plan_steps": len(scheduler.steps) if scheduler else None,
+                "plan_paused": engine.is_plan_paused(),
+                "links": {link: status["state"] for link, status in links.items()},
+                "link_recoveries": sum(status["recoveries"] for status in links.values()),
+                "rows_per_s": round(rate, 1),
+                "written": writer["written"],
+                "dropped": writer["dropped"],
+                "backlog": writer["backlog"],
+                "command_depth": sum(lane["depth"] for lane in lanes.values()),
+                "errors": errors,
+            }
+            total["rows_per_s"] += rate
+            for key in ("written", "dropped", "backlog", "errors"):
+                total[key] += rigs[name][key]
+        total["rows_per_s"] = round(total["rows_per_s"], 1)
+        total["rigs"] = len(rigs)
+        total["healthy"] = sum(1 for status in rigs.values()
+                               if status["state"] != "errore" and status["ble"] and status["bench"] is not False)
+        return {"rigs": rigs, "total": total}
+
+    def log_health(self):
+        health = self.health()
+        for name, status in health["rigs"].items():
+            step = f"{status['plan_step'] + 1}/{status['plan_steps']}" if status["plan_steps"] else "-"
+            logging.getLogger().info(
+                f"[{name}] {status['state']} BLE={'ok' if status['ble'] else 'no'} "
+                f"Lorenz={'ok' if status['lorenz'] else 'no'} passo {step} {status['rows_per_s']} righe/s "
+                f"scartate {status['dropped']} coda {status['backlog']} errori {status['errors']}")
+        total = health["total"]
+        logging.getLogger().info(f"Totale: {total['healthy']}/{total['rigs']} banchi in salute, "
+                                 f"{total['rows_per_s']} righe/s, {total['dropped']} scartate, {total['errors']} errori")
+        return health
+
+    def close(self):
+        """Closes every engine (plans, devices, session files), then the shared event loop."""
+        for rig in self.rigs.values():
+            try:
+                rig.engine.close()
+            except Exception as e:
+                logging.getLogger().error(f"Errore chiusura banco {rig.name}: {e}")
+        if self.owns_worker:
+            self.worker.stop()
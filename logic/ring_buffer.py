@@ -0,0 +1,84 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import threading
+
+
+class TimestampedRingBuffer:
+    """Fixed-capacity ring of samples with monotonic-ns timestamps, preallocated per field.
+
+    One producer thread appends; any thread can read the latest sample or a time window.
+    Timestamps must be non-decreasing, which lets windows be found by bisection.
+    """
+
+    def __init__(self, fields, capacity=65536):
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.times = array('q', bytes(8 * capacity))
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in self.fields}
+        self.count = 0  # campioni scritti in totale
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, t_ns, values):
+        """values: sequence in the order of `fields`; None is stored as NaN."""
+        with self.lock:
+            i = self.count % self.capacity
+            self.times[i] = t_ns
+            for field, value in zip(self.fields, values):
+                self.columns[field][i] = float('nan') if value is None else value
+            self.count += 1
+
+    def latest(self):
+        """Returns (t_ns, {field: value}) of the newest sample, or None if empty."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            i = (self.count - 1) % self.capacity
+            return self.times[i], {field: column[i] for field, column in self.columns.items()}
+
+    def latest_values(self):
+        """Returns (t_ns, [values in the order of `fields`]) of the newest sample, or None if empty."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            i = (self.count - 1) % self.capacity
+            return self.times[i], [self.columns[field][i] for field in self.fields]
+
+    def _ordered_indices(self):
+        # (start, stop) ranges of physical indices in chronological order
+        n = len(self)
+        start = (self.count - n) % self.capacity
+        if start + n <= self.capacity:
+            return [(start, start + n)]
+        return [(start, self.capacity), (0, (start + n) % self.capacity)]
+
+    def window(self, t_start_ns=None, t_end_ns=None, fields=None):
+        """Returns (times, {field: values}) of the samples with t_start_ns <= t <= t_end_ns, as arrays."""
+        fields = self.fields if fields is None else fields
+        with self.lock:
+            times = array('q')
+            columns = {field: array('d') for field in fields}
+            for start, stop in self._ordered_indices():
+                lo = start if t_start_ns is None else bisect_left(self.times, t_start_ns, start, stop)
+                hi = stop if t_end_ns is None else bisect_right(self.times, t_end_ns, lo, stop)
+                if lo < hi:
+                    times.extend(self.times[lo:hi])
+                    for field in fields:
+                        columns[field].extend(self.columns[field][lo:hi])
+            return times, columns
+
+    def last(self, n, fields=None):
+        """Returns (times, {field: values}) of the newest n samples."""
+        fields = self.fields if fields is None else fields
+        with self.lock:
+            n = min(n, len(self))
+            times = array('q')
+            columns = {field: array('d') for field in fields}
+            for k in range(self.count - n, self.count):
+                i = k % self.capacity
+                times.append(self.times[i])
+                for field in fields:
+                    columns[field].append(self.columns[field][i])
+            return times, columns
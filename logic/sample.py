@@ -0,0 +1,88 @@
+"""Fixed-schema sample records of the recording path.
+
+An FTMS notification becomes one Sample: its monotonic-ns timestamp and a list of values in the
+column order of the session (DATA_FIELDS plus any extra fields). Fusion fills the Lorenz slots
+in place and the sample goes to the session writer as is; wall-clock time, the ms column and
+the text timestamp are computed by the sinks on the writer thread (SessionTimebase).
+"""
+from logic.lorenz_acquisition import LORENZ_FIELDS
+
+BENCH_FIELD = "bench_speed"
+
+
+class Sample:
+    __slots__ = ("t_ns", "values", "schema")
+
+    def __init__(self, t_ns, values, schema):
+        self.t_ns = t_ns
+        self.values = values  # lista nell'ordine di schema.fields
+        self.schema = schema
+
+    def get(self, field, default=None):
+        """Dict-like read by field name (record listeners, live chart)."""
+        i = self.schema.index.get(field)
+        return default if i is None else self.values[i]
+
+    def __getitem__(self, field):
+        return self.values[self.schema.index[field]]
+
+    def copy(self, t_ns=None):
+        return Sample(self.t_ns if t_ns is None else t_ns, self.values.copy(), self.schema)
+
+    def as_dict(self):
+        return dict(zip(self.schema.fields, self.values))
+
+
+class SampleSchema:
+    """Slot layout of the samples of a session, with the slots each source fills.
+
+    Lorenz fields come from the Lorenz sensor (None when it is off), bench_speed from the bench
+    telemetry, every other field of `fields` from the FTMS notification, unless it is one of
+    `derived` (e.g. fusion interval statistics).
+    """
+
+    def __init__(self, fields, derived=()):
+        self.fields = tuple(fields)
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.width = len(self.fields)
+        self.lorenz_fields = [field for field in LORENZ_FIELDS if field in self.index]
+        self.lorenz_slots = [self.index[field] for field in self.lorenz_fields]
+        self.lorenz_slot_fields = list(zip(self.lorenz_slots, self.lorenz_fields))
+        # (slot nel campione, indice in LORENZ_FIELDS), per le righe del ring buffer Lorenz
+        self.lorenz_columns = [(self.index[field], LORENZ_FIELDS.index(field)) for field in self.lorenz_fields]
+        self.bench_slot = self.index.get(BENCH_FIELD)
+        excluded = set(LORENZ_FIELDS) | {BENCH_FIELD} | set(derived)
+        self.ftms_slots = [(i, field) for i, field in enumerate(self.fields) if field not in excluded]
+        self.empty = [None] * self.width
+
+    def from_ftms(self, t_ns, bike_data, bench_speed=None):
+        """Sample of an FTMS notification; Lorenz and derived slots are left None."""
+        values = self.empty.copy()
+        get = bike_data.get
+        for i, field in self.ftms_slots:
+            values[i] = get(field)
+        if self.bench_slot is not None:
+            values[self.bench_slot] = bench_speed
+        return Sample(t_ns, values, self)
+
+    def from_dict(self, t_ns, data):
+        """Sample with every field read from `data` (rows merged by the caller)."""
+        get = data.get
+        return Sample(t_ns, [get(field) for field in self.fields], self)
+
+
+class SessionTimebase:
+    """Maps sample times (monotonic ns) to the session wall clock and its ms column.
+
+    The sinks read the origin at write time, so it can be moved until the first rows are
+    written (e.g. a replay anchoring the original session times).
+    """
+
+    __slots__ = ("start_time", "start_monotonic_ns")
+
+    def __init__(self, start_time=None, start_monotonic_ns=None):
+        self.start_time = start_time
+        self.start_monotonic_ns = start_monotonic_ns
+
+    def wall(self, t_ns):
+        return self.start_time + (t_ns - self.start_monotonic_ns) / 1e9
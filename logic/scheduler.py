@@ -0,0 +1,158 @@
+import csv
+import logging
+import threading
+import time
+from logic.metrics import MetricsRegistry
+
+# Below this margin the scheduler stops sleeping on the event and yields until the deadline,
+# since Event.wait() can oversleep by a full timer tick (about 15 ms on Windows).
+SPIN_MARGIN = 0.002
+
+
+class StepTiming:
+    __slots__ = ("index", "planned", "actual", "dispatched", "paused")
+
+    def __init__(self, index, planned, actual, dispatched, paused=0.0):
+        self.index = index
+        self.planned = planned  # s dall'avvio del piano
+        self.actual = actual  # s dall'avvio, istante di emissione del comando
+        self.dispatched = dispatched  # s dall'avvio, fine dell'invio del comando
+        self.paused = paused  # s di pausa del piano prima del passo (esclusi da planned/actual/dispatched)
+
+    @property
+    def lateness(self):
+        return self.actual - self.planned
+
+
+class PlanScheduler:
+    """Runs plan steps on a dedicated thread at absolute time.monotonic() deadlines.
+
+    Step i is issued at start + sum(wait_time of steps < i), so neither Tk latency nor the time
+    spent dispatching a step delays the following ones. `steps` is a sequence of
+    (command_type, value, wait_time, speed_banco) with wait_time in (fractional) seconds;
+    on_step(index, step) runs on the scheduler thread, on_finished(completed) once at the end.
+    pause() freezes the plan clock (the running step's remaining time is kept) until resume();
+    times in `timings` are on the plan clock, with the pause time before each step in `paused`.
+    """
+
+    def __init__(self, steps, on_step, on_finished=None, metrics=None):
+        self.steps = steps
+        self.on_step = on_step
+        self.on_finished = on_finished
+        self.timings = []
+        self.start_monotonic = None
+        self.start_wall = None
+        self.current_index = -1
+        self.paused_total = 0.0
+        self.paused_at = None
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        metrics = metrics or MetricsRegistry()
+        self.lateness_seconds = metrics.histogram("plan_step_lateness_seconds", "Ritardo dei passi sull'istante pianificato")
+        self.dispatch_seconds = metrics.histogram("plan_step_dispatch_seconds", "Durata dell'invio di un passo")
+        # Same gauge for every plan of the engine: it follows the latest scheduler
+        metrics.gauge("plan_step", "Passo corrente del piano").fn = lambda: self.current_index
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="PlanScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = time.monotonic()
+            self._resume_event.clear()
+            logging.getLogger().info(f"Piano in pausa al passo {self.current_index}")
+
+    def resume(self):
+        if self.paused_at is not None:
+            paused = time.monotonic() - self.paused_at
+            self.paused_total += paused
+            self.paused_at = None
+            self._resume_event.set()
+            logging.getLogger().info(f"Piano ripreso dopo {paused:.1f}s di pausa")
+
+    def is_paused(self):
+        return self.paused_at is not None
+
+    def plan_time(self):
+        """Seconds on the plan clock (time since start minus pauses)."""
+        now = self.paused_at if self.paused_at is not None else time.monotonic()
+        return now - self.start_monotonic - self.paused_total
+
+    def _wait_until(self, planned):
+        """Waits until plan time `planned`; False if stopped."""
+        while True:
+            while not self._resume_event.is_set():
+                if self._stop_event.wait(0.05):
+                    return False
+            remaining = self.start_monotonic + self.paused_total + planned - time.monotonic()
+            if remaining <= 0:
+                return True
+            if remaining > SPIN_MARGIN:
+                if self._stop_event.wait(remaining - SPIN_MARGIN):
+                    return False
+            else:
+                time.sleep(0)
+                if self._stop_event.is_set():
+                    return False
+
+    def _run(self):
+        self.start_monotonic = time.monotonic()
+        self.start_wall = time.time()
+        planned = 0.0
+        completed = False
+        try:
+            for index, step in enumerate(self.steps):
+                if not self._wait_until(planned):
+                    break
+                actual = self.plan_time()
+                self.current_index = index
+                try:
+                    self.on_step(index, step)
+                except Exception as e:
+                    logging.getLogger().error(f"Errore esecuzione passo {index} del piano: {e}")
+                dispatched = self.plan_time()
+                self.timings.append(StepTiming(index, planned, actual, dispatched, self.paused_total))
+                self.lateness_seconds.observe(max(0.0, actual - planned))
+                self.dispatch_seconds.observe(dispatched - actual)
+                planned += step[2]
+            else:
+                completed = self._wait_until(planned)
+        finally:
+            if self.on_finished:
+                self.on_finished(completed)
+
+    def jitter_stats(self):
+        if not self.timings:
+            return {"steps": 0}
+        lateness = sorted(timing.lateness for timing in self.timings)
+        dispatch = [timing.dispatched - timing.actual for timing in self.timings]
+        return {
+            "steps": len(lateness),
+            "lateness_mean_ms": 1000 * sum(lateness) / len(lateness),
+            "lateness_p95_ms": 1000 * lateness[min(len(lateness) - 1, int(0.95 * len(lateness)))],
+            "lateness_max_ms": 1000 * lateness[-1],
+            "dispatch_max_ms": 1000 * max(dispatch),
+        }
+
+    def save_timings(self, file_path, session_offset=0.0):
+        """session_offset: plan start in seconds since the recording session started (session_s column)."""
+        with open(file_path, mode='w', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(["step", "command", "value", "planned_s", "actual_s", "dispatched_s", "lateness_ms",
+                             "session_s", "wait_s"])
+            for timing in self.timings:
+                command_type, value, wait_time = self.steps[timing.index][:3]
+                writer.writerow([timing.index, command_type, value, f"{timing.planned:.4f}", f"{timing.actual:.4f}",
+                                 f"{timing.dispatched:.4f}", f"{1000 * timing.lateness:.3f}",
+                                 f"{session_offset + timing.paused + timing.actual:.4f}", f"{wait_time:.4f}"])
@@ -0,0 +1,209 @@
+import csv
+from datetime import datetime
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from logic.metrics import MetricsRegistry
+
+FSYNC_POLICIES = ("never", "flush", "periodic", "close")
+
+_STOP = object()
+
+
+class TimestampFormatter:
+    """datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3], with the date and minute cached."""
+
+    def __init__(self):
+        self.minute = None
+        self.prefix = None
+
+    def __call__(self, wall_time):
+        fraction, whole = math.modf(wall_time)
+        microseconds = round(fraction * 1e6)  # Same rounding as datetime.fromtimestamp
+        if microseconds >= 1000000:
+            whole += 1
+            microseconds -= 1000000
+        elif microseconds < 0:
+            whole -= 1
+            microseconds += 1000000
+        whole = int(whole)
+        minute, second = divmod(whole, 60)
+        if minute != self.minute:
+            start = datetime.fromtimestamp(minute * 60)
+            # Offsets that are not whole minutes (historical zones) fall back to full formatting
+            self.prefix = start.strftime("%Y-%m-%d %H:%M:") if start.second == 0 else None
+            self.minute = minute
+        if self.prefix is None:
+            return datetime.fromtimestamp(wall_time).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+        return f"{self.prefix}{second:02d}.{microseconds // 1000:03d}"
+
+
+def _csv_value(value):
+    # Whole floats as integers (41.0 -> 41): the text logic.columnar_log.export_csv gives for the same value
+    return int(value) if value.__class__ is float and value.is_integer() else value
+
+
+class CsvSessionSink:
+    """Keeps the session CSV open and writes samples (logic.sample) in the layout of DataProcessor.initialize_csv.
+
+    Wall time, ms column and timestamp text are derived here, on the writer thread, from `timebase`.
+    """
+
+    def __init__(self, filename, timebase):
+        self.filename = filename
+        self.timebase = timebase
+        self.file = open(filename, mode='a', newline='')
+        self.writer = csv.writer(self.file, delimiter=';')
+        self.format_timestamp = TimestampFormatter()
+
+    def write_rows(self, items):
+        start_time, start_ns = self.timebase.start_time, self.timebase.start_monotonic_ns
+        format_timestamp = self.format_timestamp
+        rows = []
+        for sample in items:
+            wall_time = start_time + (sample.t_ns - start_ns) / 1e9
+            rows.append([format_timestamp(wall_time), int((wall_time - start_time) * 10),
+                         *map(_csv_value, sample.values)])
+        self.writer.writerows(rows)
+
+    def flush(self):
+        self.file.flush()
+
+    def fsync(self):
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class SessionWriter:
+    """Bounded queue plus a dedicated writer thread in front of one or more session sinks.
+
+    submit() never blocks: when the queue is full, or after close(), the row is dropped and counted.
+    Sinks are flushed every `batch_size` rows or every `flush_interval` seconds,
+    whichever comes first; `fsync_policy` decides when data is forced to disk:
+    "never", "flush" (at every flush), "periodic" (every `fsync_interval` s) or "close".
+    """
+
+    def __init__(self, sinks, max_queue=20000, batch_size=500, flush_interval=1.0,
+                 fsync_policy="close", fsync_interval=10.0, metrics=None):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Politica fsync non valida: {fsync_policy}")
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_backlog = 0
+        self.closed = False
+        self.submit_lock = threading.Lock()  # Producers (BLE, fusion, replay threads) and close()
+        metrics = metrics or MetricsRegistry()
+        self.write_seconds = metrics.histogram("session_write_seconds", "Durata della scrittura di un blocco di righe")
+        self.flush_seconds = metrics.histogram("session_flush_seconds", "Durata di flush/fsync della sessione")
+        metrics.counter("session_rows_written_total", "Righe di sessione scritte", fn=lambda: self.written)
+        metrics.counter("session_rows_dropped_total", "Righe scartate a coda piena", fn=lambda: self.dropped)
+        metrics.gauge("session_write_backlog", "Righe in coda di scrittura", fn=self.backlog)
+        self.thread = threading.Thread(target=self._run, name="SessionWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        with self.submit_lock:
+            if self.closed:
+                self.dropped += 1
+                return False
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self.submitted += 1
+            return True
+
+    def backlog(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "backlog": self.backlog(),
+            "max_backlog": self.max_backlog,
+            "errors": self.errors,
+        }
+
+    def close(self, timeout=10.0):
+        """Stops accepting rows, drains the queue and closes the sinks."""
+        with self.submit_lock:
+            if self.closed:
+                return
+            self.closed = True
+        # Every accepted row was queued before this point, so the sentinel comes after all of them
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logging.getLogger().warning(f"Scrittura sessione non terminata entro {timeout}s, "
+                                        f"righe in coda: {self.backlog()}")
+
+    def _run(self):
+        last_flush = last_fsync = time.monotonic()
+        unflushed = 0
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                while len(batch) < self.batch_size and not stopping:
+                    item = self.queue.get_nowait()
+                    if item is _STOP:
+                        stopping = True
+                    else:
+                        batch.append(item)
+            except queue.Empty:
+                pass
+
+            backlog = self.queue.qsize() + len(batch)
+            if backlog > self.max_backlog:
+                self.max_backlog = backlog
+            if batch:
+                t0 = time.perf_counter()
+                self._call_sinks("write_rows", batch)
+                self.write_seconds.observe_since(t0)
+                self.written += len(batch)
+                unflushed += len(batch)
+
+            now = time.monotonic()
+            if unflushed and (stopping or unflushed >= self.batch_size or now - last_flush >= self.flush_interval):
+                t0 = time.perf_counter()
+                self._call_sinks("flush")
+                unflushed = 0
+                last_flush = now
+                if self.fsync_policy == "flush" or (
+                        self.fsync_policy == "periodic" and now - last_fsync >= self.fsync_interval):
+                    self._call_sinks("fsync")
+                    last_fsync = now
+                self.flush_seconds.observe_since(t0)
+
+        if self.fsync_policy != "never":
+            self._call_sinks("fsync")
+        self._call_sinks("close")
+
+    def _call_sinks(self, method, *args):
+        for sink in self.sinks:
+            try:
+                getattr(sink, method)(*args)
+            except Exception as e:
+                self.errors += 1
+                logging.getLogger().error(f"Errore scrittura sessione ({method}) su {sink.filename}: {e}")
@@ -0,0 +1,410 @@
+"""Simulated devices with the interfaces MainWindow/BenchEngine use, for running without hardware.
+
+SimulatedBike is the shared physical model: the bench motor drives the roller (or a virtual
+rider pedals when the bench is idle), the FTMS brake absorbs power according to its mode and
+the Lorenz shaft sensor measures the resulting torque. SimulatedBLEManager, SimulatedLorenzReader
+and SimulatedModbusBanco are drop-in replacements for the shared_lib drivers;
+ModbusTcpSimServer exposes the bench on a local Modbus TCP port.
+
+    python headless.py --simulate --plan piano.csv
+    python main.py --simulate
+"""
+import asyncio
+import math
+import random
+import socketserver
+import struct
+import threading
+import time
+
+SIMULATED_ADDRESS = "SIM:00:00:00:00:01"
+SIMULATED_NAME = "SIM FTMS Trainer"
+SIMULATED_LORENZ_PORT = "COM99"
+
+
+class SimulatedBike:
+    """Physical model shared by the simulated trainer, Lorenz sensor and bench."""
+
+    def __init__(self, rider_speed_kmh=30.0, ftms_power_bias=0.03, power_noise=2.0, torque_noise=0.05,
+                 roller_diameter=0.1, brake_tau=0.8, bench_tau=1.5, mass=80.0, cda=0.35, crr=0.004):
+        self.rider_speed_kmh = rider_speed_kmh
+        self.ftms_power_bias = ftms_power_bias  # errore sistematico della potenza FTMS rispetto all'albero
+        self.power_noise = power_noise
+        self.torque_noise = torque_noise
+        self.roller_circumference = math.pi * roller_diameter
+        self.brake_tau = brake_tau
+        self.bench_tau = bench_tau
+        self.mass = mass
+        self.cda = cda
+        self.crr = crr
+        self.brake_mode = ("livelli", 0)
+        self.bench_target_kmh = None  # None: il rullo è trascinato dal ciclista virtuale
+        self.speed_kmh = 0.0
+        self.power = 0.0
+        self.distance = 0.0
+        self.offset = 0.0
+        self.start = time.monotonic()
+        self.last_update = self.start
+        self.lock = threading.Lock()
+
+    def set_brake(self, mode, value):
+        with self.lock:
+            self._advance()
+            self.brake_mode = (mode, value)
+
+    def set_bench_speed(self, speed_kmh):
+        with self.lock:
+            self._advance()
+            self.bench_target_kmh = speed_kmh
+
+    def _target_power(self, v):
+        if v < 0.1:
+            return 0.0
+        mode, value = self.brake_mode
+        if mode == "potenza":  # ERG: the brake holds the power regardless of speed
+            return float(value)
+        if mode == "livelli":
+            return 2.5 * v + 0.104 * value * v ** 1.5
+        # simulazione: pendenza [%] con resistenza al rotolamento e aerodinamica
+        force = self.mass * 9.81 * (value / 100 + self.crr)
+        return max(0.0, force * v + 0.5 * 1.2 * self.cda * v ** 3)
+
+    def _advance(self):
+        now = time.monotonic()
+        dt = now - self.last_update
+        if dt <= 0:
+            return
+        self.last_update = now
+        target_speed = self.rider_speed_kmh if self.bench_target_kmh is None else self.bench_target_kmh
+        self.speed_kmh += (target_speed - self.speed_kmh) * (1 - math.exp(-dt / self.bench_tau))
+        v = self.speed_kmh / 3.6
+        self.power += (self._target_power(v) - self.power) * (1 - math.exp(-dt / self.brake_tau))
+        self.distance += v * dt
+
+    def state(self):
+        with self.lock:
+            self._advance()
+            return self.speed_kmh, self.power, self.distance
+
+    def ftms_sample(self):
+        speed, power, distance = self.state()
+        mode, value = self.brake_mode
+        return {
+            "speed": round(speed, 2),
+            "cadence": round(speed * 3, 1),
+            "power": max(0, int(round(power * (1 + self.ftms_power_bias) + random.gauss(0, self.power_noise)))),
+            "total_distance": int(distance),
+            "resistance": int(value) if mode == "livelli" else None,
+            "elapsed_time": int(time.monotonic() - self.start),
+        }
+
+    def lorenz_sample(self):
+        speed, power, _ = self.state()
+        rpm = speed / 3.6 / self.roller_circumference * 60
+        omega = rpm * 2 * math.pi / 60
+        torque = (power / omega if omega > 0.1 else 0.0) + random.gauss(0, self.torque_noise) - self.offset
+        return {
+            "speed_avg": rpm,
+            "torque_lorenz": torque,
+            "power_lorenz": torque * omega,
+            "offset_lorenz": self.offset,
+        }
+
+
+def _jittered(latency, jitter):
+    return max(0.0, latency + random.uniform(-jitter, jitter))
+
+
+class SimulatedAsyncioWorker:
+    """Same interface as shared_lib.bluetooth_manager.AsyncioWorker: an event loop on a daemon thread."""
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="AsyncioWorker", daemon=True)
+        self.thread.start()
+
+    def run_coroutine(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        if self.loop and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(2.0)
+
+
+class SimulatedBLEManager:
+    """FTMS trainer with configurable notification rate, command latency and jitter."""
+
+    def __init__(self, worker, bike, rate_hz=4.0, latency=0.02, jitter=0.005, scan_time=0.5,
+                 address=SIMULATED_ADDRESS, name=SIMULATED_NAME):
+        self.worker = worker
+        self.bike = bike
+        self.rate_hz = rate_hz
+        self.latency = latency
+        self.jitter = jitter
+        self.scan_time = scan_time
+        self.address = address
+        self.name = name
+        self.connected = False
+        self.notify_task = None
+        self.notifications = 0
+        self.unreachable_until = 0.0
+
+    def drop_link(self, duration=5.0, silent=False):
+        """Simulates a link loss: the trainer is unreachable for `duration` s.
+
+        silent=True keeps the connection status up and only stops the notifications (a stall).
+        """
+        self.unreachable_until = time.monotonic() + duration
+        if not silent:
+            self.connected = False
+        if self.notify_task:
+            self.worker.loop.call_soon_threadsafe(self.notify_task.cancel)
+
+    async def scan_devices(self, timeout=5):
+        await asyncio.sleep(min(timeout, self.scan_time))
+        if time.monotonic() < self.unreachable_until:
+            return {}
+        return {self.address: (self.name, int(-45 + random.gauss(0, 3)))}
+
+    async def connect_to_device(self, address):
+        await asyncio.sleep(_jittered(self.latency * 10, self.jitter))
+        if address != self.address or time.monotonic() < self.unreachable_until:
+            raise ConnectionError(f"Dispositivo simulato {address} non trovato")
+        self.connected = True
+
+    async def disconnect_device(self):
+        await self.disable_indoor_bike_data_notifications()
+        self.connected = False
+        return True
+
+    def get_connection_status(self):
+        return self.connected
+
+    async def enable_indoor_bike_data_notifications(self, callback):
+        if not self.connected:
+            raise ConnectionError("Rullo simulato non connesso")
+        await self.disable_indoor_bike_data_notifications()
+        self.notify_task = asyncio.get_running_loop().create_task(self._notify(callback))
+
+    async def disable_indoor_bike_data_notifications(self):
+        if self.notify_task:
+            self.notify_task.cancel()
+            self.notify_task = None
+
+    async def _notify(self, callback):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while self.connected:
+            deadline += 1.0 / self.rate_hz
+            await asyncio.sleep(max(0.0, deadline - loop.time() + random.uniform(0, self.jitter)))
+            self.notifications += 1
+            callback(self.bike.ftms_sample())
+
+    async def _command(self, mode, value):
+        if not self.connected:
+            raise ConnectionError("Rullo simulato non connesso")
+        await asyncio.sleep(_jittered(self.latency, self.jitter))
+        self.bike.set_brake(mode, value)
+
+    async def set_brake_power(self, power):
+        await self._command("potenza", power)
+
+    async def set_brake_percentage(self, level):
+        await self._command("livelli", level)
+
+    async def set_brake_simulation(self, grade=0):
+        await self._command("simulazione", grade)
+
+
+class SimulatedLorenzReader:
+    """Lorenz shaft sensor; get_data() blocks for the configured serial read latency."""
+
+    def __init__(self, bike, read_latency=0.002, jitter=0.001):
+        self.bike = bike
+        self.read_latency = read_latency
+        self.jitter = jitter
+        self.connected = False
+        self.unreachable_until = 0.0
+
+    def drop_link(self, duration=5.0):
+        """Simulates a USB/serial loss: reads and reconnections fail for `duration` s."""
+        self.unreachable_until = time.monotonic() + duration
+
+    def open_connection(self, port):
+        time.sleep(_jittered(self.read_latency * 50, self.jitter))
+        self.connected = time.monotonic() >= self.unreachable_until
+        return self.connected
+
+    def close_connection(self):
+        self.connected = False
+        return True
+
+    def is_connected(self):
+        return self.connected
+
+    def get_data(self):
+        if not self.connected:
+            raise ConnectionError("Lorenz simulato non connesso")
+        time.sleep(_jittered(self.read_latency, self.jitter))
+        if time.monotonic() < self.unreachable_until:
+            raise OSError("Porta seriale Lorenz non disponibile")
+        return self.bike.lorenz_sample()
+
+    def read_offset(self):
+        time.sleep(_jittered(self.read_latency * 10, self.jitter))
+        self.bike.offset = round(random.gauss(0, 0.02), 3)
+
+
+class SimulatedModbusBanco:
+    """Bench motor with the ModbusBancoCollaudo interface; speeds are km/h * 10 like the real driver."""
+
+    def __init__(self, bike, latency=0.005, jitter=0.002, connect_time=0.05, reachable=True):
+        self.bike = bike
+        self.latency = latency
+        self.jitter = jitter
+        self.connect_time = connect_time
+        self.reachable = reachable
+        self.connected = False
+
+    def connetti(self, ip, port):
+        time.sleep(self.connect_time)
+        self.connected = self.reachable
+
+    def disconnetti(self):
+        self.connected = False
+
+    def is_connesso(self):
+        return self.connected
+
+    def set_motor_speed(self, speed):
+        if not self.connected:
+            raise ConnectionError("Banco simulato non connesso")
+        time.sleep(_jittered(self.latency, self.jitter))
+        self.bike.set_bench_speed(speed / 10)
+
+    def get_motor_speed(self):
+        if not self.connected:
+            raise ConnectionError("Banco simulato non connesso")
+        time.sleep(_jittered(self.latency, self.jitter))
+        return int(round(self.bike.state()[0] * 10))
+
+
+class _ModbusRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            header = self._recv_exact(7)
+            if header is None:
+                return
+            transaction_id, protocol_id, length, unit_id = struct.unpack(">HHHB", header)
+            pdu = self._recv_exact(length - 1)
+            if pdu is None:
+                return
+            response = server.sim.handle_pdu(pdu)
+            self.request.sendall(struct.pack(">HHHB", transaction_id, protocol_id, len(response) + 1, unit_id)
+                                 + response)
+
+    def _recv_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+class ModbusTcpSimServer:
+    """Local Modbus TCP stand-in for the bench (FC 3/4 read, FC 6/16 write holding registers).
+
+    Writing `setpoint_register` sets the bench speed (km/h * 10); `speed_register` returns the
+    actual roller speed. Register addresses are configurable to match the bench PLC map.
+    """
+
+    def __init__(self, bike, host="127.0.0.1", port=5020, setpoint_register=0, speed_register=1, registers=64):
+        self.bike = bike
+        self.setpoint_register = setpoint_register
+        self.speed_register = speed_register
+        self.registers = [0] * registers
+        self.lock = threading.Lock()
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), _ModbusRequestHandler)
+        self.server.daemon_threads = True
+        self.server.sim = self
+        self.address = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="ModbusTcpSimServer", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle_pdu(self, pdu):
+        function = pdu[0]
+        try:
+            if function in (3, 4):
+                address, count = struct.unpack(">HH", pdu[1:5])
+                with self.lock:
+                    self.registers[self.speed_register] = int(round(self.bike.state()[0] * 10))
+                    values = self.registers[address:address + count]
+                if len(values) != count:
+                    return bytes([function | 0x80, 2])
+                return struct.pack(f">BB{count}H", function, 2 * count, *values)
+            if function == 6:
+                address, value = struct.unpack(">HH", pdu[1:5])
+                self._write(address, [value])
+                return pdu[:5]
+            if function == 16:
+                address, count = struct.unpack(">HH", pdu[1:5])
+                values = struct.unpack(f">{count}H", pdu[6:6 + 2 * count])
+                self._write(address, values)
+                return pdu[:5]
+        except (struct.error, IndexError):
+            return bytes([function | 0x80, 3])
+        return bytes([function | 0x80, 1])
+
+    def _write(self, address, values):
+        with self.lock:
+            if address + len(values) > len(self.registers):
+                raise IndexError(address)
+            self.registers[address:address + len(values)] = values
+            if address <= self.setpoint_register < address + len(values):
+                self.bike.set_bench_speed(self.registers[self.setpoint_register] / 10)
+
+
+def find_simulated_lorenz_port(description):
+    return SIMULATED_LORENZ_PORT
+
+
+def create_simulated_engine(ftms_rate_hz=4.0, lorenz_latency=0.002, ble_latency=0.02, jitter=0.005,
+                            bike=None, worker=None, address=SIMULATED_ADDRESS, **engine_kwargs):
+    """BenchEngine wired to simulated devices sharing one SimulatedBike (available as engine.simulated_bike).
+
+    With a worker the engine shares its event loop (several rigs, see logic.rigs) and does not stop it on close.
+    """
+    from logic.engine import BenchEngine
+    bike = bike if bike is not None else SimulatedBike()
+    owns_worker = worker is None
+    if owns_worker:
+        worker = SimulatedAsyncioWorker()
+        worker.start()
+    engine_kwargs.setdefault("known_trainers_path", None)  # Do not mix simulated trainers with the real ones
+    engine = BenchEngine(worker=worker,
+                         ble_manager=SimulatedBLEManager(worker, bike, rate_hz=ftms_rate_hz, latency=ble_latency,
+                                                         jitter=jitter, address=address),
+                         lorenz_reader=SimulatedLorenzReader(bike, read_latency=lorenz_latency),
+                         modbus=SimulatedModbusBanco(bike),
+                         find_lorenz_port=find_simulated_lorenz_port,
+                         **engine_kwargs)
+    engine.owns_worker = owns_worker
+    engine.simulated_bike = bike
+    return engine
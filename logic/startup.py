@@ -0,0 +1,95 @@
+"""Deferred device construction and startup timing.
+
+Driver imports (bleak/winrt behind BLEManager, the Lorenz DLL, pymodbus) dominate the cold start
+of the packaged app, so BenchEngine wraps the devices it builds itself in LazyDevice: the driver
+is imported and the object created at the first attribute access. STARTUP records how long each
+import and initialization phase took; `python main.py --profile-startup` reports it.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+
+class StartupProfiler:
+    """Timeline of named phases (start and duration since the profiler was created), nested per thread."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases = []  # (inizio s, durata s, profondità, thread, nome)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def phase(self, name):
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            end = time.perf_counter()
+            with self.lock:
+                self.phases.append((start - self.t0, end - start, depth, threading.current_thread().name, name))
+
+    def mark(self, name):
+        """Records an instant (e.g. the window being shown) as a zero-length phase."""
+        with self.lock:
+            self.phases.append((time.perf_counter() - self.t0, 0.0, 0, threading.current_thread().name, name))
+
+    def report(self):
+        with self.lock:
+            phases = sorted(self.phases)
+        lines = [f"{'inizio [ms]':>11} {'durata [ms]':>11}  {'thread':<16} fase"]
+        for start, duration, depth, thread, name in phases:
+            lines.append(f"{1000 * start:11.1f} {1000 * duration:11.1f}  {thread:<16} {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+
+STARTUP = StartupProfiler()
+
+
+class LazyDevice:
+    """Proxy that builds its device with `factory()` at the first attribute access (thread-safe).
+
+    Attribute reads and writes are forwarded to the device; created() tells whether it exists
+    yet, so status checks and shutdown need not build a device that was never used.
+    """
+
+    __slots__ = ("_factory", "_name", "_instance", "_lock")
+
+    def __init__(self, factory, name):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    with STARTUP.phase(f"init {self._name}"):
+                        instance = self._factory()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+    def __repr__(self):
+        return f"<LazyDevice {self._name}: {'creato' if self._instance is not None else 'non creato'}>"
+
+
+def created(device):
+    """False only for a LazyDevice whose device was not built yet."""
+    return not isinstance(device, LazyDevice) or device._instance is not None
+
+
+def resolve(device):
+    """The device behind a LazyDevice (built now if needed), or the object itself."""
+    return device._get() if isinstance(device, LazyDevice) else device
@@ -0,0 +1,246 @@
+import threading
+import time
+from logic.dispatcher import PRIORITY_CONTROL
+
+STALL_INTERVALS = 5  # campioni attesi mancanti prima di dichiarare lo stallo
+MIN_STALL_S = 1.0
+INTERVAL_ALPHA = 0.1  # peso dell'ultimo intervallo nella stima dell'intervallo atteso
+BACKOFF_INITIAL_S = 1.0
+BACKOFF_MAX_S = 30.0
+
+
+class LinkState:
+    __slots__ = ("name", "state", "count", "last_change", "interval", "stalls", "recoveries", "attempts",
+                 "recovery_times", "downtimes", "thread")
+
+    def __init__(self, name):
+        self.name = name
+        self.state = "inattivo"  # inattivo, ok, riconnessione
+        self.count = None
+        self.last_change = None  # monotonic ns dell'ultimo campione visto
+        self.interval = None  # s, intervallo atteso tra i campioni
+        self.stalls = 0
+        self.recoveries = 0
+        self.attempts = 0
+        self.recovery_times = []
+        self.downtimes = []
+        self.thread = None
+
+    def reset(self):
+        self.count = None
+        self.last_change = None
+
+    def stats(self):
+        times = self.recovery_times
+        return {"state": self.state, "stalls": self.stalls, "recoveries": self.recoveries, "attempts": self.attempts,
+                "interval_ms": None if self.interval is None else 1000 * self.interval,
+                "last_recovery_s": times[-1] if times else None, "max_recovery_s": max(times) if times else None,
+                "max_downtime_s": max(self.downtimes) if self.downtimes else None}
+
+
+class ConnectionSupervisor:
+    """Watches the FTMS and Lorenz links of a BenchEngine and brings them back after a drop or a stall.
+
+    A link that should be delivering data (FTMS: connected by the user with notifications
+    enabled; Lorenz: acquisition started by connect_lorenz) is stalled when no sample arrived for
+    `stall_intervals` expected intervals (estimated from the observed rate, at least `min_stall` s)
+    or the FTMS connection is reported down. Recovery runs on its own thread per link: reconnect
+    with exponential backoff, re-enable the notifications, wait for the first sample and re-apply
+    the current brake setpoint. "gap" and "resume" markers go to the session events file
+    (DataProcessor.mark_event) at the last sample before and the first one after the hole; with
+    `pause_plan` the running plan is paused for an FTMS recovery. Time to recover (stall detected
+    -> first new sample) is logged, kept in stats() and observed in `link_recovery_seconds`.
+    """
+
+    def __init__(self, engine, stall_intervals=STALL_INTERVALS, min_stall=MIN_STALL_S, check_interval=0.25,
+                 max_backoff=BACKOFF_MAX_S, pause_plan=False, connect_timeout=20.0):
+        self.engine = engine
+        self.stall_intervals = stall_intervals
+        self.min_stall = min_stall
+        self.check_interval = check_interval
+        self.max_backoff = max_backoff
+        self.pause_plan = pause_plan
+        self.connect_timeout = connect_timeout
+        self.links = {"ftms": LinkState("ftms"), "lorenz": LinkState("lorenz")}
+        metrics = engine.metrics
+        self.recovery_seconds = {name: metrics.histogram("link_recovery_seconds", "Tempo di ripristino di un collegamento",
+                                                         {"link": name}) for name in self.links}
+        for name, link in self.links.items():
+            metrics.counter("link_stalls_total", "Stalli o cadute di un collegamento", {"link": name},
+                            fn=lambda link=link: link.stalls)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ConnectionSupervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        threads = [self._thread] + [link.thread for link in self.links.values()]
+        for thread in threads:
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def state(self, link):
+        return self.links[link].state
+
+    def stats(self):
+        return {name: link.stats() for name, link in self.links.items()}
+
+    # --- Rilevamento ---
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self._check(self.links["ftms"], self._ftms_expected(), self.engine.ftms_notifications.value,
+                            lambda: not self.engine.is_ble_connected())
+                acquisition = self.engine.lorenz_acquisition
+                self._check(self.links["lorenz"], self._lorenz_expected(), acquisition.samples, lambda: False)
+            except Exception as e:
+                self.engine.log.error(f"Errore nel supervisore dei collegamenti: {e}")
+
+    def _ftms_expected(self):
+        return self.engine.ble_address is not None and self.engine.data_enabled
+
+    def _lorenz_expected(self):
+        return self.engine.lorenz_expected and not self.engine.lorenz_acquisition.external
+
+    def _check(self, link, expected, count, is_down):
+        if link.state == "riconnessione":
+            return
+        if not expected:
+            link.state = "inattivo"
+            link.reset()
+            return
+        now = self.engine.clock()
+        if count != link.count:
+            if link.count is not None and link.last_change is not None and count > link.count:
+                interval = (now - link.last_change) / 1e9 / (count - link.count)
+                link.interval = interval if link.interval is None else \
+                    link.interval + INTERVAL_ALPHA * (interval - link.interval)
+            link.count = count
+            link.last_change = now
+            link.state = "ok"
+            return
+        if link.last_change is None:  # Armed: wait for the first sample from now on
+            link.last_change = now
+            return
+        silent = (now - link.last_change) / 1e9
+        if is_down() or silent > self._stall_threshold(link):
+            link.state = "riconnessione"
+            link.thread = threading.Thread(target=self._recover, args=(link, silent), name=f"Recover-{link.name}",
+                                           daemon=True)
+            link.thread.start()
+
+    def _stall_threshold(self, link):
+        if link.interval is None:
+            return max(self.min_stall, 5.0)  # Rate not known yet (e.g. right after enable_data)
+        return max(self.min_stall, self.stall_intervals * link.interval)
+
+    # --- Ripristino ---
+
+    def _recover(self, link, silent):
+        engine = self.engine
+        t0 = time.perf_counter()
+        link.stalls += 1
+        gap_ns = link.last_change
+        engine.log.warning(f"Collegamento {link.name} interrotto: nessun campione da {silent:.1f}s, riconnessione")
+        engine.data_processor.mark_event("gap", link.name, f"nessun campione da {silent:.1f}s", gap_ns)
+        paused = False
+        if self.pause_plan and link.name == "ftms" and engine.is_plan_running() and not engine.is_plan_paused():
+            engine.pause_plan()
+            paused = True
+        reconnect, expected = (self._reconnect_ftms, self._ftms_expected) if link.name == "ftms" \
+            else (self._reconnect_lorenz, self._lorenz_expected)
+        counter = (lambda: engine.ftms_notifications.value) if link.name == "ftms" \
+            else (lambda: engine.lorenz_acquisition.samples)
+        backoff = BACKOFF_INITIAL_S
+        attempts = 0
+        recovered = False
+        try:
+            while not self._stop_event.is_set() and expected():
+                attempts += 1
+                link.attempts += 1
+                count = counter()
+                try:
+                    reconnect()
+                    if self._wait_sample(counter, count, max(5.0, self._stall_threshold(link))):
+                        recovered = True
+                        break
+                    raise TimeoutError("nessun campione dopo la riconnessione")
+                except Exception as e:
+                    engine.log.warning(f"Riconnessione {link.name} fallita (tentativo {attempts}): {e}; "
+                                       f"nuovo tentativo tra {backoff:.0f}s")
+                if self._stop_event.wait(backoff):
+                    break
+                backoff = min(2 * backoff, self.max_backoff)
+            if not recovered:
+                engine.log.info(f"Ripristino {link.name} interrotto dopo {attempts} tentativi")
+                return
+            recovery = time.perf_counter() - t0
+            resume_ns = engine.clock()
+            downtime = (resume_ns - gap_ns) / 1e9
+            if link.name == "ftms":
+                engine.reapply_setpoint()
+            link.recoveries += 1
+            link.recovery_times.append(recovery)
+            link.downtimes.append(downtime)
+            self.recovery_seconds[link.name].observe(recovery)
+            engine.data_processor.mark_event("resume", link.name,
+                                             f"ripristino in {recovery:.2f}s, {attempts} tentativi, "
+                                             f"buco di {downtime:.1f}s", resume_ns)
+            engine.log.info(f"Collegamento {link.name} ripristinato in {recovery:.2f}s ({attempts} tentativi, "
+                            f"dati assenti per {downtime:.1f}s)")
+        finally:
+            if paused:
+                engine.resume_plan()
+            link.reset()
+            link.state = "ok" if recovered else "inattivo"
+
+    def _wait_sample(self, counter, count, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if counter() != count:
+                return True
+            if self._stop_event.wait(0.05):
+                return False
+        return False
+
+    def _on_lane(self, lane, fn):
+        # Reconnections run on the device lane, serialized with the setpoints queued there
+        future = self.engine.dispatcher.submit(lane, fn, priority=PRIORITY_CONTROL, coalesce_key="reconnect")
+        return future.result(timeout=2 * self.connect_timeout + 5)
+
+    def _reconnect_ftms(self):
+        self._on_lane("ftms", self._reconnect_ftms_now)
+
+    def _reconnect_ftms_now(self):
+        engine = self.engine
+        address = engine.ble_address
+        try:
+            engine.worker.run_coroutine(engine.ble_manager.disconnect_device()).result(timeout=5)
+        except Exception as e:
+            engine.log.debug(f"Disconnessione prima della riconnessione: {e}")
+        engine.connect_ble(address, timeout=self.connect_timeout)
+        engine.enable_data().result(timeout=self.connect_timeout)
+
+    def _reconnect_lorenz(self):
+        self._on_lane("lorenz", self._reconnect_lorenz_now)
+
+    def _reconnect_lorenz_now(self):
+        engine = self.engine
+        engine.lorenz_acquisition.stop()
+        with engine.lorenz_acquisition.driver_lock:
+            try:
+                engine.lorenz_reader.close_connection()
+            except Exception as e:
+                engine.log.debug(f"Chiusura Lorenz prima della riconnessione: {e}")
+        if not engine.connect_lorenz():
+            raise ConnectionError("apertura della porta Lorenz fallita")
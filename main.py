@@ -1,14 +1,21 @@
+import argparse
 import logging
 from logging.handlers import RotatingFileHandler
-from gui.main_window import MainWindow, TextHandler
+from logic.startup import STARTUP
+with STARTUP.phase("import gui.main_window"):
+    from gui.main_window import MainWindow, TextHandler
+from logic.data_processing import BACKENDS
+from logic.log_pipeline import JsonFormatter, start_log_listener
+from logic.metrics import MetricsExporter
+from logic.simulators import create_simulated_engine
 
-def setup_logging(text_widget):
+def setup_logging(text_widget, json_logs=False):
     LOG_FILENAME = "app.log"
     log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
-    # Handler per file rotativo
+    # Handler per file rotativo (JSON, una riga per record, se richiesto)
     file_handler = logging.handlers.RotatingFileHandler(LOG_FILENAME, maxBytes=5 * 1024 * 1024, backupCount=3)
-    file_handler.setFormatter(log_formatter)
+    file_handler.setFormatter(JsonFormatter() if json_logs else log_formatter)
 
     # Handler per la console
     console_handler = logging.StreamHandler()
@@ -18,17 +25,37 @@ def setup_logging(text_widget):
     text_handler = TextHandler(text_widget)
     text_handler.setFormatter(log_formatter)
 
-    # Creazione del logger principale
-    logger = logging.getLogger()  # Ottieni il root logger
-    logger.setLevel(logging.INFO)  # Imposta il livello di logging
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    logger.addHandler(text_handler)
+    # Gli handler girano sul thread del listener: chi logga accoda soltanto il record
+    listener = start_log_listener([file_handler, console_handler, text_handler], level=logging.INFO)
 
     # Esempio di log nel main
-    logger.info("Avvio del programma...")
+    logging.getLogger().info("Avvio del programma...")
+    return listener
 
 if __name__ == "__main__":
-    app = MainWindow()
-    setup_logging(app.log_text)
-    app.mainloop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Total Commander")
+    parser.add_argument("--log-json", action="store_true", help="Scrive app.log come JSON, un record per riga")
+    parser.add_argument("--simulate", action="store_true", help="Usa rullo, Lorenz e banco simulati")
+    parser.add_argument("--metrics-file", help="File delle metriche (formato textfile Prometheus, JSON se termina in .json)")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="Intervallo di scrittura delle metriche [s]")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="csv", help="Formato dei file di sessione")
+    parser.add_argument("--pause-plan-on-stall", action="store_true",
+                        help="Mette in pausa il piano mentre il rullo viene riconnesso")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Misura i tempi di import e inizializzazione per fase, li salva in startup_profile.txt ed esce")
+    args = parser.parse_args()
+    with STARTUP.phase("costruzione finestra"):
+        backends = BACKENDS[args.backend]
+        app = MainWindow(engine=create_simulated_engine(backends=backends) if args.simulate else None,
+                         profile_startup=args.profile_startup, backends=backends)
+    app.engine.supervisor.pause_plan = args.pause_plan_on_stall
+    log_listener = setup_logging(app.log_text, json_logs=args.log_json)
+    exporter = None
+    if args.metrics_file:
+        exporter = MetricsExporter([app.engine.metrics], args.metrics_file, args.metrics_interval).start()
+    try:
+        app.mainloop()
+    finally:
+        if exporter is not None:
+            exporter.stop()
+        log_listener.stop()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from logic.analysis import analyze, load_step_starts
+from logic.plan import compile_text
+
+HEADER = "wait;livelli;potenza;simulazione;speed_banco;potenza_lorenz;coppia_lorenz\n"
+NAN = np.nan
+
+
+def power_plan(*steps):
+    """Plan of "potenza" steps, one (wait_s, watts) per row."""
+    return compile_text(HEADER + "".join(f"{wait};;{watts};;;;\n" for wait, watts in steps))
+
+
+def session(t, power, lorenz):
+    t = np.asarray(t, dtype=np.float64)
+    return {"t": t, "ms": t * 10, "power": np.asarray(power, dtype=np.float64),
+            "power_lorenz": np.asarray(lorenz, dtype=np.float64), "torque_lorenz": np.full(len(t), NAN)}
+
+
+def test_steady_steps_report_error_against_lorenz():
+    t = np.arange(0, 10, 0.1)
+    lorenz = np.where(t < 5, 100.0, 200.0)
+    report = analyze(session(t, lorenz + 4, lorenz), power_plan((5, 100), (5, 200)), np.array([0.0, 5.0, 10.0]))
+    assert list(report["samples"]) == [50, 50]
+    assert report["settling_s"] == pytest.approx([0.0, 0.0])
+    assert report["error_mean_w"] == pytest.approx([4.0, 4.0])
+    assert report["target_error"] == pytest.approx([0.0, 0.0])
+
+
+def test_step_without_samples_is_reported_empty():
+    t = np.concatenate((np.arange(0, 4, 0.1), np.arange(6, 10, 0.1)))
+    report = analyze(session(t, np.full(len(t), 150.0), np.full(len(t), 150.0)),
+                     power_plan((4, 150), (2, 150), (4, 150)), np.array([0.0, 4.0, 6.0, 10.0]))
+    assert list(report["samples"]) == [40, 0, 40]
+    assert report["steady_samples"][1] == 0
+    assert np.isnan(report["settling_s"][1]) and np.isnan(report["power_lorenz"][1])
+    assert report["power_lorenz"][[0, 2]] == pytest.approx([150.0, 150.0])
+
+
+def test_step_that_never_settles_has_no_steady_window():
+    t = np.arange(0, 10, 0.1)
+    ramp = 30.0 * t  # Still rising at the end of the step
+    report = analyze(session(t, ramp, ramp), power_plan((10, 300)), np.array([0.0, 10.0]))
+    assert np.isnan(report["settling_s"][0])
+    assert report["steady_samples"][0] == 0
+    assert np.isnan(report["error_mean_w"][0])
+
+
+def test_session_without_lorenz_settles_on_ftms_power():
+    t = np.arange(0, 10, 0.1)
+    power = np.where(t < 1, 50.0, 120.0)
+    report = analyze(session(t, power, np.full(len(t), NAN)), power_plan((10, 120)), np.array([0.0, 10.0]))
+    assert report["settling_s"][0] == pytest.approx(1.0)
+    assert report["steady_samples"][0] == 90
+    assert np.isnan(report["error_mean_w"][0]) and np.isnan(report["target_error"][0])
+
+
+def test_timing_file_that_stops_mid_plan(tmp_path):
+    plan = power_plan((5, 100), (5, 200), (5, 300), (5, 400))
+    (tmp_path / "20240101_120000_plan_timing.csv").write_text(
+        "step;command;value;planned_s;actual_s;dispatched_s;lateness_ms;session_s;wait_s\n"
+        "0;potenza;100;0.0000;0.0100;0.0100;10.000;2.0100;5.0000\n"
+        "1;potenza;200;5.0000;5.0200;5.0200;20.000;7.0200;5.0000\n")
+    starts = load_step_starts(str(tmp_path / "20240101_120000_bike_data_log.csv"), plan)
+    assert starts == pytest.approx([2.01, 7.02, 12.02])
+    t = np.arange(0, 20, 0.1)
+    report = analyze(session(t, np.full(len(t), 100.0), np.full(len(t), 100.0)), plan, starts)
+    assert list(report["step"]) == [0, 1]
+    assert report["duration_s"] == pytest.approx([5.01, 5.0])
+
+
+def test_timing_file_with_steps_missing_from_plan_is_rejected(tmp_path):
+    (tmp_path / "s_plan_timing.csv").write_text("step;command;value;session_s;wait_s\n3;potenza;100;1.0;5.0\n")
+    with pytest.raises(ValueError):
+        load_step_starts(str(tmp_path / "s_bike_data_log.csv"), power_plan((5, 100)))
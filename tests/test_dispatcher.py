@@ -0,0 +1,39 @@
+import threading
+import time
+
+from logic.dispatcher import PRIORITY_CONTROL, CommandLane
+
+
+def blocked_lane():
+    """Lane whose worker is held by a first command until the returned event is set."""
+    lane = CommandLane("test")
+    release, started = threading.Event(), threading.Event()
+    lane.submit(lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    return lane, release
+
+
+def test_coalescing_keeps_only_latest_setpoint_per_key():
+    lane, release = blocked_lane()
+    sent = []
+    futures = [lane.submit(sent.append, level, priority=PRIORITY_CONTROL, coalesce_key="brake")
+               for level in (10, 20, 30)]
+    other = lane.submit(sent.append, "bench", coalesce_key="bench")
+    release.set()
+    assert futures[-1].result(5) is None
+    other.result(5)
+    lane.shutdown()
+    assert sent == [30, "bench"]
+    assert all(future.cancelled() for future in futures[:-1])
+    assert lane.stats()["coalesced"] == 2
+
+
+def test_coalesced_command_wait_starts_at_its_submission():
+    lane, release = blocked_lane()
+    lane.submit(lambda: None, coalesce_key="brake")
+    time.sleep(0.3)
+    latest = lane.submit(lambda: None, coalesce_key="brake")
+    release.set()
+    latest.result(5)
+    lane.shutdown()
+    assert lane.wait_last < 0.2
@@ -0,0 +1,22 @@
+from logic.live_series import LiveSeries
+
+SECOND = 1_000_000_000
+
+
+def test_recent_keeps_min_and_max_of_each_interval():
+    series = LiveSeries(["power"], recent_windows=(60,), recent_slots=60)
+    for i, value in enumerate([10.0, 50.0, 30.0, None]):
+        series.push(5 * SECOND + i * SECOND // 10, {"power": value})
+    points = series.recent(60, 60)["power"]
+    assert [value for _, value in points] == [10.0, 50.0]
+    assert points[0][0] == points[1][0]
+
+
+def test_recent_cost_is_bounded_by_slots_not_samples():
+    series = LiveSeries(["power"], recent_windows=(60,), recent_slots=60)
+    for i in range(200 * 120):  # 2 min a 200 Hz, oltre la finestra
+        series.push(i * SECOND // 200, {"power": float(i % 7)})
+    points = series.recent(60, 30)["power"]
+    assert len(points) <= 2 * 30
+    assert min(t for t, _ in points) >= 60 * SECOND
+    assert {value for _, value in points} == {0.0, 6.0}
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from logic import plan as plan_module
+from logic.plan import PlanError, compile_plan, compile_text
+
+HEADER = "wait;livelli;potenza;simulazione;speed_banco;potenza_lorenz;coppia_lorenz\n"
+
+
+def compile_rows(*rows):
+    return compile_text(HEADER + "\n".join(rows) + "\n")
+
+
+def error_lines(*rows):
+    with pytest.raises(PlanError) as info:
+        compile_rows(*rows)
+    return [line for line, _ in info.value.errors]
+
+
+def test_ramp_split_by_wait():
+    plan = compile_rows("4;;100..200;;;;")
+    assert list(plan) == [("potenza", 100, 1.0, None), ("potenza", 133, 1.0, None),
+                          ("potenza", 167, 1.0, None), ("potenza", 200, 1.0, None)]
+
+
+def test_descending_ramps_with_explicit_steps():
+    plan = compile_rows("3;150..0/3;;;;;", "2;;;;20..10/2;;")
+    assert list(plan) == [("livelli", 150, 1.0, None), ("livelli", 75, 1.0, None), ("livelli", 0, 1.0, None),
+                          (None, None, 1.0, 20.0), (None, None, 1.0, 10.0)]
+
+
+def test_float_ramp_keeps_fractions():
+    plan = compile_rows("2;;;;;;1.5..0.5/2")
+    assert [step[1] for step in plan] == [1.5, 0.5]
+
+
+def test_nested_repeats():
+    plan = compile_rows("ripeti 2", "1;10;;;;;", "repeat 3", "2;;;;5;;", "end", "fine")
+    assert len(plan) == 8
+    assert [step[0] for step in plan] == ["livelli", None, None, None] * 2
+    assert plan.duration == pytest.approx(2 * (1 + 3 * 2))
+
+
+def test_unbalanced_repeat_blocks():
+    assert error_lines("ripeti 2", "1;10;;;;;") == [2]
+    assert error_lines("1;10;;;;;", "fine") == [3]
+
+
+def test_empty_wait_cell_is_a_plan_error():
+    assert error_lines("1;10;;;;;", ";100;;;", "1;20;;;;;") == [3]
+
+
+def test_two_commands_in_one_row():
+    with pytest.raises(PlanError) as info:
+        compile_rows("1;10;200;;;;")
+    assert "più comandi" in info.value.errors[0][1]
+
+
+def test_every_invalid_line_is_reported():
+    assert error_lines("x;10;;;;;", "1;300;;;;;", "1;10;;;;;", "-1;;;;;;") == [2, 3, 5]
+
+
+def test_cache_follows_file_changes(tmp_path):
+    path = tmp_path / "piano.csv"
+    cache_dir = tmp_path / "cache"
+    path.write_text(HEADER + "1;10;;;;;\n")
+    first = compile_plan(str(path), cache_dir=str(cache_dir))
+    assert list(first) == [("livelli", 10, 1.0, None)]
+    assert len(os.listdir(cache_dir)) == 1
+
+    path.write_text(HEADER + "1;20;;;;;\n2;;150;;;;\n")
+    plan_module._memory_cache.clear()
+    second = compile_plan(str(path), cache_dir=str(cache_dir))
+    assert list(second) == [("livelli", 20, 1.0, None), ("potenza", 150, 2.0, None)]
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Unchanged file: loaded back from the disk cache
+    plan_module._memory_cache.clear()
+    assert list(compile_plan(str(path), cache_dir=str(cache_dir))) == list(second)